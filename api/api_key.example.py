@@ -0,0 +1,6 @@
+# Template for the GraphHopper API key module.
+# Copy this file to api_key.py (in the same directory) and fill in your own key;
+# api_key.py is ignored by git, so that your key is not committed.
+# An API key can be obtained from https://www.graphhopper.com/.
+
+API_KEY = 'your-graphhopper-api-key'
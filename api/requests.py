@@ -4,33 +4,104 @@
 # See documentation here: https://docs.graphhopper.com/#section/Explore-our-APIs,
 # specifically: https://docs.graphhopper.com/#operation/postRoute
 # and: https://docs.graphhopper.com/#operation/postMatrix
+# and: https://docs.graphhopper.com/#operation/getGeocode
 
 
+import os
+import sys
 import time
+import threading
+import collections
 
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '..')))
 
-def graphhopper_url(key, service='route'):
+# local imports
+from tools.profiletools import profile_stage
+from tools.profiletools import profile_add
+
+
+class QuotaLimiter(object):
+    # limit the rate of GraphHopper requests, shared between threads
+    # input arguments:
+    # - max_concurrent: maximum number of requests in flight at the same time
+    # - max_per_minute: maximum number of requests started per minute (default: no limit)
+    # note: when a request returns status code 429 (quota exceeded),
+    #       all threads using the same limiter pause until the quota is replenished.
+
+    def __init__(self, max_concurrent=4, max_per_minute=None):
+        self.max_concurrent = max_concurrent
+        self.max_per_minute = max_per_minute
+        self.semaphore = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.timestamps = collections.deque()
+        self.paused_until = 0.
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        self.wait()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.semaphore.release()
+
+    def wait(self):
+        # wait until a new request is allowed
+        waited = 0.
+        while True:
+            with self.lock:
+                now = time.time()
+                delay = self.paused_until - now
+                if self.max_per_minute is not None:
+                    while len(self.timestamps)>0 and self.timestamps[0] <= now-60:
+                        self.timestamps.popleft()
+                    if len(self.timestamps) >= self.max_per_minute:
+                        delay = max(delay, self.timestamps[0]+60-now)
+                if delay <= 0:
+                    self.timestamps.append(now)
+                    if waited > 0: profile_add('api/quota_wait', wall_time=waited)
+                    return
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        # block all new requests for a given number of seconds
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.time()+seconds)
+
+
+# base URL of the GraphHopper API
+# (note: can be overridden per request, e.g. to test against a local stand-in server)
+default_base_url = 'https://graphhopper.com/api/1'
+
+
+def graphhopper_url(key, service='route', base_url=None):
     # make GraphHopper request URL
     # input arguments:
     # - key: GraphHopper API key in str format
     # - service: valid GraphHopper service (e.g. 'route' or 'matrix')
-    url = 'https://graphhopper.com/api/1/{}?key={}'.format(service, key)
+    # - base_url: base URL of the API (default: default_base_url)
+    if base_url is None: base_url = default_base_url
+    url = '{}/{}?key={}'.format(base_url.rstrip('/'), service, key)
     return url
 
 def graphhopper_headers():
     # make GraphHopper request headers
     return {'Content-Type': 'application/json'}
 
-def graphhopper_request(session, json, key, service='route'):
-    # make GraphHopper request and return the result
+def graphhopper_send(send, service='route', limiter=None):
+    # send a GraphHopper request and return the result
     # input arguments:
-    # - session: a requests.Session object
-    # - json: request data in json format
-    # - key: GraphHopper API key in str format
-    # - service: valid GraphHopper service (e.g. 'route' or 'matrix')
-    url = graphhopper_url(key, service=service)
-    headers = graphhopper_headers()
-    r = session.post(url, headers=headers, json=json)
+    # - send: function without arguments that sends the request and returns the response
+    # - service: valid GraphHopper service (only used for profiling and printouts)
+    # - limiter: QuotaLimiter object (optional, use when sending requests from multiple threads)
+    if limiter is None:
+        with profile_stage('api/{}'.format(service)):
+            r = send()
+    else:
+        with limiter, profile_stage('api/{}'.format(service)):
+            r = send()
     # check status code and act accordingly
     if r.status_code==200: return r.json()
     elif r.status_code==429:
@@ -38,10 +109,37 @@ def graphhopper_request(session, json, key, service='route'):
         msg += ' ({}).'.format(r.json()['message'])
         msg += ' Will try again in one minute...'
         print(msg)
-        time.sleep(60)
-        return graphhopper_request(session, json, key, service=service)
+        if limiter is None:
+            time.sleep(60)
+            profile_add('api/quota_wait', wall_time=60)
+        else: limiter.pause(60)
+        return graphhopper_send(send, service=service, limiter=limiter)
     if r.status_code!=200:
         msg = 'WARNING: request returned status code {}.'.format(r.status_code)
         msg += ' Full response:\n{}'.format(r.json())
         print(msg)
     return r.json()
+
+def graphhopper_request(session, json, key, service='route', limiter=None, base_url=None):
+    # make GraphHopper (POST) request and return the result
+    # input arguments:
+    # - session: a requests.Session object
+    # - json: request data in json format
+    # - key: GraphHopper API key in str format
+    # - service: valid GraphHopper service (e.g. 'route' or 'matrix')
+    # - limiter: QuotaLimiter object (optional, use when sending requests from multiple threads)
+    # - base_url: base URL of the API (default: default_base_url)
+    url = graphhopper_url(key, service=service, base_url=base_url)
+    headers = graphhopper_headers()
+    send = lambda: session.post(url, headers=headers, json=json)
+    return graphhopper_send(send, service=service, limiter=limiter)
+
+def graphhopper_get(session, params, key, service='geocode', limiter=None, base_url=None):
+    # make GraphHopper GET request (e.g. for geocoding) and return the result
+    # input arguments:
+    # - session: a requests.Session object
+    # - params: dict with query parameters
+    # - other arguments: see graphhopper_request
+    url = graphhopper_url(key, service=service, base_url=base_url)
+    send = lambda: session.get(url, params=params)
+    return graphhopper_send(send, service=service, limiter=limiter)
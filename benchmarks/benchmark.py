@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+#####################################################
+# Time the main calculation steps on synthetic data #
+#####################################################
+# Usage:
+#   python benchmark.py -o results.json
+#   python benchmark.py -o results-new.json --compare results.json
+# The benchmarks are run on synthetic datasets (see synthetic.py) of several sizes.
+# Each benchmark has a maximum size beyond which it is skipped by default,
+# since some steps scale quadratically (or worse) with the number of points;
+# use --no_size_limits to run all benchmarks at all sizes.
+# With --compare, the results are compared to those of a previous run,
+# and the script exits with a non-zero exit code if any benchmark has become slower
+# by more than the given tolerance.
+
+
+# external imports
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import contextlib
+import subprocess
+import numpy as np
+import pandas as pd
+
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '..')))
+
+# local imports
+from benchmarks.synthetic import make_synthetic_dataset
+from python.distancematrix import get_geodesic_distance_matrix
+from datatools.clustering.cluster_categorical import cluster_categorical
+from datatools.clustering.cluster_distance import cluster_distance
+from tools.tsptools import solve_tsp
+from tools.kmltools import coords_to_kml
+from tools.distance import haversine_array
+
+
+def get_coords(df):
+    # get the coordinates of a dataset as a list of {'lon': longitude, 'lat': latitude}
+    return [{'lon': lon, 'lat': lat} for lon, lat in zip(df['lon'].values, df['lat'].values)]
+
+
+def get_street_distances(df):
+    # get the geodesic distance matrix between the street centers of a dataset
+    # (i.e. a typical input for the shortest path calculation after clustering by street)
+    centers = df.groupby('street', sort=False)[['lat', 'lon']].mean()
+    lat = centers['lat'].values
+    lon = centers['lon'].values
+    return haversine_array(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+
+
+def setup_geodesic_distance_matrix(df):
+    coords = get_coords(df)
+    return lambda: get_geodesic_distance_matrix(coords, verbose=False)
+
+
+def setup_cluster_categorical(df, max_distance=None):
+    return lambda: cluster_categorical(df, column_names=['street'], num_key='num',
+                     lat_key='lat', lon_key='lon', max_distance=max_distance)
+
+
+def setup_cluster_distance(df):
+    return lambda: cluster_distance(df, num_key='num', distance_threshold=50)
+
+
+def setup_solve_tsp(df, method='local'):
+    distances = get_street_distances(df)
+    return lambda: solve_tsp(distances, method=method)
+
+
+def setup_coords_to_kml(df):
+    coords = df[['lon', 'lat']].values
+    return lambda: coords_to_kml(coords)
+
+
+# definition of the benchmarks
+# each benchmark is defined by a setup function, taking a synthetic dataset as input
+# and returning the function to time, and the maximum dataset size to run it on.
+# (note: the shortest path benchmarks run on the street centers,
+#  of which there are about 20 times fewer than entries in the dataset.)
+# (note: the clustering steps do not build full distance matrices,
+#  so they are run up to the largest default size.)
+benchmarks = {
+  'geodesic_distance_matrix': {'setup': setup_geodesic_distance_matrix, 'max_size': 2000},
+  'cluster_categorical': {'setup': setup_cluster_categorical, 'max_size': 100000},
+  'cluster_categorical_max_distance': {
+    'setup': lambda df: setup_cluster_categorical(df, max_distance=100), 'max_size': 100000},
+  'cluster_distance': {'setup': setup_cluster_distance, 'max_size': 100000},
+  'solve_tsp_exact': {'setup': lambda df: setup_solve_tsp(df, method='exact'), 'max_size': 200},
+  'solve_tsp_local': {'setup': lambda df: setup_solve_tsp(df, method='local'), 'max_size': 1000},
+  'solve_tsp_annealing': {'setup': lambda df: setup_solve_tsp(df, method='annealing'), 'max_size': 1000},
+  'solve_tsp_two_opt': {'setup': lambda df: setup_solve_tsp(df, method='two_opt'), 'max_size': 10000},
+  'coords_to_kml': {'setup': setup_coords_to_kml, 'max_size': None}
+}
+
+
+def run_benchmark(function, repeat=3, verbose=False):
+    # time a function
+    # input arguments:
+    # - function: function to time (without arguments)
+    # - repeat: number of repetitions
+    # - verbose: whether to show the printouts of the function
+    #   (if False, they are discarded; note that some functions print progress info)
+    # returns:
+    #   list of wall times (in seconds), one for each repetition
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            with contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+                start = time.perf_counter()
+                function()
+                times.append(time.perf_counter() - start)
+    return times
+
+
+def get_metadata():
+    # get information about the environment in which the benchmarks are run
+    metadata = {
+      'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+      'platform': platform.platform(),
+      'python': platform.python_version(),
+      'numpy': np.__version__,
+      'pandas': pd.__version__,
+      'commit': None
+    }
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=thisdir,
+                   capture_output=True, text=True, check=True)
+        metadata['commit'] = commit.stdout.strip()
+    except Exception: pass
+    return metadata
+
+
+def compare_results(results, reference, tolerance=0.2):
+    # compare benchmark results to reference results
+    # input arguments:
+    # - results, reference: lists of results in the format written by this script
+    # - tolerance: maximum allowed relative increase of the minimum time
+    # returns:
+    #   list of (name, size) of benchmarks that have become slower than the tolerance
+    reference = {(res['name'], res['size']): res for res in reference if res['min'] is not None}
+    regressions = []
+    print('Comparison to reference results:')
+    for res in results:
+        key = (res['name'], res['size'])
+        if res['min'] is None or key not in reference: continue
+        ratio = res['min'] / reference[key]['min']
+        msg = '  - {} (size {}): {:.4f} s -> {:.4f} s ({:.2f}x)'.format(
+                res['name'], res['size'], reference[key]['min'], res['min'], ratio)
+        if ratio > 1 + tolerance:
+            msg += ' WARNING: slower than reference'
+            regressions.append(key)
+        print(msg)
+    return regressions
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser(description='Run benchmarks on synthetic data')
+    parser.add_argument('-o', '--outputfile', default=None, type=os.path.abspath,
+            help='Output .json file to store the results in (default: do not store).')
+    parser.add_argument('--sizes', default=[100, 1000, 10000, 100000], type=int, nargs='+',
+            help='Number of entries of the synthetic datasets (default: 1e2 to 1e5).')
+    parser.add_argument('--benchmarks', default=None, nargs='+', choices=list(benchmarks.keys()),
+            help='Benchmarks to run (default: all).')
+    parser.add_argument('--repeat', default=3, type=int,
+            help='Number of repetitions of each benchmark (default: 3).')
+    parser.add_argument('--no_size_limits', default=False, action='store_true',
+            help='Run all benchmarks at all sizes (default: skip too large sizes).')
+    parser.add_argument('--seed', default=0, type=int,
+            help='Seed for the synthetic datasets (default: 0).')
+    parser.add_argument('--verbose', default=False, action='store_true',
+            help='Show the printouts of the benchmarked functions.')
+    parser.add_argument('--compare', default=None, type=os.path.abspath,
+            help='Output .json file of a previous run to compare to.')
+    parser.add_argument('--tolerance', default=0.2, type=float,
+            help='Maximum allowed relative slowdown w.r.t. the compared run (default: 0.2).')
+    args = parser.parse_args()
+    names = args.benchmarks if args.benchmarks is not None else list(benchmarks.keys())
+
+    # run benchmarks
+    results = []
+    for size in args.sizes:
+        df = make_synthetic_dataset(size, seed=args.seed)
+        for name in names:
+            res = {'name': name, 'size': size, 'times': None, 'min': None, 'median': None}
+            max_size = benchmarks[name]['max_size']
+            if not args.no_size_limits and max_size is not None and size > max_size:
+                print('Skipping {} for size {} (maximum size: {}).'.format(name, size, max_size))
+                res['skipped'] = True
+                results.append(res)
+                continue
+            print('Running {} for size {}...'.format(name, size))
+            sys.stdout.flush()
+            function = benchmarks[name]['setup'](df.copy())
+            times = run_benchmark(function, repeat=args.repeat, verbose=args.verbose)
+            res.update({'times': times, 'min': float(np.min(times)), 'median': float(np.median(times))})
+            print('  min: {:.4f} s, median: {:.4f} s'.format(res['min'], res['median']))
+            results.append(res)
+
+    # write results
+    if args.outputfile is not None:
+        outputdir = os.path.dirname(args.outputfile)
+        if not os.path.exists(outputdir): os.makedirs(outputdir)
+        with open(args.outputfile, 'w') as f:
+            json.dump({'metadata': get_metadata(), 'results': results}, f, indent=2)
+        print('Written results to {}.'.format(args.outputfile))
+
+    # compare to reference
+    if args.compare is not None:
+        with open(args.compare, 'r') as f: reference = json.load(f)['results']
+        regressions = compare_results(results, reference, tolerance=args.tolerance)
+        if len(regressions) > 0:
+            print('Found {} benchmarks slower than the reference.'.format(len(regressions)))
+            sys.exit(1)
@@ -0,0 +1,77 @@
+###############################################
+# Make synthetic tree datasets for benchmarks #
+###############################################
+# The datasets mimic the (filtered) tree databases of the cities in data/:
+# trees are planted in rows along straight streets of random length and orientation,
+# with some jitter, so that clustering by street name or by distance
+# gives clusters of realistic size.
+
+
+# external imports
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+
+# settings of some typical city centers (latitude and longitude in degrees)
+cities = {
+  'gent': (51.05, 3.72),
+  'boston': (42.35, -71.08),
+  'geneve': (46.20, 6.14),
+  'providence': (41.82, -71.41)
+}
+
+
+def make_synthetic_dataset(nrows, city='gent', extent=5000, trees_per_street=20,
+        spacing=10, jitter=3, ntypes=5, seed=0):
+    # make a synthetic dataset of tree locations
+    # input arguments:
+    # - nrows: number of trees
+    # - city: name of the city to center the dataset on (see cities above)
+    # - extent: size of the (square) area covered by the streets (in meter)
+    # - trees_per_street: average number of trees per street
+    # - spacing: average distance between consecutive trees in a street (in meter)
+    # - jitter: standard deviation of the tree positions around the street axis (in meter)
+    # - ntypes: number of distinct tree types
+    # - seed: seed for the random number generator
+    # returns:
+    #   pandas DataFrame with columns lat, lon, street and type
+    rng = np.random.default_rng(seed)
+    (lat0, lon0) = cities[city]
+    nstreets = max(1, int(round(nrows / trees_per_street)))
+    # make streets with a random start point and orientation
+    street_x = rng.uniform(-extent/2, extent/2, size=nstreets)
+    street_y = rng.uniform(-extent/2, extent/2, size=nstreets)
+    street_angle = rng.uniform(0, np.pi, size=nstreets)
+    # assign trees to streets and place them along the street axis
+    street_ids = np.sort(rng.integers(0, nstreets, size=nrows))
+    position = rng.uniform(0, trees_per_street*spacing, size=nrows)
+    x = street_x[street_ids] + position*np.cos(street_angle[street_ids]) + rng.normal(0, jitter, size=nrows)
+    y = street_y[street_ids] + position*np.sin(street_angle[street_ids]) + rng.normal(0, jitter, size=nrows)
+    # convert from meter to degrees
+    r = 6371000 # (in meter)
+    p = np.pi / 180.
+    lat = lat0 + y / (r*p)
+    lon = lon0 + x / (r*p*np.cos(lat0*p))
+    df = pd.DataFrame({'lat': lat, 'lon': lon})
+    df['street'] = np.char.add('street ', street_ids.astype(str))
+    df['type'] = np.char.add('type ', rng.integers(0, ntypes, size=nrows).astype(str))
+    return df
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser(description='Make a synthetic tree dataset')
+    parser.add_argument('-n', '--nrows', required=True, type=int)
+    parser.add_argument('-o', '--outputfile', required=True, type=os.path.abspath)
+    parser.add_argument('--city', default='gent', choices=list(cities.keys()))
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    # make and write dataset
+    df = make_synthetic_dataset(args.nrows, city=args.city, seed=args.seed)
+    df.to_csv(args.outputfile, index=False)
+    print('Written {} synthetic entries to {}.'.format(len(df), args.outputfile))
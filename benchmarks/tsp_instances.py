@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+###################################################
+# Make shortest path benchmark instances from data #
+###################################################
+# Each instance is the geodesic distance matrix between the clustered locations
+# of a city (i.e. the output of data/<city>/process.py), stored in .npz format
+# together with the coordinates.
+# Usage:
+#   python tsp_instances.py
+# (by default, all clustered outputs found in data/ are used;
+#  synthetic instances can be added with --synthetic, e.g. if no clustered outputs are available.)
+
+
+# external imports
+import os
+import sys
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+topdir = os.path.abspath(os.path.join(thisdir, '..'))
+sys.path.append(topdir)
+
+# local imports
+from benchmarks.synthetic import make_synthetic_dataset
+from tools.distance import haversine_array
+
+
+def make_instance(lat, lon):
+    # make a shortest path instance from a set of coordinates
+    # input arguments:
+    # - lat and lon: 1D numpy arrays with latitudes and longitudes
+    # returns:
+    #   dict with the geodesic distance matrix and the coordinates
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    distances = haversine_array(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+    return {'distances': distances, 'lat': lat, 'lon': lon}
+
+
+def save_instance(path, instance):
+    # store an instance in .npz format
+    np.savez(path, **instance)
+
+
+def load_instance(path):
+    # load an instance stored with save_instance
+    # returns:
+    #   dict with the distance matrix and coordinates
+    with np.load(path) as f: return {name: f[name] for name in f.files}
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser(description='Make shortest path benchmark instances')
+    parser.add_argument('-i', '--inputfiles', default=None, nargs='+', type=os.path.abspath,
+            help='Clustered .csv files to make instances from'
+                +' (default: all data/*/data-*-clustered.csv files).')
+    parser.add_argument('-o', '--outputdir', default=os.path.join(thisdir, 'instances'),
+            type=os.path.abspath,
+            help='Directory to store the instances in (default: benchmarks/instances).')
+    parser.add_argument('--lat_key', default='lat')
+    parser.add_argument('--lon_key', default='lon')
+    parser.add_argument('--synthetic', default=[], type=int, nargs='+',
+            help='Number of locations of additional synthetic instances (default: none).')
+    args = parser.parse_args()
+    inputfiles = args.inputfiles
+    if inputfiles is None:
+        inputfiles = sorted(glob.glob(os.path.join(topdir, 'data', '*', 'data-*-clustered.csv')))
+    if len(inputfiles)==0 and len(args.synthetic)==0:
+        msg = 'WARNING: no input files found; run data/<city>/process.py first,'
+        msg += ' or use --synthetic to make synthetic instances.'
+        print(msg)
+    if not os.path.exists(args.outputdir): os.makedirs(args.outputdir)
+
+    # make instances from clustered data
+    for inputfile in inputfiles:
+        df = pd.read_csv(inputfile)
+        instance = make_instance(df[args.lat_key], df[args.lon_key])
+        name = os.path.splitext(os.path.basename(inputfile))[0]
+        outputfile = os.path.join(args.outputdir, name + '.npz')
+        save_instance(outputfile, instance)
+        print('Written instance {} with {} locations.'.format(outputfile, len(df)))
+
+    # make synthetic instances
+    # (note: one location per street of a synthetic dataset, i.e. as if clustered by street)
+    for size in args.synthetic:
+        df = make_synthetic_dataset(size*20, trees_per_street=20)
+        df = df.groupby('street', sort=False)[['lat', 'lon']].mean()
+        instance = make_instance(df['lat'], df['lon'])
+        outputfile = os.path.join(args.outputdir, 'synthetic-{}.npz'.format(len(df)))
+        save_instance(outputfile, instance)
+        print('Written instance {} with {} locations.'.format(outputfile, len(df)))
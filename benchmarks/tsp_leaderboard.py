@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+############################################################
+# Compare shortest path methods in quality versus run time #
+############################################################
+# Each method of tools/tsptools.py is run on each instance (see tsp_instances.py)
+# for a number of time budgets, and the tour length is compared to the best known tour.
+# Usage:
+#   python tsp_leaderboard.py -o leaderboard.json
+# The best known tour length of each instance is stored in best_known.json
+# in the instance directory, and updated whenever a shorter tour is found.
+
+
+# external imports
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import numpy as np
+
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '..')))
+
+# local imports
+from benchmarks.tsp_instances import load_instance
+from tools.tsptools import solve_tsp
+from tools.tsptools import tsp_methods
+from tools.tsptools import time_limited_methods
+
+
+def make_leaderboard(results, best_known, tolerance=0.01):
+    # summarize the results per instance and method
+    # input arguments:
+    # - results: list of dicts with keys instance, method, time_budget, length and time
+    # - best_known: dict mapping instance names to the best known tour length
+    # - tolerance: relative gap to the best known tour that counts as reached
+    # returns:
+    #   list of dicts with keys instance, method, best_length, best_gap, median_gap
+    #   and time_to_tolerance (minimum run time of a run within the tolerance, or None),
+    #   sorted by instance and then by best gap and time
+    leaderboard = []
+    keys = sorted(set([(res['instance'], res['method']) for res in results]))
+    for (instance, method) in keys:
+        runs = [res for res in results if res['instance']==instance and res['method']==method]
+        lengths = np.array([res['length'] for res in runs])
+        times = np.array([res['time'] for res in runs])
+        gaps = lengths / best_known[instance] - 1
+        reached = (gaps <= tolerance + 1e-9)
+        leaderboard.append({
+          'instance': instance,
+          'method': method,
+          'best_length': float(np.min(lengths)),
+          'best_gap': float(np.min(gaps)),
+          'median_gap': float(np.median(gaps)),
+          'time_to_tolerance': float(np.min(times[reached])) if np.any(reached) else None
+        })
+    sortkey = lambda el: (el['instance'], el['best_gap'],
+                el['time_to_tolerance'] if el['time_to_tolerance'] is not None else np.inf)
+    return sorted(leaderboard, key=sortkey)
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser(description='Compare shortest path methods')
+    parser.add_argument('--instancedir', default=os.path.join(thisdir, 'instances'),
+            type=os.path.abspath,
+            help='Directory with instances (default: benchmarks/instances, see tsp_instances.py).')
+    parser.add_argument('-o', '--outputfile', default=None, type=os.path.abspath,
+            help='Output .json file to store the results in (default: do not store).')
+    parser.add_argument('--methods', default=None, nargs='+', choices=list(tsp_methods.keys()),
+            help='Methods to compare (default: all).')
+    parser.add_argument('--time_budgets', default=[0.1, 1, 10], type=float, nargs='+',
+            help='Maximum processing times (in seconds) for the methods that support it'
+                +' (default: 0.1, 1 and 10).')
+    parser.add_argument('--repeat', default=3, type=int,
+            help='Number of runs per method and time budget (default: 3).')
+    parser.add_argument('--max_exact_size', default=12, type=int,
+            help='Maximum number of locations for the exact method (default: 12).')
+    parser.add_argument('--tolerance', default=0.01, type=float,
+            help='Relative gap to the best known tour that counts as reached (default: 0.01).')
+    parser.add_argument('--seed', default=0, type=int,
+            help='Seed for the random number generator (default: 0).')
+    args = parser.parse_args()
+    methods = args.methods if args.methods is not None else list(tsp_methods.keys())
+
+    # load instances and best known tour lengths
+    instancefiles = sorted(glob.glob(os.path.join(args.instancedir, '*.npz')))
+    if len(instancefiles)==0:
+        raise Exception('No instances found in {}; run tsp_instances.py first.'.format(args.instancedir))
+    instances = {os.path.splitext(os.path.basename(f))[0]: load_instance(f) for f in instancefiles}
+    best_known_file = os.path.join(args.instancedir, 'best_known.json')
+    best_known = {}
+    if os.path.exists(best_known_file):
+        with open(best_known_file, 'r') as f: best_known = json.load(f)
+
+    # run all methods on all instances
+    # (note: python_tsp uses the global numpy random state, so it is seeded for each run)
+    results = []
+    for name, instance in instances.items():
+        distances = instance['distances']
+        for method in methods:
+            if method=='exact' and len(distances) > args.max_exact_size:
+                print('Skipping method exact for instance {} ({} locations).'.format(name, len(distances)))
+                continue
+            time_budgets = args.time_budgets if method in time_limited_methods else [None]
+            for time_budget in time_budgets:
+                for run in range(args.repeat):
+                    np.random.seed(args.seed + run)
+                    start = time.perf_counter()
+                    (_, length) = solve_tsp(distances, method=method, max_processing_time=time_budget)
+                    runtime = time.perf_counter() - start
+                    results.append({'instance': name, 'method': method, 'time_budget': time_budget,
+                                    'run': run, 'length': float(length), 'time': runtime})
+                    msg = 'Instance {}, method {}, time budget {}, run {}:'.format(
+                            name, method, time_budget, run)
+                    msg += ' length {:.1f}, time {:.3f} s'.format(length, runtime)
+                    print(msg)
+                    sys.stdout.flush()
+            # update best known tour length
+            lengths = [res['length'] for res in results if res['instance']==name]
+            if name not in best_known or min(lengths) < best_known[name]:
+                best_known[name] = min(lengths)
+    with open(best_known_file, 'w') as f: json.dump(best_known, f, indent=2)
+
+    # make and print leaderboard
+    leaderboard = make_leaderboard(results, best_known, tolerance=args.tolerance)
+    print('Leaderboard:')
+    for instance in instances.keys():
+        print('  Instance {} (best known: {:.1f}):'.format(instance, best_known[instance]))
+        for entry in [el for el in leaderboard if el['instance']==instance]:
+            time_to_tolerance = entry['time_to_tolerance']
+            time_to_tolerance = '{:.3f} s'.format(time_to_tolerance) if time_to_tolerance is not None else 'never'
+            msg = '    - {}: best gap {:.2f}%, median gap {:.2f}%,'.format(
+                    entry['method'], entry['best_gap']*100, entry['median_gap']*100)
+            msg += ' time to within {}%: {}'.format(args.tolerance*100, time_to_tolerance)
+            print(msg)
+
+    # write results
+    if args.outputfile is not None:
+        outputdir = os.path.dirname(args.outputfile)
+        if not os.path.exists(outputdir): os.makedirs(outputdir)
+        with open(args.outputfile, 'w') as f:
+            json.dump({'best_known': best_known, 'results': results, 'leaderboard': leaderboard}, f, indent=2)
+        print('Written results to {}.'.format(args.outputfile))
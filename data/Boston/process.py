@@ -7,6 +7,7 @@
 
 import os
 import sys
+import functools
 import pandas as pd
 
 # set path for local imports
@@ -14,7 +15,8 @@ thisdir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.abspath(os.path.join(thisdir, '../..')))
 
 # local imports
-from datatools.filtering.filter import filter_dataset
+from datatools.parsing.ingest import read_dataset
+from datatools.parsing.cache import load_cached
 from datatools.clustering.cluster_categorical import cluster_categorical
 from datatools.parsing.parse import parse
 from datatools.selection.select_square import select_square
@@ -29,6 +31,8 @@ if __name__=='__main__':
       'parks': os.path.abspath(os.path.join(thisdir, 'raw/treekeeper_parks_trees.csv'))
     }
     outputfile = 'data-boston-{}.csv'
+    hover_columns = ['treetype', 'street', 'num']
+    plotfiles = None # e.g. 'data-boston-{}.png' to write the plots to files instead of showing them
     treetype_key = 'spp_bot'
     rename = {
       'spp_bot': 'treetype',
@@ -40,21 +44,22 @@ if __name__=='__main__':
     filters = [
       os.path.abspath(os.path.join(thisdir, 'filters/treetype_filter.json'))
     ]
+    columns = list(rename.keys())
+    dtype = {'y_latitude': 'float64', 'x_longitude': 'float64'}
+    chunksize = 100000
+    cachedir = None # e.g. os.path.join(thisdir, 'cache') to cache the full parsed raw file (see load_cached)
 
     # load input files
     datasets = []
-    for dtype, inputfile in inputfiles.items():
-        
-        dataset = pd.read_csv(inputfile)
-        print('Loaded dataset {}'.format(inputfile))
-        print('Number of entries: {}'.format(len(dataset)))
-        print('Column names:')
-        print(dataset.columns.values)
-
-        # filter
-        dataset_filtered = filter_dataset(dataset, filters, verbose=True)
-
-        # parse
+    for inputfile in inputfiles.values():
+        # load input file from cache, or read it in chunks with filters
+        # (note: columns that are not present in a file are ignored)
+        parse_function = functools.partial(read_dataset, inputfile, columns=columns, dtype=dtype,
+                           chunksize=chunksize, verbose=True)
+        dataset_filtered = load_cached(inputfile, parse_function,
+                             params={'columns': columns, 'dtype': dtype},
+                             cachedir=cachedir, filters=filters,
+                             float32_columns=['y_latitude', 'x_longitude'], verbose=True)
         dataset_filtered = parse(dataset_filtered, rename=rename)
         datasets.append(dataset_filtered)
 
@@ -69,16 +74,14 @@ if __name__=='__main__':
     # plotting (filtered)
     lat = dataset_filtered['lat']
     lon = dataset_filtered['lon']
-    extra_info = {}
-    for key, val in dataset_filtered.items(): extra_info[key] = val.values
-    plot_locations(lat, lon, extra_info=extra_info)
+    plotfile = plotfiles.format('filtered') if plotfiles is not None else None
+    plot_locations(lat, lon, extra_info=dataset_filtered, hover_columns=hover_columns, outputfile=plotfile)
 
     # plotting (clustered)
     lat = dataset_clustered['lat']
     lon = dataset_clustered['lon']
-    extra_info = {}
-    for key, val in dataset_clustered.items(): extra_info[key] = val.values
-    plot_locations(lat, lon, extra_info=extra_info)
+    plotfile = plotfiles.format('clustered') if plotfiles is not None else None
+    plot_locations(lat, lon, extra_info=dataset_clustered, hover_columns=hover_columns, outputfile=plotfile)
 
     # save output files
     dataset_filtered.to_csv(outputfile.format('filtered'), index=False)
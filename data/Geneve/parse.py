@@ -5,28 +5,21 @@
 
 import os
 import sys
-import pyproj
 import argparse
 import pandas as pd
 import numpy as np
 
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '../..')))
+
+# local imports
+from datatools.parsing.coordinates import add_latlon
+
 
 def parse_coords(dataset):
     # parse tree coordinates
-    # the latitude and longitude are stored in some weird custom coordinate system;
+    # the latitude and longitude are stored in some weird custom coordinate system
+    # (the Swiss EPSG:2056 system, with easting E and northing N);
     # need to convert using pyproj package
-    lats = np.zeros(len(dataset))
-    lons = np.zeros(len(dataset))
-    ns = dataset['N'].values
-    es = dataset['E'].values
-    transformer = pyproj.Transformer.from_crs("EPSG:2056", "EPSG:4326", always_xy=True)
-    for idx in range(len(dataset)):
-        n = ns[idx]
-        e = es[idx]
-        lon, lat = transformer.transform(e, n)
-        lats[idx] = lat
-        lons[idx] = lon
-    dataset['lat'] = lats
-    dataset['lon'] = lons
-
-    return dataset
+    return add_latlon(dataset, 'E', 'N', 'EPSG:2056')
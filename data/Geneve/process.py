@@ -7,6 +7,7 @@
 
 import os
 import sys
+import functools
 import pandas as pd
 
 # set path for local imports
@@ -14,7 +15,8 @@ thisdir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.abspath(os.path.join(thisdir, '../..')))
 
 # local imports
-from datatools.filtering.filter import filter_dataset
+from datatools.parsing.ingest import read_dataset
+from datatools.parsing.cache import load_cached
 from datatools.clustering.cluster_distance import cluster_distance
 from datatools.parsing.parse import parse
 from datatools.selection.select_square import select_square
@@ -30,26 +32,27 @@ if __name__=='__main__':
     thisdir = os.path.dirname(os.path.abspath(__file__))
     inputfile = os.path.abspath(os.path.join(thisdir, 'raw/SIPV_ICA_ARBRE_ISOLE.csv'))
     outputfile = 'data-geneve-{}.csv'
+    hover_columns = ['treetype', 'num']
+    plotfiles = None # e.g. 'data-geneve-{}.png' to write the plots to files instead of showing them
     filters = [
       os.path.abspath(os.path.join(thisdir, 'filters/treetype_filter.json'))
     ]
     rename = {
       "NOM_COMPLET": "treetype"
     }
+    columns = ['N', 'E'] + list(rename.keys())
+    dtype = {'N': 'float64', 'E': 'float64'}
+    chunksize = 100000
+    cachedir = None # e.g. os.path.join(thisdir, 'cache') to cache the full parsed raw file (see load_cached)
     clustering_distance_threshold = 100
 
-    # load input file
-    dataset = pd.read_csv(inputfile, sep=';')
-    print('Loaded dataset {}'.format(inputfile))
-    print('Number of entries: {}'.format(len(dataset)))
-    print('Column names:')
-    print(dataset.columns.values)
-
-    # filter
-    dataset_filtered = filter_dataset(dataset, filters, verbose=True)
-
-    # parse
-    dataset_filtered = parse_coords(dataset_filtered)
+    # load parsed input file from cache, or read it in chunks with filters and parse it
+    parse_function = functools.partial(read_dataset, inputfile, columns=columns, dtype=dtype,
+                       steps=[parse_coords], chunksize=chunksize, sep=';', verbose=True)
+    dataset_filtered = load_cached(inputfile, parse_function,
+                         params={'columns': columns, 'dtype': dtype, 'steps': ['parse_coords']},
+                         cachedir=cachedir, columns=list(rename.keys()) + ['lat', 'lon'],
+                         filters=filters, verbose=True)
     dataset_filtered = parse(dataset_filtered, rename=rename)
 
     # select region of interest
@@ -69,23 +72,20 @@ if __name__=='__main__':
     # plotting (filtered)
     lat = dataset_filtered['lat']
     lon = dataset_filtered['lon']
-    extra_info = {}
-    for key, val in dataset_filtered.items(): extra_info[key] = val.values
-    plot_locations(lat, lon, extra_info=extra_info)
+    plotfile = plotfiles.format('filtered') if plotfiles is not None else None
+    plot_locations(lat, lon, extra_info=dataset_filtered, hover_columns=hover_columns, outputfile=plotfile)
 
     # plotting (selected)
     lat = dataset_selected['lat']
     lon = dataset_selected['lon']
-    extra_info = {}
-    for key, val in dataset_selected.items(): extra_info[key] = val.values
-    plot_locations(lat, lon, extra_info=extra_info)
+    plotfile = plotfiles.format('selected') if plotfiles is not None else None
+    plot_locations(lat, lon, extra_info=dataset_selected, hover_columns=hover_columns, outputfile=plotfile)
 
     # plotting (clustered)
     lat = dataset_clustered['lat']
     lon = dataset_clustered['lon']
-    extra_info = {}
-    for key, val in dataset_clustered.items(): extra_info[key] = val.values
-    plot_locations(lat, lon, extra_info=extra_info)
+    plotfile = plotfiles.format('clustered') if plotfiles is not None else None
+    plot_locations(lat, lon, extra_info=dataset_clustered, hover_columns=hover_columns, outputfile=plotfile)
 
     # save output files
     dataset_filtered.to_csv(outputfile.format('filtered'), index=False)
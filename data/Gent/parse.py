@@ -3,22 +3,21 @@
 ###############################################
 
 
+import os
+import sys
 import numpy as np
 
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '../..')))
+
+# local imports
+from datatools.parsing.coordinates import add_latlon_from_text
+
 
 def parse_coords(dataset):
 
     # write tree coordinates in a more conventional notation
-    geo_points = dataset['geo_point_2d']
-    lats = np.zeros(len(dataset))
-    lons = np.zeros(len(dataset))
-    for idx, geo_point in enumerate(geo_points):
-        temp = geo_point.split(',')
-        lat = float(temp[0])
-        lon = float(temp[1])
-        lats[idx] = lat
-        lons[idx] = lon
-    dataset['lat'] = lats
-    dataset['lon'] = lons
-
-    return dataset
+    # (note: they are stored as "latitude, longitude" in a single column;
+    #  entries that cannot be parsed are removed, with a warning.)
+    return add_latlon_from_text(dataset, 'geo_point_2d', pattern='pair', drop_invalid=True)
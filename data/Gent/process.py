@@ -7,6 +7,7 @@
 
 import os
 import sys
+import functools
 import pandas as pd
 
 # set path for local imports
@@ -14,7 +15,8 @@ thisdir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.abspath(os.path.join(thisdir, '../..')))
 
 # local imports
-from datatools.filtering.filter import filter_dataset
+from datatools.parsing.ingest import read_dataset
+from datatools.parsing.cache import load_cached
 from datatools.clustering.cluster_categorical import cluster_categorical
 from datatools.parsing.parse import parse
 from tools.plottools import plot_locations
@@ -30,6 +32,8 @@ if __name__=='__main__':
     inputfile = os.path.abspath(os.path.join(thisdir, 'raw/locaties-bomen-gent-full.csv'))
     sep = ';'
     outputfile = 'data-gent-{}.csv'
+    hover_columns = ['type', 'street', 'area', 'num']
+    plotfiles = None # e.g. 'data-gent-{}.png' to write the plots to files instead of showing them
     filters = [
       os.path.abspath(os.path.join(thisdir, 'filters/treetype_filter.json')),
       os.path.abspath(os.path.join(thisdir, 'filters/location_filter.json'))
@@ -39,19 +43,17 @@ if __name__=='__main__':
       'straatnaam': 'street',
       'onderhoudsgebied': 'area'
     }
-
-    # load input file
-    dataset = pd.read_csv(inputfile, sep=sep)
-    print('Loaded dataset {}'.format(inputfile))
-    print('Number of entries: {}'.format(len(dataset)))
-    print('Column names:')
-    print(dataset.columns.values)
-
-    # filter
-    dataset_filtered = filter_dataset(dataset, filters, verbose=True)
-
-    # parse
-    dataset_filtered = parse_coords(dataset_filtered)
+    columns = ['geo_point_2d'] + list(rename.keys())
+    chunksize = 100000
+    cachedir = None # e.g. os.path.join(thisdir, 'cache') to cache the full parsed raw file (see load_cached)
+
+    # load parsed input file from cache, or read it in chunks with filters and parse it
+    parse_function = functools.partial(read_dataset, inputfile, columns=columns,
+                       steps=[parse_coords], chunksize=chunksize, sep=sep, verbose=True)
+    dataset_filtered = load_cached(inputfile, parse_function,
+                         params={'columns': columns, 'sep': sep, 'steps': ['parse_coords']},
+                         cachedir=cachedir, columns=list(rename.keys()) + ['lat', 'lon'],
+                         filters=filters, verbose=True)
     dataset_filtered = parse(dataset_filtered, rename=rename)
 
     # cluster
@@ -61,16 +63,14 @@ if __name__=='__main__':
     # plotting (filtered)
     lat = dataset_filtered['lat']
     lon = dataset_filtered['lon']
-    extra_info = {}
-    for key, val in dataset_filtered.items(): extra_info[key] = val.values
-    plot_locations(lat, lon, extra_info=extra_info)
+    plotfile = plotfiles.format('filtered') if plotfiles is not None else None
+    plot_locations(lat, lon, extra_info=dataset_filtered, hover_columns=hover_columns, outputfile=plotfile)
 
     # plotting (clustered)
     lat = dataset_clustered['lat']
     lon = dataset_clustered['lon']
-    extra_info = {}
-    for key, val in dataset_clustered.items(): extra_info[key] = val.values
-    plot_locations(lat, lon, extra_info=extra_info)
+    plotfile = plotfiles.format('clustered') if plotfiles is not None else None
+    plot_locations(lat, lon, extra_info=dataset_clustered, hover_columns=hover_columns, outputfile=plotfile)
 
     # save output files
     dataset_filtered.to_csv(outputfile.format('filtered'), index=False)
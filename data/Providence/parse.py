@@ -9,37 +9,19 @@ import argparse
 import pandas as pd
 import numpy as np
 
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '../..')))
 
-def parse_coords(dataset):
+# local imports
+from datatools.parsing.coordinates import add_latlon_from_text
 
-    # get the coordinates
-    addresses = dataset['Property Address']
-    lats = np.zeros(len(dataset))
-    lons = np.zeros(len(dataset))
-    mask = np.ones(len(dataset)).astype(bool)
-    nwarnings = 0
-    for idx, address in enumerate(addresses):
-        try:
-            temp = address.split('(')[1].strip(' \n\t()')
-            temp = temp.split(',')
-            lat = float(temp[0].strip(' '))
-            lon = float(temp[1].strip(' '))
-        except:
-            msg = 'WARNING: could not parse the coordinates'
-            msg += f' for address "{address}".'
-            print(msg)
-            # do do: use graphhopper api to find coordinates
-            nwarnings += 1
-            lat = None
-            lon = None
-            mask[idx] = False
-        lats[idx] = lat
-        lons[idx] = lon
-    msg = 'WARNING: could not parse the coordinates'
-    msg += f' for {nwarnings} out of {len(dataset)} entries.'
-    print(msg)
-    dataset['lat'] = lats
-    dataset['lon'] = lons
-    dataset = dataset[mask]
 
-    return dataset
+def parse_coords(dataset, drop_invalid=True):
+
+    # get the coordinates
+    # (note: they are stored at the end of the address between parentheses;
+    #  entries without coordinates are removed, unless drop_invalid is False,
+    #  in which case they get NaN coordinates, e.g. to find them with python/geocode.py.)
+    return add_latlon_from_text(dataset, 'Property Address', pattern='parentheses',
+             drop_invalid=drop_invalid)
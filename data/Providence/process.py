@@ -7,6 +7,7 @@
 
 import os
 import sys
+import functools
 import pandas as pd
 
 # set path for local imports
@@ -14,7 +15,8 @@ thisdir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.abspath(os.path.join(thisdir, '../..')))
 
 # local imports
-from datatools.filtering.filter import filter_dataset
+from datatools.parsing.ingest import read_dataset
+from datatools.parsing.cache import load_cached
 from datatools.clustering.cluster_categorical import cluster_categorical
 from datatools.parsing.parse import parse
 from datatools.selection.select_square import select_square
@@ -30,6 +32,8 @@ if __name__=='__main__':
     thisdir = os.path.dirname(os.path.abspath(__file__))
     inputfile = os.path.abspath(os.path.join(thisdir, 'raw/Providence_Tree_Inventory_20250118.csv'))
     outputfile = 'data-providence-{}.csv'
+    hover_columns = ['type', 'street', 'num']
+    plotfiles = None # e.g. 'data-providence-{}.png' to write the plots to files instead of showing them
     filters = [
       os.path.abspath(os.path.join(thisdir, 'filters/treetype_filter.json'))
     ]
@@ -37,20 +41,35 @@ if __name__=='__main__':
       'Species': 'type',
       'On Street': 'street',
     }
+    address_key = 'Property Address'
+    columns = [address_key] + list(rename.keys())
+    chunksize = 100000
+    cachedir = None # e.g. os.path.join(thisdir, 'cache') to cache the full parsed raw file (see load_cached)
+    geocode = False # find the coordinates of entries without coordinates in their address
+                    # (note: requires a GraphHopper API key, and makes requests for all addresses
+                    #  that are not yet in the geocoding cache; if False, these entries are dropped)
+    geocode_cachefile = os.path.join(thisdir, 'cache/geocode.json')
+    center = {'lat': 41.82, 'lon': -71.41} # geocoding results near this point are preferred
     max_cluster_distance = 100
 
-    # load input file
-    dataset = pd.read_csv(inputfile)
-    print('Loaded dataset {}'.format(inputfile))
-    print('Number of entries: {}'.format(len(dataset)))
-    print('Column names:')
-    print(dataset.columns.values)
-
-    # filter
-    dataset_filtered = filter_dataset(dataset, filters, verbose=True)
-
-    # parse
-    dataset_filtered = parse_coords(dataset_filtered)
+    # load parsed input file from cache, or read it in chunks with filters and parse it
+    # (note: entries without coordinates are kept, with NaN coordinates)
+    parse_function = functools.partial(read_dataset, inputfile, columns=columns,
+                       steps=[functools.partial(parse_coords, drop_invalid=False)],
+                       chunksize=chunksize, verbose=True)
+    dataset_filtered = load_cached(inputfile, parse_function,
+                         params={'columns': columns, 'steps': ['parse_coords(drop_invalid=False)']},
+                         cachedir=cachedir, columns=columns + ['lat', 'lon'],
+                         filters=filters, verbose=True)
+
+    # find coordinates of entries without coordinates in their address
+    # (note: only done after filtering, to limit the number of requests;
+    #  the geocoding module is only imported if needed, since it requires an API key.)
+    if geocode:
+        from python.geocode import add_missing_coords
+        dataset_filtered = add_missing_coords(dataset_filtered, address_key,
+                             cachefile=geocode_cachefile, point=center)
+    else: dataset_filtered = dataset_filtered[dataset_filtered['lat'].notna()]
     dataset_filtered = parse(dataset_filtered, rename=rename)
 
     # select region of interest
@@ -69,23 +88,20 @@ if __name__=='__main__':
     # plotting (filtered)
     lat = dataset_filtered['lat']
     lon = dataset_filtered['lon']
-    extra_info = {}
-    for key, val in dataset_filtered.items(): extra_info[key] = val.values
-    plot_locations(lat, lon, extra_info=extra_info)
+    plotfile = plotfiles.format('filtered') if plotfiles is not None else None
+    plot_locations(lat, lon, extra_info=dataset_filtered, hover_columns=hover_columns, outputfile=plotfile)
 
     # plotting (selected)
     lat = dataset_selected['lat']
     lon = dataset_selected['lon']
-    extra_info = {}
-    for key, val in dataset_selected.items(): extra_info[key] = val.values
-    plot_locations(lat, lon, extra_info=extra_info)
+    plotfile = plotfiles.format('selected') if plotfiles is not None else None
+    plot_locations(lat, lon, extra_info=dataset_selected, hover_columns=hover_columns, outputfile=plotfile)
 
     # plotting (clustered)
     lat = dataset_clustered['lat']
     lon = dataset_clustered['lon']
-    extra_info = {}
-    for key, val in dataset_clustered.items(): extra_info[key] = val.values
-    plot_locations(lat, lon, extra_info=extra_info)
+    plotfile = plotfiles.format('clustered') if plotfiles is not None else None
+    plot_locations(lat, lon, extra_info=dataset_clustered, hover_columns=hover_columns, outputfile=plotfile)
 
     # save output files
     dataset_filtered.to_csv(outputfile.format('filtered'), index=False)
@@ -9,9 +9,10 @@
 import os
 import sys
 import argparse
-import itertools
+import functools
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 # set path for local imports
 thisdir = os.path.dirname(os.path.abspath(__file__))
@@ -20,7 +21,7 @@ sys.path.append(topdir)
 
 # local imports
 from datatools.clustering.clustertools import split_cluster_by_max_distance
-from datatools.clustering.cluster_dataset import cluster_parts
+from datatools.clustering.cluster_dataset import cluster_by_indices
 
 
 def cluster_categorical(
@@ -30,6 +31,7 @@ def cluster_categorical(
         lat_key = None,
         lon_key = None,
         max_distance = None,
+        max_workers = 1,
         verbose = False):
     '''
     Cluster a dataframe by categorical values in specified columns.
@@ -44,6 +46,8 @@ def cluster_categorical(
       used to determine the geographical cluster center.
     - max_distance: maximum distance between two instances in a cluster;
       bigger clusters will be split despite sharing the same categorical values.
+    - max_workers: number of processes for splitting clusters by max_distance
+      (default: 1, i.e. no parallel processing).
     '''
 
     # check provided column names
@@ -58,10 +62,16 @@ def cluster_categorical(
             msg = f'Column {column_name} not found in provided dataframe.'
             raise Exception(msg)
 
-    # find values for each of the columns that are present in the dataframe
+    # find values for each of the columns that are present in the dataframe,
+    # and encode each entry by the (sorted) index of its value in each column
     column_values = {}
+    column_codes = {}
     for column_name in column_names:
-        column_values[column_name] = sorted(list(set(df[column_name].values.astype(str))))
+        # (note: missing values are converted to the str 'nan' and treated as a value)
+        strvalues = np.asarray(df[column_name].values, dtype=object).astype(str)
+        (codes, values) = pd.factorize(strvalues, sort=True)
+        column_values[column_name] = values
+        column_codes[column_name] = codes
     if verbose:
         print('INFO in cluster_categorical: found following number of potential categories:')
         ncat = 1
@@ -73,15 +83,13 @@ def cluster_categorical(
         sys.stderr.flush()
 
     # split the data based on combination of values for each of the columns
-    categories = []
-    column_values_raw = [v for v in column_values.values()]
-    for idx, value_combo in enumerate(itertools.product(*column_values_raw)):
-        mask = np.ones(len(df)).astype(bool)
-        for column_name, column_value in zip(column_names, value_combo):
-            mask = ((mask) & (df[column_name].values.astype(str)==column_value))
-        if np.sum(mask.astype(int))==0: continue
-        part = df[mask]
-        categories.append(part)
+    # (note: only combinations that occur in the data are considered;
+    #  the categories are ordered by the sorted values of the first column,
+    #  then of the second column, etc., and the entries in each category keep their order.)
+    group_ids = pd.DataFrame(column_codes).groupby(column_names, sort=True).ngroup().values
+    order = np.argsort(group_ids, kind='stable')
+    counts = np.bincount(group_ids)
+    categories = np.split(order, np.cumsum(counts)[:-1])
     if verbose:
         print(f'INFO in cluster_categorical: found {len(categories)} effective categories.')
 
@@ -96,25 +104,29 @@ def cluster_categorical(
             
     # perform additional splitting based on the maximum distance within each cluster
     if max_distance is not None and max_distance > 0:
+        # get coordinates of each cluster as arrays of [lon, lat] points
+        lon = df[lon_key].values.astype(float)
+        lat = df[lat_key].values.astype(float)
+        coordsets = [np.column_stack((lon[ids], lat[ids])) for ids in categories]
+        # get indices of subclusters for each cluster
+        split = functools.partial(split_cluster_by_max_distance, max_distance=max_distance)
+        if max_workers is not None and max_workers > 1:
+            chunksize = max(1, int(len(coordsets)/(4*max_workers)))
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                subcluster_sets = list(executor.map(split, coordsets, chunksize=chunksize))
+        else: subcluster_sets = [split(coords) for coords in coordsets]
+        # add parts to total
         newcategories = []
-        # loop over clusters
-        for category in categories:
-            # get coordinates in suitable format
-            lats = category[lat_key].astype(float)
-            lons = category[lon_key].astype(float)
-            coords = [{'lon': lon, 'lat': lat} for lon, lat in zip(lons, lats)]
-            # get indices of subclusters and add parts to total
-            subcluster_sets = split_cluster_by_max_distance(coords, max_distance=max_distance)
-            for subcluster_ids in subcluster_sets:
-                newcategory = category.iloc[subcluster_ids]
-                newcategories.append(newcategory)
+        for ids, subclusters in zip(categories, subcluster_sets):
+            for subcluster_ids in subclusters: newcategories.append(ids[subcluster_ids])
         categories = newcategories
         if verbose:
             print('INFO in cluster_categorical: splitting clusters by distance threshold'
                   + f' resulted in {len(categories)} clusters.')
 
     # make the cluster centers
-    centers = cluster_parts(categories, lat_key=lat_key, lon_key=lon_key, num_key=num_key)
+    # (note: categories are lists of indices, so the dataframe is not split into parts)
+    centers = cluster_by_indices(df, categories, lat_key=lat_key, lon_key=lon_key, num_key=num_key)
     return centers
 
 
@@ -130,6 +142,7 @@ if __name__=='__main__':
     parser.add_argument('--lon_key', default='lon')
     parser.add_argument('--num_key', default='num')
     parser.add_argument('--max_distance', default=-1, type=float)
+    parser.add_argument('--max_workers', default=1, type=int)
     args = parser.parse_args()
     print('Running with following configuration:')
     for arg in vars(args): print(f'  - {arg}: {getattr(args, arg)}')
@@ -149,6 +162,7 @@ if __name__=='__main__':
       lon_key=args.lon_key,
       num_key=args.num_key,
       max_distance=args.max_distance,
+      max_workers=args.max_workers,
       verbose=True
     )
 
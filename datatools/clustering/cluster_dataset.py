@@ -1,17 +1,32 @@
 ##################################
 # Tools for clustering a dataset #
 ##################################
+# The clusters are represented by an array of cluster labels (one per entry),
+# and all cluster centers are calculated at once with grouped array operations.
 
 import os
 import sys
 import numpy as np
 import pandas as pd
 
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+topdir = os.path.abspath(os.path.join(thisdir, '../..'))
+sys.path.append(topdir)
+
+# local imports
+from tools.distance import haversine_array
+
+
+# supported methods to calculate the cluster centers
+center_methods = ['mean', 'weighted', 'medoid']
+
 
 def make_cluster_center(cluster, lat_key='lat', lon_key='lon', num_key='num'):
     # compress a given dataset (assumed to represent a single cluster)
     # into a single entry (representing the center of the cluster)
-    
+    # (note: for many clusters, use aggregate_clusters instead)
+
     # copy first element of cluster
     center = cluster.iloc[[0]].copy()
     # average coordinates over cluster
@@ -26,23 +41,103 @@ def make_cluster_center(cluster, lat_key='lat', lon_key='lon', num_key='num'):
     return center
 
 
-def cluster_parts(parts, **kwargs):
-    centers = []
-    for part in parts:
-        centers.append(make_cluster_center(part, **kwargs))
-    centers = pd.concat(centers, ignore_index=True)
+def aggregate_clusters(dataset, cluster_labels, first_ids=None,
+        lat_key='lat', lon_key='lon', num_key='num',
+        center='mean', weight_key=None):
+    # compress each cluster of a dataset into a single entry
+    # input arguments:
+    # - dataset: pandas DataFrame
+    # - cluster_labels: 1D numpy array with a cluster label for each entry,
+    #   where the labels are integers from 0 to the number of clusters - 1
+    #   (entries with a negative label are not part of any cluster)
+    # - first_ids: 1D numpy array with for each cluster the index of the entry
+    #   of which the attributes are copied (default: the first entry of each cluster)
+    # - lat_key, lon_key: name of the columns with latitude and longitude coordinates
+    #   (if None, the coordinates are not modified)
+    # - num_key: name of a new column with the number of entries in each cluster
+    #   (if None, no such column is added)
+    # - center: method to calculate the cluster center, choose from:
+    #   - 'mean': average coordinates of all entries in the cluster.
+    #   - 'weighted': average coordinates weighted by the column weight_key.
+    #   - 'medoid': coordinates of the entry nearest to the average coordinates.
+    # - weight_key: name of the column with weights (only for center='weighted')
+    # returns:
+    #   pandas DataFrame with one entry per cluster (ordered by label)
+    if center not in center_methods:
+        msg = f'Center method {center} not recognized; choose from {center_methods}.'
+        raise Exception(msg)
+    if center=='weighted' and weight_key is None:
+        raise Exception('Center method weighted requires a weight_key.')
+
+    # get entries that belong to a cluster, sorted by label
+    cluster_labels = np.asarray(cluster_labels, dtype=int)
+    ids = np.nonzero(cluster_labels >= 0)[0]
+    labels = cluster_labels[ids]
+    nclusters = int(np.max(labels)) + 1 if len(labels) > 0 else 0
+    counts = np.bincount(labels, minlength=nclusters)
+    if np.any(counts==0): raise Exception('Found cluster labels without any entries.')
+    if first_ids is None:
+        order = np.argsort(labels, kind='stable')
+        first_ids = ids[order[np.cumsum(counts) - counts]]
+
+    # copy the attributes of the first entry of each cluster
+    centers = dataset.iloc[first_ids].reset_index(drop=True)
+
+    # calculate the center coordinates
+    if lat_key is not None and lon_key is not None:
+        lat = dataset[lat_key].values.astype(float)[ids]
+        lon = dataset[lon_key].values.astype(float)[ids]
+        if center=='weighted':
+            weights = dataset[weight_key].values.astype(float)[ids]
+            sum_weights = np.bincount(labels, weights=weights, minlength=nclusters)
+            # (note: clusters with zero total weight get the unweighted average)
+            zero = (sum_weights==0)
+            weights[zero[labels]] = 1
+            sum_weights[zero] = counts[zero]
+            lat_center = np.bincount(labels, weights=weights*lat, minlength=nclusters) / sum_weights
+            lon_center = np.bincount(labels, weights=weights*lon, minlength=nclusters) / sum_weights
+        else:
+            lat_center = np.bincount(labels, weights=lat, minlength=nclusters) / counts
+            lon_center = np.bincount(labels, weights=lon, minlength=nclusters) / counts
+        if center=='medoid':
+            dist = haversine_array(lat, lon, lat_center[labels], lon_center[labels])
+            order = np.lexsort((dist, labels))
+            nearest = order[np.cumsum(counts) - counts]
+            lat_center = lat[nearest]
+            lon_center = lon[nearest]
+        centers[lat_key] = lat_center
+        centers[lon_key] = lon_center
+
+    # store number of entries in each cluster
+    if num_key is not None: centers[num_key] = counts
     return centers
 
 
+def cluster_parts(parts, **kwargs):
+    # compress each of a list of DataFrames into a single entry
+    # (note: the parts are concatenated and aggregated at once)
+    if len(parts)==0: return pd.concat(parts, ignore_index=True)
+    dataset = pd.concat(parts, ignore_index=True)
+    lengths = np.array([len(part) for part in parts])
+    labels = np.repeat(np.arange(len(parts)), lengths)
+    return aggregate_clusters(dataset, labels, **kwargs)
+
+
 def cluster_by_indices(dataset, cluster_indices, **kwargs):
-    parts = []
-    for indices in cluster_indices: parts.append(dataset.iloc[indices])
-    return cluster_parts(parts)
+    # compress a dataset given the indices of the entries in each cluster
+    # (note: the attributes of each cluster are copied from the first index)
+    lengths = np.array([len(indices) for indices in cluster_indices], dtype=int)
+    if np.any(lengths==0): raise Exception('Found clusters without any entries.')
+    ids = np.concatenate(cluster_indices).astype(int) if len(lengths) > 0 else np.array([], dtype=int)
+    if len(np.unique(ids))!=len(ids): raise Exception('Found entries in more than one cluster.')
+    labels = np.full(len(dataset), -1)
+    labels[ids] = np.repeat(np.arange(len(lengths)), lengths)
+    first_ids = ids[np.cumsum(lengths) - lengths]
+    return aggregate_clusters(dataset, labels, first_ids=first_ids, **kwargs)
 
 
 def cluster_by_label(dataset, cluster_labels, **kwargs):
-    indices = []
-    for label in np.unique(sorted(cluster_labels)):
-        mask = (cluster_labels==label)
-        indices.append(np.nonzero(mask))
-    return cluster_by_indices(dataset, indices, **kwargs)
+    # compress a dataset given a cluster label for each entry
+    # (note: the labels can be of any sortable type; the clusters are ordered by label)
+    (_, labels) = np.unique(np.asarray(cluster_labels), return_inverse=True)
+    return aggregate_clusters(dataset, labels.ravel(), **kwargs)
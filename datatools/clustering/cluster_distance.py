@@ -24,6 +24,7 @@ from datatools.clustering.cluster_dataset import cluster_by_indices
 def cluster_distance(dataset,
         lat_key='lat', lon_key='lon', num_key='num',
         distance_threshold=1,
+        linkage='complete',
         verbose=False):
     
     # get coordinates in suitable format
@@ -32,7 +33,8 @@ def cluster_distance(dataset,
     coords = [{'lon': lon, 'lat': lat} for lon, lat in zip(lons, lats)]
 
     # cluster by distance
-    cluster_indices = cluster_by_distance_threshold(coords, distance_threshold=distance_threshold)
+    cluster_indices = cluster_by_distance_threshold(coords, distance_threshold=distance_threshold,
+                        linkage=linkage)
 
     # cluster dataset
     centers = cluster_by_indices(dataset, cluster_indices, lat_key=lat_key, lon_key=lon_key, num_key=num_key)
@@ -56,6 +58,7 @@ if __name__=='__main__':
     parser.add_argument('--lon_key', default='lon')
     parser.add_argument('--num_key', default='num')
     parser.add_argument('--distance_threshold', default=1, type=float)
+    parser.add_argument('--linkage', default='complete', choices=['complete', 'single'])
     args = parser.parse_args()
     print('Running with following configuration:')
     for arg in vars(args): print(f'  - {arg}: {getattr(args, arg)}')
@@ -74,6 +77,7 @@ if __name__=='__main__':
       lon_key=args.lon_key,
       num_key=args.num_key,
       distance_threshold=args.distance_threshold,
+      linkage=args.linkage,
       verbose=True
     )
 
@@ -5,9 +5,12 @@
 # import external modules
 import os
 import sys
-import sklearn
+import scipy.cluster.hierarchy
+import scipy.spatial.distance
 import pandas as pd
 import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 # set path for local imports
 thisdir = os.path.dirname(os.path.abspath(__file__))
@@ -16,99 +19,335 @@ sys.path.append(topdir)
 
 # local imports
 from python.distancematrix import get_geodesic_distance_matrix
+from tools.distance import haversine_array
+from tools.geometrytools import coords_to_array
+from tools.geometrytools import project_local
+from tools.geometrytools import convex_hull
+
+
+def find_farthest_pair(lat, lon, distance_matrix=None):
+    '''
+    Find the two points that are farthest apart
+    Input arguments:
+      - lat, lon: 1D numpy arrays with latitudes and longitudes
+      - distance_matrix: distance matrix between the points (optional);
+        if not provided, geodesic distances are used.
+    Returns: a tuple of the indices of both points and their distance
+    Note: for geodesic distances, the farthest pair is searched among the points
+          on the convex hull only (in a local flat projection), which avoids
+          calculating the distances between all pairs of points.
+    '''
+    if distance_matrix is None:
+        ids = np.sort(convex_hull(project_local(np.column_stack((lon, lat)))))
+        distances = haversine_array(lat[ids][:, np.newaxis], lon[ids][:, np.newaxis],
+                      lat[ids][np.newaxis, :], lon[ids][np.newaxis, :])
+    else:
+        ids = np.arange(len(lat))
+        distances = distance_matrix
+    (max1, max2) = np.unravel_index(np.argmax(distances, axis=None), distances.shape)
+    return (int(ids[max1]), int(ids[max2]), distances[max1, max2])
 
 
 def split_cluster_by_max_distance(
         coords,
         distance_matrix = None,
-        max_distance = None,
-        cids = None):
+        max_distance = None):
     '''
     Split a cluster of coordinates based on maximum allowed distance between any two points
     Input argument:
-      - coords: list of dicts of the form {'lat': latitude, 'lon': longitude}
-      - distance_matrix: distance matrix.
-        if not provided, calculated on the fly (in geodesic approximation)
+      - coords: list of dicts of the form {'lat': latitude, 'lon': longitude},
+        or array of [lon, lat] points
+      - distance_matrix: distance matrix (optional).
+        if not provided, geodesic distances are calculated on the fly
+        (only to the relevant points, without building a full distance matrix).
       - max_distance: maximum allowed distance (in meter) within each cluster
-      - cids: for internal recursive calls only, do not use.
     Returns: lists of indices (w.r.t. input coords) of subclusters
+    Note: the cluster is split in two around the two points that are farthest apart,
+          by assigning each point to the closest of both;
+          this is repeated for each part until no part is too large.
     '''
-    
-    # calculate (simplified) distance matrix for original cluster
-    if distance_matrix is None: distance_matrix = get_geodesic_distance_matrix(coords, verbose=False)
-    (max1, max2) = np.unravel_index(np.argmax(distance_matrix, axis=None), distance_matrix.shape)
-    maxdist = distance_matrix[max1, max2]
-
-    # handle case where no splitting is needed
-    if cids is None: cids = list(range(len(coords)))
-    if maxdist is None: return [cids]
-    if maxdist < max_distance: return [cids]
-
-    # split into two clusters by max distance
-    cluster_1_ids = [max1]
-    cluster_2_ids = [max2]
-    cluster_1_orig_ids = [cids[max1]]
-    cluster_2_orig_ids = [cids[max2]]
-    for idx in range(len(coords)):
-        if idx == max1 or idx == max2: continue
-        dist_to_max1 = distance_matrix[idx, max1]
-        dist_to_max2 = distance_matrix[idx, max2]
-        if dist_to_max1 < dist_to_max2:
-            cluster_1_ids.append(idx)
-            cluster_1_orig_ids.append(cids[idx])
+
+    # get coordinates in suitable format
+    coords = coords_to_array(coords)
+    lon = coords[:, 0]
+    lat = coords[:, 1]
+
+    # split parts until no part is too large
+    # (note: parts are processed depth-first, first part first,
+    #  so that the order of the output is the same as for recursive splitting)
+    result = []
+    stack = [np.arange(len(coords))]
+    while len(stack) > 0:
+        cids = stack.pop()
+        submatrix = distance_matrix[np.ix_(cids, cids)] if distance_matrix is not None else None
+        (max1, max2, maxdist) = find_farthest_pair(lat[cids], lon[cids], distance_matrix=submatrix)
+
+        # handle case where no splitting is needed
+        if maxdist < max_distance:
+            result.append([int(idx) for idx in cids])
+            continue
+
+        # split into two clusters by max distance
+        if distance_matrix is None:
+            dist_to_max1 = haversine_array(lat[cids[max1]], lon[cids[max1]], lat[cids], lon[cids])
+            dist_to_max2 = haversine_array(lat[cids[max2]], lon[cids[max2]], lat[cids], lon[cids])
         else:
-            cluster_2_ids.append(idx)
-            cluster_2_orig_ids.append(cids[idx])
-    cluster_1 = [coords[idx] for idx in cluster_1_ids]
-    cluster_2 = [coords[idx] for idx in cluster_2_ids]
-    distance_matrix_1 = distance_matrix[cluster_1_ids, :][:, cluster_1_ids]
-    distance_matrix_2 = distance_matrix[cluster_2_ids, :][:, cluster_2_ids]
-
-    # repeat recursively
-    res1 = split_cluster_by_max_distance(
-             cluster_1,
-             distance_matrix = distance_matrix_1, 
-             max_distance = max_distance,
-             cids = cluster_1_orig_ids)
-    res2 = split_cluster_by_max_distance(
-             cluster_2,
-             distance_matrix = distance_matrix_2,
-             max_distance = max_distance,
-             cids = cluster_2_orig_ids)
-
-    return res1 + res2
+            dist_to_max1 = submatrix[:, max1]
+            dist_to_max2 = submatrix[:, max2]
+        mask = np.ones(len(cids), dtype=bool)
+        mask[[max1, max2]] = False
+        cluster_1_ids = np.concatenate(([max1], np.nonzero(mask & (dist_to_max1 < dist_to_max2))[0]))
+        cluster_2_ids = np.concatenate(([max2], np.nonzero(mask & (dist_to_max1 >= dist_to_max2))[0]))
+        stack.append(cids[cluster_2_ids])
+        stack.append(cids[cluster_1_ids])
+
+    return result
+
+
+def find_neighbour_pairs(coords, radius, chunksize=100000):
+    '''
+    Find all pairs of points that are closer to each other than a given radius
+    Input arguments:
+      - coords: list of dicts of the form {'lat': latitude, 'lon': longitude},
+        or array of [lon, lat] points
+      - radius: maximum distance (in meter, exclusive) between two points in a pair
+      - chunksize: number of points for which candidate pairs are handled at once
+        (limits the memory usage for dense point sets)
+    Returns: a tuple of three 1D numpy arrays with the first index, second index
+             and geodesic distance of each pair (with first index < second index)
+    Note: the points are hashed into a grid of square cells (in a local flat projection)
+          of the size of the radius, so that only points in neighbouring cells
+          need to be compared.
+    '''
+
+    # get coordinates in suitable format
+    coords = coords_to_array(coords)
+    lon = coords[:, 0]
+    lat = coords[:, 1]
+    npoints = len(coords)
+
+    # hash the points into grid cells
+    # (note: the cells are slightly larger than the radius, to be robust against
+    #  the small difference between projected and geodesic distances.)
+    cells = np.floor(project_local(coords) / (1.05*radius)).astype(np.int64)
+    cells = cells - np.amin(cells, axis=0) + 1 if npoints > 0 else cells
+    ncols = int(np.amax(cells[:, 1])) + 2 if npoints > 0 else 1
+    keys = cells[:, 0]*ncols + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    (cell_keys, cell_starts, cell_counts) = np.unique(keys[order], return_index=True, return_counts=True)
+    point_cells = np.searchsorted(cell_keys, keys)
+
+    # compare each cell to itself and to half of its neighbours
+    # (the other half is covered by the neighbours themselves)
+    first = []
+    second = []
+    distances = []
+    for offset in [0, 1, ncols-1, ncols, ncols+1]:
+        # find the neighbouring cell of each cell (if it is not empty)
+        target = cell_keys + offset
+        pos = np.minimum(np.searchsorted(cell_keys, target), len(cell_keys)-1)
+        neighbour_cells = np.where(cell_keys[pos]==target, pos, -1)
+        for start in range(0, npoints, chunksize):
+            # make all candidate pairs between the points in the chunk
+            # and the points in the neighbouring cell
+            ids = np.arange(start, min(start+chunksize, npoints))
+            ncells = neighbour_cells[point_cells[ids]]
+            ids = ids[ncells >= 0]
+            ncells = ncells[ncells >= 0]
+            counts = cell_counts[ncells]
+            i = np.repeat(ids, counts)
+            within = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts)-counts, counts)
+            j = order[np.repeat(cell_starts[ncells], counts) + within]
+            if offset==0:
+                (i, j) = (i[i<j], j[i<j])
+            # keep the pairs that are close enough
+            dist = haversine_array(lat[i], lon[i], lat[j], lon[j])
+            mask = (dist < radius)
+            first.append(np.minimum(i[mask], j[mask]))
+            second.append(np.maximum(i[mask], j[mask]))
+            distances.append(dist[mask])
+    if len(first)==0: return (np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0))
+    return (np.concatenate(first), np.concatenate(second), np.concatenate(distances))
 
 
 def cluster_by_distance_threshold(
         coords,
         distance_matrix = None,
-        distance_threshold = 1):
+        distance_threshold = 1,
+        linkage = 'complete',
+        max_component_size = 5000):
     '''
     Cluster a set of coordinates based on a preset distance threshold.
     Input argument:
-      - coords: list of dicts of the form {'lat': latitude, 'lon': longitude}
-      - distances: distance matrix.
-        if not provided, calculated on the fly (in geodesic approximation).
+      - coords: list of dicts of the form {'lat': latitude, 'lon': longitude},
+        or array of [lon, lat] points
+      - distances: distance matrix (optional).
+        if not provided, geodesic distances are calculated on the fly
+        (only between points closer than the threshold, without building a full distance matrix).
       - distance_threshold: distance threshold (in meter) for clustering.
-    Returns: lists of indices (w.r.t. input coords) of subclusters.
+      - linkage: choose from 'complete' (default; all points in a cluster are closer
+        than the threshold to each other) or 'single' (each point in a cluster is closer
+        than the threshold to at least one other point in the cluster).
+      - max_component_size: for complete linkage without distance matrix,
+        components larger than this are first split in parts (see below).
+    Returns: lists of indices (w.r.t. input coords) of subclusters,
+             ordered by their lowest index.
+    Note: without distance matrix, the points are first grouped into connected components
+          of the graph of pairs closer than the threshold (see find_neighbour_pairs).
+          these are the clusters for single linkage. for complete linkage,
+          clusters never extend over multiple components, so agglomerative clustering
+          is only needed within components of which not all points are close enough
+          to each other. its memory usage is quadratic in the component size,
+          so components larger than max_component_size are split in spatially compact parts
+          first (in which case clusters can not extend over multiple parts,
+          and the result is an approximation).
     '''
+    if linkage not in ['complete', 'single']:
+        raise Exception(f'Linkage {linkage} not recognized; choose from "complete" or "single".')
 
-    # get distance matrix
-    if distance_matrix is None: distance_matrix = get_geodesic_distance_matrix(coords)
+    # run clusterer on full distance matrix if provided
+    if distance_matrix is not None:
+        return labels_to_indices(run_agglomerative_clustering(distance_matrix,
+                 distance_threshold=distance_threshold, linkage=linkage))
 
-    # make and run clusterer
-    clusterer = sklearn.cluster.AgglomerativeClustering(
-                  n_clusters = None,
-                  distance_threshold = distance_threshold,
-                  metric = 'precomputed',
-                  linkage = 'complete')
-    clusterer.fit(distance_matrix)
-    cluster_labels = clusterer.labels_
+    # get coordinates in suitable format
+    coords = coords_to_array(coords)
 
-    # convert cluster labels to cluster indices
-    cluster_indices = []
-    for label in np.unique(sorted(cluster_labels)):
-        mask = (cluster_labels==label)
-        cluster_indices.append(np.nonzero(mask))
+    # find connected components of the graph of close pairs
+    (first, second, pair_distances) = find_neighbour_pairs(coords, distance_threshold)
+    graph = coo_matrix((np.ones(len(first)), (first, second)), shape=(len(coords), len(coords)))
+    (_, cluster_labels) = connected_components(graph, directed=False)
+    if linkage=='single': return labels_to_indices(cluster_labels)
 
-    return cluster_indices
+    # run complete linkage clustering within each component that is not a clique,
+    # i.e. of which not all points are closer than the threshold to each other
+    # (note: the distances between points that do not form a pair are irrelevant,
+    #  as long as they are not below the threshold, so they are not calculated.)
+    counts = np.bincount(cluster_labels)
+    component_edges = np.bincount(cluster_labels[first], minlength=len(counts))
+    components = np.nonzero(component_edges < counts*(counts-1)/2)[0]
+    points = project_local(coords)
+    local_ids = np.zeros(len(coords), dtype=int)
+    in_part = np.zeros(len(coords), dtype=bool)
+    next_label = len(counts)
+    point_order = np.argsort(cluster_labels, kind='stable')
+    point_starts = np.concatenate(([0], np.cumsum(counts)))
+    edge_order = np.argsort(cluster_labels[first], kind='stable')
+    edge_starts = np.concatenate(([0], np.cumsum(component_edges)))
+    for component in components:
+        members = point_order[point_starts[component]:point_starts[component+1]]
+        edges = edge_order[edge_starts[component]:edge_starts[component+1]]
+        # split very large components, to limit the memory usage
+        for part in split_by_median(points, members, max_size=max_component_size):
+            local_ids[part] = np.arange(len(part))
+            in_part[part] = True
+            part_edges = edges[(in_part[first[edges]]) & (in_part[second[edges]])]
+            in_part[part] = False
+            distances = np.full((len(part), len(part)), 2.*distance_threshold)
+            np.fill_diagonal(distances, 0.)
+            distances[local_ids[first[part_edges]], local_ids[second[part_edges]]] = pair_distances[part_edges]
+            distances[local_ids[second[part_edges]], local_ids[first[part_edges]]] = pair_distances[part_edges]
+            sublabels = run_agglomerative_clustering(distances,
+                          distance_threshold=distance_threshold, linkage=linkage)
+            cluster_labels[part] = next_label + sublabels
+            next_label += np.amax(sublabels) + 1
+    return labels_to_indices(cluster_labels)
+
+
+def split_by_median(points, ids, max_size=5000):
+    '''
+    Split a set of points recursively at the median of their widest coordinate,
+    until each part contains at most a given number of points
+    Input arguments:
+      - points: array of [x, y] points (e.g. as returned by project_local)
+      - ids: 1D numpy array with indices of the points to split
+      - max_size: maximum number of points per part
+    Returns: list of 1D numpy arrays with indices (w.r.t. points) of the parts
+    '''
+    parts = []
+    stack = [ids]
+    while len(stack) > 0:
+        ids = stack.pop()
+        if max_size is None or len(ids) <= max_size:
+            parts.append(ids)
+            continue
+        axis = np.argmax(np.ptp(points[ids], axis=0))
+        order = np.argsort(points[ids, axis], kind='stable')
+        stack.append(ids[order[len(ids)//2:]])
+        stack.append(ids[order[:len(ids)//2]])
+    return parts
+
+
+def run_agglomerative_clustering(distance_matrix, distance_threshold=1, linkage='complete'):
+    '''
+    Run agglomerative clustering on a distance matrix
+    Returns: 1D numpy array with a cluster label for each point
+    Note: clusters are merged as long as their linkage distance is strictly smaller
+          than the threshold (same convention as sklearn's AgglomerativeClustering).
+          for small matrices, the clusters are merged directly,
+          which avoids the overhead of scipy's hierarchical clustering.
+    '''
+    npoints = len(distance_matrix)
+    if npoints < 2: return np.zeros(npoints, dtype=int)
+    if npoints <= 100: return merge_clusters(distance_matrix, distance_threshold, linkage=linkage)
+    tree = scipy.cluster.hierarchy.linkage(
+             scipy.spatial.distance.squareform(distance_matrix, checks=False),
+             method = linkage)
+    # apply the merges below the threshold
+    # (note: for complete and single linkage, the merge distances are non-decreasing)
+    parents = np.arange(2*npoints-1)
+    for idx, (cluster1, cluster2, distance, _) in enumerate(tree):
+        if distance >= distance_threshold: break
+        parents[int(cluster1)] = npoints + idx
+        parents[int(cluster2)] = npoints + idx
+    roots = parents[:npoints]
+    while True:
+        newroots = parents[roots]
+        if np.all(newroots==roots): break
+        roots = newroots
+    return np.unique(roots, return_inverse=True)[1].ravel()
+
+
+def merge_clusters(distance_matrix, distance_threshold=1, linkage='complete'):
+    '''
+    Agglomerative clustering by direct merging (suitable for small distance matrices)
+    Returns: 1D numpy array with a cluster label for each point
+    '''
+    distances = np.array(distance_matrix, dtype=float)
+    np.fill_diagonal(distances, np.inf)
+    labels = np.arange(len(distances))
+    update = np.maximum if linkage=='complete' else np.minimum
+    while True:
+        (idx1, idx2) = np.unravel_index(np.argmin(distances), distances.shape)
+        if distances[idx1, idx2] >= distance_threshold: break
+        # merge the second cluster into the first one
+        distances[idx1, :] = update(distances[idx1, :], distances[idx2, :])
+        distances[:, idx1] = distances[idx1, :]
+        distances[idx1, idx1] = np.inf
+        distances[idx2, :] = np.inf
+        distances[:, idx2] = np.inf
+        labels[labels==idx2] = idx1
+    return np.unique(labels, return_inverse=True)[1].ravel()
+
+
+def labels_to_indices(cluster_labels, min_size=1):
+    '''
+    Convert cluster labels to lists of indices per cluster
+    Input arguments:
+      - cluster_labels: 1D numpy array with a cluster label for each point
+      - min_size: minimum number of points in a cluster (smaller clusters are omitted)
+    Returns: list of 1D numpy arrays with indices of the points in each cluster,
+             ordered by their lowest index.
+    '''
+    cluster_labels = np.asarray(cluster_labels)
+    if len(cluster_labels)==0: return []
+    (_, first_ids, labels, counts) = np.unique(cluster_labels,
+        return_index=True, return_inverse=True, return_counts=True)
+    # renumber the clusters in order of their lowest index
+    rank = np.empty(len(first_ids), dtype=int)
+    rank[np.argsort(first_ids)] = np.arange(len(first_ids))
+    labels = rank[labels.ravel()]
+    counts = counts[np.argsort(first_ids)]
+    order = np.argsort(labels, kind='stable')
+    cluster_indices = np.split(order, np.cumsum(counts)[:-1])
+    return [ids for ids in cluster_indices if len(ids) >= min_size]
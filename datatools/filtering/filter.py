@@ -5,20 +5,37 @@
 
 import os
 import sys
+import re
 import json
 import copy
 import argparse
+import numpy as np
 import pandas as pd
-from fnmatch import fnmatch
+from fnmatch import translate
 
 
-class Filter(object):
+# supported ways of matching the values in a column to the select and veto lists
+match_modes = ['exact', 'glob', 'regex']
+
 
-    def __init__(self, column_name=None, select=None, veto=None):
+class Filter(object):
+    # filter on the values in a column of a dataframe
+    # - column_name: name of the column to filter on
+    # - select: list of values to keep (all other entries are removed)
+    # - veto: list of values to remove
+    # - match: how values are compared to the select and veto lists, choose from:
+    #   - 'exact': values must be equal to an element of the list.
+    #   - 'glob': list elements are shell-style patterns (e.g. "Prunus serrulata*")
+    #     that must match the full value.
+    #   - 'regex': list elements are regular expressions that must match
+    #     (part of) the value.
+
+    def __init__(self, column_name=None, select=None, veto=None, match='exact'):
         self.column_name = column_name
         self.select = select
         self.veto = veto
-        self.properties = ['column_name', 'select', 'veto']
+        self.match = match
+        self.properties = ['column_name', 'select', 'veto', 'match']
 
     def __str__(self):
         parts = ['Filter:']
@@ -30,7 +47,7 @@ class Filter(object):
     def from_dict(cls, fdict):
         # todo: implement more extensive format checking
         f = Filter()
-        keys = ['column_name', 'select', 'veto']
+        keys = ['column_name', 'select', 'veto', 'match']
         for key in keys:
             if key in fdict.keys():
                 setattr(f, key, copy.deepcopy(fdict[key]))
@@ -46,20 +63,50 @@ class Filter(object):
             fdict = json.load(f)
         return cls.from_dict(fdict)
 
-    def filter_df(self, df):
-        res = df.copy()
+    def compile_pattern(self, values):
+        # combine a list of glob patterns or regular expressions into a single regular expression
+        if self.match=='glob': patterns = [translate(str(value)) for value in values]
+        else: patterns = [str(value) for value in values]
+        return re.compile('|'.join(['(?:{})'.format(pattern) for pattern in patterns]))
+
+    def match_values(self, column, values):
+        # check which entries of a column match any of a list of values
+        # input arguments:
+        # - column: pandas Series
+        # - values: list of values (or patterns, depending on self.match)
+        # returns:
+        #   1D numpy array of booleans
+        if self.match=='exact': return column.isin(values).values
+        # (note: the patterns are only evaluated once per distinct value in the column;
+        #  missing values never match)
+        (codes, uniques) = pd.factorize(column)
+        pattern = self.compile_pattern(values)
+        if self.match=='glob': matches = [pattern.match(str(value)) is not None for value in uniques]
+        else: matches = [pattern.search(str(value)) is not None for value in uniques]
+        matches = np.append(np.array(matches, dtype=bool), False)
+        return matches[codes]
+
+    def get_mask(self, df):
+        # get a boolean mask of the entries of a dataframe that pass this filter
         if self.column_name is None:
             raise Exception('Cannot apply this filter as the column_name was not set.')
-        if self.select is not None: res = res[res[self.column_name].isin(self.select)]
-        if self.veto is not None: res = res[~res[self.column_name].isin(self.veto)]
-        res.reset_index(inplace=True)
-        return res
-    
+        if self.column_name not in df.columns:
+            raise Exception(f'Column {self.column_name} not found in provided dataframe.')
+        if self.match not in match_modes:
+            raise Exception(f'Match mode {self.match} not recognized; choose from {match_modes}.')
+        column = df[self.column_name]
+        mask = np.ones(len(df), dtype=bool)
+        if self.select is not None: mask &= self.match_values(column, self.select)
+        if self.veto is not None: mask &= ~self.match_values(column, self.veto)
+        return mask
+
+    def filter_df(self, df):
+        return df[self.get_mask(df)].reset_index(drop=True)
     
-def filter_dataset(dataset, filters, verbose=False):
-    # main function
     
-    # parse filters
+def parse_filters(filters):
+    # convert a list of filters and/or paths to filter json files to a list of filters
+    filters = list(filters)
     for idx, dffilter in enumerate(filters):
         if isinstance(dffilter, Filter): pass
         elif isinstance(dffilter, str):
@@ -70,31 +117,68 @@ def filter_dataset(dataset, filters, verbose=False):
             filters[idx] = dffilter
         if not isinstance(dffilter, Filter):
             raise Exception(f'Filter is of unrecognized type {type(dffilter)}.')
+    return filters
 
-    # printout
-    if verbose:
-        print('Found following filters:')
-        for dffilter in filters:
-            print(dffilter)
 
-    # do filtering
-    for dffilter in filters:
+def get_filter_mask(dataset, filters, verbose=False, summary=None):
+    # combine a list of filters into a single boolean mask
+    # (note: if a summary is given (see make_filter_summary), the available values
+    #  and the number of entries after each filter are added to it,
+    #  e.g. to report on all chunks of a dataset at once with print_filter_summary.)
+    mask = np.ones(len(dataset), dtype=bool)
+    for idx, dffilter in enumerate(filters):
         column_name = dffilter.column_name
         if verbose: print(f'Filtering {column_name}...')
 
-        # print available values
-        if verbose:
-            values = list(set(dataset[column_name]))
+        # get available values
+        # (note: only distinct values of the entries that passed the previous filters)
+        if verbose or summary is not None:
+            values = pd.unique(dataset[column_name].values[mask])
             values = [el for el in values if isinstance(el, str)]
-            values = sorted(values)
+        if verbose:
             print('Available values:')
-            for value in values: print('  - {}'.format(value))
+            for value in sorted(values): print('  - {}'.format(value))
+        if summary is not None: summary[idx]['values'].update(values)
     
-        # do filtering
-        dataset = dffilter.filter_df(dataset)
-        if verbose: print('Number of entries after this filter: {}'.format(len(dataset)))
+        # update mask
+        mask &= dffilter.get_mask(dataset)
+        if verbose: print('Number of entries after this filter: {}'.format(np.sum(mask)))
+        if summary is not None: summary[idx]['count'] += int(np.sum(mask))
+    return mask
+
+
+def make_filter_summary(filters):
+    # make an empty summary for a list of filters (see get_filter_mask)
+    return [{'column_name': dffilter.column_name, 'values': set(), 'count': 0} for dffilter in filters]
+
+
+def print_filter_summary(summary):
+    # print a summary made with get_filter_mask
+    # (in the same format as the printouts of get_filter_mask with verbose=True)
+    for entry in summary:
+        print('Filtering {}...'.format(entry['column_name']))
+        print('Available values:')
+        for value in sorted(entry['values']): print('  - {}'.format(value))
+        print('Number of entries after this filter: {}'.format(entry['count']))
+
+
+def filter_dataset(dataset, filters, verbose=False):
+    # main function
+    # (note: the filters are combined into a single mask,
+    #  and the selection is done once at the end.)
     
-    return dataset
+    # parse filters
+    filters = parse_filters(filters)
+
+    # printout
+    if verbose:
+        print('Found following filters:')
+        for dffilter in filters:
+            print(dffilter)
+
+    # do filtering
+    mask = get_filter_mask(dataset, filters, verbose=verbose)
+    return dataset[mask].reset_index(drop=True)
 
 
 if __name__=='__main__':
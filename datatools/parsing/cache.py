@@ -0,0 +1,229 @@
+###########################################
+# Columnar cache of parsed (raw) datasets #
+###########################################
+# Parsing a raw tree inventory (reading the csv file, converting coordinates, ...)
+# can be slow, while it only needs to be redone if the raw file or the parsing changes.
+# The functions below store the parsed dataset in a columnar format (parquet or feather),
+# in a file named after a hash of the raw file and the parsing parameters,
+# with low-cardinality text columns stored as categoricals and coordinates as float32.
+# Filters (see datatools/filtering) are pushed down into the columnar read where possible.
+# Note: requires the pyarrow package, which is only imported when the cache is used.
+
+
+# import external modules
+import os
+import sys
+import json
+import hashlib
+import pandas as pd
+
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+topdir = os.path.abspath(os.path.join(thisdir, '../..'))
+sys.path.append(topdir)
+
+# local imports
+from tools.checkpointtools import make_key
+from datatools.filtering.filter import parse_filters
+from datatools.filtering.filter import get_filter_mask
+
+
+# supported cache formats and their file extensions
+cache_formats = {
+  'parquet': '.parquet',
+  'feather': '.feather'
+}
+
+
+def import_pyarrow():
+    # import pyarrow (only when needed, since it is an optional dependency)
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError:
+        msg = 'The dataset cache requires the pyarrow package;'
+        msg += ' install it (e.g. pip install pyarrow) or disable the cache.'
+        raise Exception(msg)
+    return pyarrow
+
+
+def hash_file(path, blocksize=2**20):
+    # make a content hash of a file (read in blocks of limited size)
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''): h.update(block)
+    return h.hexdigest()[:16]
+
+
+def get_file_hash(path, cachedir=None):
+    # get the content hash of a file, reusing a previously calculated hash if possible
+    # (note: the hashes are stored in the cache directory together with the size
+    #  and modification time of each file, and reused if these have not changed,
+    #  to avoid reading large raw files completely on each reload.)
+    if cachedir is None: return hash_file(path)
+    path = os.path.abspath(path)
+    indexfile = os.path.join(cachedir, 'hashes.json')
+    index = {}
+    if os.path.exists(indexfile):
+        with open(indexfile, 'r') as f: index = json.load(f)
+    stat = os.stat(path)
+    entry = index.get(path, None)
+    if entry is not None and entry['size']==stat.st_size and entry['mtime']==stat.st_mtime:
+        return entry['hash']
+    index[path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': hash_file(path)}
+    if not os.path.exists(cachedir): os.makedirs(cachedir)
+    with open(indexfile + '.tmp', 'w') as f: json.dump(index, f, indent=2)
+    os.replace(indexfile + '.tmp', indexfile)
+    return index[path]['hash']
+
+
+def get_cache_path(cachedir, inputfile, params=None, fmt='parquet'):
+    # get the path of the cached version of a raw file
+    # input arguments:
+    # - cachedir: directory with cached files
+    # - inputfile: path to the raw file
+    # - params: json-serializable object with the parameters of the parsing
+    # - fmt: cache format (see cache_formats)
+    if fmt not in cache_formats:
+        raise Exception(f'Cache format {fmt} not recognized; choose from {list(cache_formats.keys())}.')
+    key = make_key(get_file_hash(inputfile, cachedir=cachedir), params, fmt)
+    name = os.path.splitext(os.path.basename(inputfile))[0]
+    return os.path.join(cachedir, '{}-{}{}'.format(name, key, cache_formats[fmt]))
+
+
+def compact_dtypes(dataset, float32_columns=None, max_category_fraction=0.5):
+    # convert the columns of a dataset to more compact dtypes
+    # input arguments:
+    # - dataset: pandas DataFrame
+    # - float32_columns: list of columns to store as float32 (e.g. coordinates)
+    # - max_category_fraction: text columns with fewer distinct values than this fraction
+    #   of the number of entries are converted to categoricals
+    # returns:
+    #   pandas DataFrame
+    dataset = dataset.copy()
+    for column in (float32_columns if float32_columns is not None else []):
+        if column in dataset.columns: dataset[column] = dataset[column].astype('float32')
+    for column in dataset.columns:
+        values = dataset[column]
+        if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)): continue
+        if values.nunique() < max_category_fraction * len(values):
+            dataset[column] = values.astype('category')
+    return dataset
+
+
+def write_cache(dataset, path, fmt='parquet'):
+    # store a dataset in the cache
+    # (note: the file is written under a temporary name first,
+    #  so an interrupted write does not leave a corrupt cache file)
+    import_pyarrow()
+    outputdir = os.path.dirname(path)
+    if not os.path.exists(outputdir): os.makedirs(outputdir)
+    dataset = dataset.reset_index(drop=True)
+    if fmt=='parquet': dataset.to_parquet(path + '.tmp', index=False)
+    else: dataset.to_feather(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def get_filter_expression(filters):
+    # convert filters to a pyarrow expression
+    # input arguments:
+    # - filters: list of filters
+    # returns:
+    #   a tuple of the expression (or None) and the list of filters that could not be converted
+    #   (only filters with exact matching can be converted)
+    pyarrow = import_pyarrow()
+    expression = None
+    remaining = []
+    for dffilter in filters:
+        if dffilter.match!='exact':
+            remaining.append(dffilter)
+            continue
+        field = pyarrow.dataset.field(dffilter.column_name)
+        if dffilter.select is not None:
+            part = field.isin(dffilter.select)
+            expression = part if expression is None else (expression & part)
+        if dffilter.veto is not None:
+            # (note: missing values are kept, as for the filters applied to a dataframe)
+            part = (~field.isin(dffilter.veto)) | field.is_null()
+            expression = part if expression is None else (expression & part)
+    return (expression, remaining)
+
+
+def read_cache(path, fmt='parquet', columns=None, filters=None):
+    # read a dataset from the cache
+    # input arguments:
+    # - path: path to the cached file
+    # - fmt: cache format (see cache_formats)
+    # - columns: list of columns to read (default: all columns)
+    # - filters: list of filters and/or paths to filter json files
+    # returns:
+    #   pandas DataFrame with the entries that pass the filters
+    pyarrow = import_pyarrow()
+    filters = parse_filters(filters) if filters is not None else []
+    (expression, remaining) = get_filter_expression(filters)
+    if columns is not None and len(remaining) > 0:
+        columns = list(columns) + [f.column_name for f in remaining if f.column_name not in columns]
+    source = pyarrow.dataset.dataset(path, format='parquet' if fmt=='parquet' else 'ipc')
+    dataset = source.to_table(columns=columns, filter=expression).to_pandas()
+    if len(remaining) > 0:
+        dataset = dataset[get_filter_mask(dataset, remaining)].reset_index(drop=True)
+    # remove categories that do not occur anymore after filtering
+    for column in dataset.columns:
+        if isinstance(dataset[column].dtype, pd.CategoricalDtype):
+            dataset[column] = dataset[column].cat.remove_unused_categories()
+    return dataset
+
+
+def load_cached(inputfile, parse_function,
+        params = None,
+        cachedir = None,
+        fmt = 'parquet',
+        columns = None,
+        filters = None,
+        float32_columns = None,
+        verbose = False):
+    '''
+    Load a parsed dataset from the cache, or parse it and store it in the cache.
+    Input arguments:
+    - inputfile: path to the raw file.
+    - parse_function: function that reads and parses the raw file and returns a pandas DataFrame,
+      taking the filters as optional keyword argument (e.g. read_dataset in ingest.py,
+      with all other arguments fixed using functools.partial).
+      Without cache, the filters are passed to it, so that they can be applied while reading
+      (e.g. per chunk, keeping only the entries that pass them in memory).
+      When building the cache, it is called without filters, so that the cache can be reused
+      if they change; note that this means the full raw file is parsed and kept in memory.
+    - params: json-serializable object with the parameters of the parsing
+      (e.g. the columns that are read); the cache is only reused if they are the same.
+    - cachedir: directory with cached files (if None, no cache is used;
+      if pyarrow is not installed, a warning is printed and no cache is used either).
+    - fmt: cache format (see cache_formats).
+    - columns: list of columns to read from the cache (default: all columns).
+    - filters: list of filters and/or paths to filter json files,
+      applied when reading from the cache.
+    - float32_columns: list of columns to store as float32 (default: 'lat' and 'lon').
+    Returns:
+    - pandas DataFrame with the entries that pass the filters.
+    '''
+    if cachedir is not None:
+        try: import_pyarrow()
+        except Exception as e:
+            print(f'WARNING in load_cached: {e} Parsing {inputfile} without cache.')
+            cachedir = None
+    if cachedir is None:
+        dataset = parse_function(filters=filters) if filters is not None else parse_function()
+        if columns is not None: dataset = dataset[columns]
+        return dataset
+    if float32_columns is None: float32_columns = ['lat', 'lon']
+    path = get_cache_path(cachedir, inputfile, params=params, fmt=fmt)
+    if not os.path.exists(path):
+        dataset = parse_function()
+        dataset = compact_dtypes(dataset, float32_columns=float32_columns)
+        write_cache(dataset, path, fmt=fmt)
+        if verbose: print(f'Stored parsed dataset in cache {path}.')
+    dataset = read_cache(path, fmt=fmt, columns=columns, filters=filters)
+    if verbose:
+        print(f'Loaded {len(dataset)} entries from cache {path}.')
+        print('Column names:')
+        print(dataset.columns.values)
+    return dataset
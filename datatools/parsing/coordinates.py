@@ -0,0 +1,191 @@
+###################################################
+# Tools for converting between coordinate systems #
+###################################################
+# Some tree inventories store their coordinates in a local coordinate system
+# (e.g. the Swiss EPSG:2056 system for Geneve) rather than in latitude and longitude.
+# The functions below convert full arrays of coordinates at once,
+# reusing the (expensive to create) transformers between calls.
+# Other inventories store their coordinates as text (e.g. "(41.82, -71.41)");
+# these can be extracted for a full column at once with a regular expression.
+
+
+# import external modules
+import os
+import sys
+import re
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+
+# transformers per thread and per pair of coordinate systems
+# (note: pyproj transformers should not be shared between threads,
+#  so each thread gets its own set of transformers)
+transformers = threading.local()
+
+
+def get_transformer(crs_from, crs_to='EPSG:4326'):
+    # get a transformer between two coordinate systems (created only once per thread)
+    # input arguments:
+    # - crs_from, crs_to: coordinate systems in any format accepted by pyproj (e.g. 'EPSG:2056')
+    # returns:
+    #   pyproj Transformer, with x/y (or lon/lat) axis order
+    import pyproj
+    if not hasattr(transformers, 'cache'): transformers.cache = {}
+    key = (str(crs_from), str(crs_to))
+    if key not in transformers.cache:
+        transformers.cache[key] = pyproj.Transformer.from_crs(crs_from, crs_to, always_xy=True)
+    return transformers.cache[key]
+
+
+def transform_chunk(x, y, crs_from, crs_to):
+    # convert a single chunk of coordinates (see transform_coords)
+    return get_transformer(crs_from, crs_to).transform(x, y)
+
+
+def transform_coords(x, y, crs_from, crs_to='EPSG:4326', chunksize=1000000, max_workers=1):
+    # convert arrays of coordinates from one coordinate system to another
+    # input arguments:
+    # - x, y: 1D numpy arrays with coordinates in the input system
+    #   (e.g. easting and northing, or longitude and latitude)
+    # - crs_from, crs_to: coordinate systems in any format accepted by pyproj
+    #   (default output: EPSG:4326, i.e. longitude and latitude)
+    # - chunksize: number of points converted at once
+    # - max_workers: number of threads to convert chunks in parallel
+    #   (default: 1, i.e. no parallel processing)
+    # returns:
+    #   a tuple of 1D numpy arrays with the converted x and y coordinates
+    #   (i.e. longitude and latitude for EPSG:4326)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x)==0: return (np.zeros(0), np.zeros(0))
+    starts = range(0, len(x), chunksize)
+    if max_workers is not None and max_workers > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(transform_chunk, x[start:start+chunksize],
+                         y[start:start+chunksize], crs_from, crs_to) for start in starts]
+            chunks = [future.result() for future in futures]
+    else:
+        chunks = [transform_chunk(x[start:start+chunksize], y[start:start+chunksize], crs_from, crs_to)
+                  for start in starts]
+    xout = np.concatenate([np.asarray(chunk[0], dtype=float) for chunk in chunks])
+    yout = np.concatenate([np.asarray(chunk[1], dtype=float) for chunk in chunks])
+    return (xout, yout)
+
+
+# regular expressions for coordinates stored as text,
+# with the two coordinates as first and second group
+number = r'[-+]?\d*\.?\d+'
+coordinate_patterns = {
+  # two numbers separated by a comma, e.g. "51.05, 3.72"
+  'pair': re.compile(r'(?P<first>{0})\s*,\s*(?P<second>{0})'.format(number)),
+  # two numbers separated by a comma between parentheses, e.g. "Main St (41.82, -71.41)"
+  'parentheses': re.compile(r'\(\s*(?P<first>{0})\s*,\s*(?P<second>{0})\s*\)'.format(number))
+}
+
+
+def extract_groups(values, pattern):
+    # extract the first two groups of a regular expression from each string as floats
+    # (note: pyarrow is used if available, which is much faster than pandas;
+    #  it requires named groups and does not support all regular expression syntax,
+    #  nor columns with non-string values, in which cases pandas is used.)
+    try:
+        import pyarrow
+        import pyarrow.compute
+    except ImportError: pyarrow = None
+    if pyarrow is not None:
+        try:
+            array = pyarrow.array(values, type=pyarrow.string(), from_pandas=True)
+            extracted = pyarrow.compute.extract_regex(array, pattern.pattern)
+            return tuple([pyarrow.compute.cast(pyarrow.compute.struct_field(extracted, [idx]),
+                      pyarrow.float64()).to_numpy(zero_copy_only=False) for idx in [0, 1]])
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowNotImplementedError, pyarrow.ArrowTypeError): pass
+    extracted = pd.Series(values, dtype='str').str.extract(pattern, expand=True)
+    return tuple([extracted.iloc[:, idx].astype(float).values for idx in [0, 1]])
+
+
+def extract_coords(values, pattern='pair', order='latlon'):
+    # extract coordinates from text
+    # input arguments:
+    # - values: array or pandas Series of strings
+    # - pattern: key of coordinate_patterns, or a (compiled) regular expression
+    #   with the two coordinates as first and second group
+    # - order: order of the coordinates in the text ('latlon' or 'lonlat')
+    # returns:
+    #   a tuple of 1D numpy arrays with latitudes, longitudes and a validity mask
+    #   (entries without a match, e.g. missing values, or with coordinates out of range
+    #   are invalid, and have NaN as latitude and longitude)
+    if isinstance(pattern, str): pattern = coordinate_patterns.get(pattern, None) or re.compile(pattern)
+    (first, second) = extract_groups(values, pattern)
+    (lat, lon) = (np.array(first), np.array(second))
+    if order=='lonlat': (lat, lon) = (lon, lat)
+    mask = (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+    lat[~mask] = np.nan
+    lon[~mask] = np.nan
+    return (lat, lon, mask)
+
+
+def add_latlon_from_text(dataset, key, pattern='pair', order='latlon',
+        lat_key='lat', lon_key='lon', drop_invalid=True, verbose=True):
+    # add latitude and longitude columns to a dataframe with coordinates stored as text
+    # input arguments:
+    # - dataset: pandas DataFrame
+    # - key: name of the column with the text
+    # - pattern, order: see extract_coords
+    # - lat_key, lon_key: names of the columns to add
+    # - drop_invalid: whether to remove the entries for which no coordinates were found
+    # - verbose: whether to print a summary of the entries for which no coordinates were found
+    # returns:
+    #   pandas DataFrame
+    (lat, lon, mask) = extract_coords(dataset[key].values, pattern=pattern, order=order)
+    dataset[lat_key] = lat
+    dataset[lon_key] = lon
+    ninvalid = int(np.sum(~mask))
+    if verbose and ninvalid > 0:
+        msg = 'WARNING: could not parse the coordinates'
+        msg += f' for {ninvalid} out of {len(dataset)} entries, for example:'
+        print(msg)
+        for value in dataset[key].values[~mask][:5]: print(f'  - "{value}"')
+    if drop_invalid and ninvalid > 0: dataset = dataset[mask]
+    return dataset
+
+
+def add_latlon(dataset, x_key, y_key, crs_from,
+        lat_key='lat', lon_key='lon', chunksize=1000000, max_workers=1):
+    # add latitude and longitude columns to a dataframe with coordinates in another system
+    # input arguments:
+    # - dataset: pandas DataFrame
+    # - x_key, y_key: names of the columns with the x (e.g. easting) and y (e.g. northing) coordinates
+    # - crs_from: coordinate system of the x and y columns
+    # - lat_key, lon_key: names of the columns to add
+    # - chunksize, max_workers: see transform_coords
+    # returns:
+    #   pandas DataFrame
+    (lon, lat) = transform_coords(dataset[x_key].values, dataset[y_key].values, crs_from,
+                   chunksize=chunksize, max_workers=max_workers)
+    dataset[lat_key] = lat
+    dataset[lon_key] = lon
+    return dataset
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--inputfile', required=True, type=os.path.abspath)
+    parser.add_argument('-o', '--outputfile', required=True)
+    parser.add_argument('--delimiter', default=',')
+    parser.add_argument('--x_key', required=True)
+    parser.add_argument('--y_key', required=True)
+    parser.add_argument('--crs', required=True)
+    parser.add_argument('--max_workers', default=1, type=int)
+    args = parser.parse_args()
+    print('Running with following configuration:')
+    for arg in vars(args): print(f'  - {arg}: {getattr(args, arg)}')
+
+    # load input file, convert coordinates and write output file
+    dataset = pd.read_csv(args.inputfile, sep=args.delimiter)
+    dataset = add_latlon(dataset, args.x_key, args.y_key, args.crs, max_workers=args.max_workers)
+    dataset.to_csv(args.outputfile, sep=args.delimiter, index=False)
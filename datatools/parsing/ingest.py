@@ -0,0 +1,133 @@
+###############################################
+# Read large csv files in chunks with filters #
+###############################################
+# The raw tree inventories of full cities can be large,
+# while only a few columns and a small fraction of the rows are needed.
+# The functions below read a csv file in chunks of limited size,
+# and apply the filters and other processing steps to each chunk,
+# so that only the surviving rows are kept in memory.
+
+
+# import external modules
+import os
+import sys
+import argparse
+import pandas as pd
+
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+topdir = os.path.abspath(os.path.join(thisdir, '../..'))
+sys.path.append(topdir)
+
+# local imports
+from datatools.filtering.filter import parse_filters
+from datatools.filtering.filter import get_filter_mask
+from datatools.filtering.filter import make_filter_summary
+from datatools.filtering.filter import print_filter_summary
+
+
+def get_usecols(columns=None, filters=None):
+    # get a function that selects the columns to read from a csv file
+    # input arguments:
+    # - columns: list of column names needed for processing
+    # - filters: list of filters (their columns are added)
+    # returns:
+    #   function that takes a column name and returns whether it is needed,
+    #   or None if all columns are needed (i.e. if columns is None)
+    # (note: a function is used rather than a list, so that column names
+    #  that are not present in a file are ignored rather than raising an error)
+    if columns is None: return None
+    needed = set(columns)
+    if filters is not None: needed.update([f.column_name for f in filters])
+    return lambda column: column in needed
+
+
+def read_dataset(inputfile,
+        columns = None,
+        dtype = None,
+        filters = None,
+        steps = None,
+        chunksize = 100000,
+        verbose = False,
+        **kwargs):
+    '''
+    Read a csv file in chunks, keeping only the entries that pass the filters.
+    Input arguments:
+    - inputfile: path to the csv file.
+    - columns: list of column names to read (default: all columns);
+      the columns needed by the filters are added automatically,
+      and columns that are not present in the file are ignored.
+    - dtype: dict mapping column names to dtypes (e.g. 'float64'), passed to pandas.read_csv.
+    - filters: list of filters and/or paths to filter json files (see datatools/filtering).
+    - steps: list of functions taking a dataframe as input and returning a dataframe
+      (e.g. parsing of the coordinates), applied in order to each filtered chunk.
+    - chunksize: number of rows per chunk.
+    - verbose: whether to print the available values and the number of entries
+      after each filter (summed over all chunks).
+    - kwargs: passed to pandas.read_csv (e.g. sep).
+    Returns:
+    - pandas DataFrame with the filtered and processed entries of all chunks
+      (if no entries are left, an empty dataframe with the columns after processing).
+    '''
+    filters = parse_filters(filters) if filters is not None else []
+    usecols = get_usecols(columns=columns, filters=filters)
+    if verbose:
+        print(f'Reading {inputfile} in chunks of {chunksize} rows...')
+        if len(filters) > 0:
+            print('Found following filters:')
+            for dffilter in filters: print(dffilter)
+    steps = steps if steps is not None else []
+    summary = make_filter_summary(filters) if verbose else None
+    parts = []
+    nread = 0
+    empty = pd.DataFrame()
+    with pd.read_csv(inputfile, usecols=usecols, dtype=dtype,
+            chunksize=chunksize, **kwargs) as reader:
+        for chunk in reader:
+            nread += len(chunk)
+            empty = chunk.iloc[:0]
+            if len(filters) > 0:
+                chunk = chunk[get_filter_mask(chunk, filters, summary=summary)]
+            for step in steps:
+                if len(chunk)==0: break
+                chunk = step(chunk)
+            if len(chunk) > 0: parts.append(chunk)
+    if len(parts) > 0: dataset = pd.concat(parts, ignore_index=True)
+    else:
+        # run the processing steps on an empty chunk,
+        # so that the result has the same columns as a non-empty one
+        dataset = empty
+        for step in steps: dataset = step(dataset)
+    if verbose:
+        if len(filters) > 0: print_filter_summary(summary)
+        print(f'Read {nread} entries, of which {len(dataset)} were kept.')
+        print('Column names:')
+        print(dataset.columns.values)
+    return dataset
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--inputfile', required=True, type=os.path.abspath)
+    parser.add_argument('-o', '--outputfile', default=None)
+    parser.add_argument('--delimiter', default=',')
+    parser.add_argument('--columns', default=None, nargs='+')
+    parser.add_argument('--filters', default=None, nargs='+')
+    parser.add_argument('--chunksize', default=100000, type=int)
+    args = parser.parse_args()
+    print('Running with following configuration:')
+    for arg in vars(args): print(f'  - {arg}: {getattr(args, arg)}')
+
+    # read and filter input file
+    dataset = read_dataset(args.inputfile,
+                columns = args.columns,
+                filters = args.filters,
+                chunksize = args.chunksize,
+                sep = args.delimiter,
+                verbose = True)
+
+    # write output file
+    if args.outputfile is not None:
+        dataset.to_csv(args.outputfile, sep=args.delimiter, index=False)
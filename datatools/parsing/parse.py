@@ -15,7 +15,7 @@ def parse(dataset, lat_column=None, lon_column=None, rename=None, extra_columns=
 
     # remove unneeded columns
     keep = list(rename.values()) + ['lat', 'lon']
-    if extra_columns is not None: keep += extra_column
+    if extra_columns is not None: keep += extra_columns
     drop = [c for c in dataset.columns.values if c not in keep]
     dataset.drop(columns=drop, inplace=True)
 
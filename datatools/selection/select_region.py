@@ -0,0 +1,122 @@
+##########################################################
+# Make a selection based on a polygon or a circular area #
+##########################################################
+# The selections use a grid index (see spatialindex.py),
+# which can be passed explicitly to make many selections on the same dataset.
+
+
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+topdir = os.path.abspath(os.path.join(thisdir, '../..'))
+sys.path.append(topdir)
+
+# local imports
+from datatools.selection.spatialindex import SpatialIndex
+
+
+def read_polygons(polygonfile):
+    # read polygons from a json file
+    # input arguments:
+    # - polygonfile: path to a json file with either a list of [lon, lat] vertices,
+    #   or a GeoJSON object with Polygon or MultiPolygon geometries
+    #   (only the outer ring of each polygon is used, holes are ignored)
+    # returns:
+    #   list of numpy arrays of [lon, lat] vertices
+    with open(polygonfile, 'r') as f: data = json.load(f)
+    if isinstance(data, list): return [np.array(data, dtype=float)]
+    if data.get('type', None)=='FeatureCollection':
+        geometries = [feature['geometry'] for feature in data['features']]
+    elif data.get('type', None)=='Feature': geometries = [data['geometry']]
+    else: geometries = [data]
+    polygons = []
+    for geometry in geometries:
+        if geometry['type']=='Polygon': rings = [geometry['coordinates'][0]]
+        elif geometry['type']=='MultiPolygon': rings = [polygon[0] for polygon in geometry['coordinates']]
+        else: raise Exception('Geometry type {} not recognized.'.format(geometry['type']))
+        polygons += [np.array(ring, dtype=float) for ring in rings]
+    return polygons
+
+
+def select_polygon(dataset, polygon, lat_key='lat', lon_key='lon', index=None, verbose=False):
+    # select the entries inside a polygon
+    # input arguments:
+    # - dataset: pandas DataFrame
+    # - polygon: list of coordinates formatted as {'lon': longitude, 'lat': latitude},
+    #   or an array of [lon, lat] vertices
+    # - lat_key, lon_key: names of the columns with latitude and longitude
+    # - index: SpatialIndex of the dataset (if None, a new one is made)
+    # returns:
+    #   pandas DataFrame with the selected entries (with their original index)
+    if index is None: index = SpatialIndex.from_dataset(dataset, lat_key=lat_key, lon_key=lon_key)
+    norig = len(dataset)
+    dataset = dataset.iloc[index.query_polygon(polygon)]
+    if verbose:
+        print(f'INFO in select_polygon: selected {len(dataset)} out of {norig} instances.')
+    return dataset
+
+
+def select_radius(dataset, lat, lon, radius, lat_key='lat', lon_key='lon', index=None, verbose=False):
+    # select the entries within a given distance from a center point
+    # input arguments:
+    # - dataset: pandas DataFrame
+    # - lat, lon: coordinates of the center point
+    # - radius: maximum distance (in meter)
+    # - lat_key, lon_key: names of the columns with latitude and longitude
+    # - index: SpatialIndex of the dataset (if None, a new one is made)
+    # returns:
+    #   pandas DataFrame with the selected entries (with their original index)
+    if index is None: index = SpatialIndex.from_dataset(dataset, lat_key=lat_key, lon_key=lon_key)
+    norig = len(dataset)
+    dataset = dataset.iloc[index.query_radius(float(lat), float(lon), float(radius))]
+    if verbose:
+        print(f'INFO in select_radius: selected {len(dataset)} out of {norig} instances.')
+    return dataset
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--inputfile', required=True, type=os.path.abspath)
+    parser.add_argument('-o', '--outputfile', default=None)
+    parser.add_argument('--delimiter', default=',')
+    parser.add_argument('--lat_key', default='lat')
+    parser.add_argument('--lon_key', default='lon')
+    parser.add_argument('--polygon', default=None, type=os.path.abspath)
+    parser.add_argument('--center', default=None, nargs=2, type=float, metavar=('LAT', 'LON'))
+    parser.add_argument('--radius', default=None, type=float)
+    args = parser.parse_args()
+    print('Running with following configuration:')
+    for arg in vars(args): print(f'  - {arg}: {getattr(args, arg)}')
+    if (args.polygon is None) == (args.center is None):
+        raise Exception('Provide either a polygon file or a center point and radius.')
+    if args.center is not None and args.radius is None:
+        raise Exception('A radius is required in combination with a center point.')
+
+    # load input file
+    dataset = pd.read_csv(args.inputfile, sep=args.delimiter)
+    print('Loaded dataset {}'.format(args.inputfile))
+    print('Number of entries: {}'.format(len(dataset)))
+
+    # do selections
+    # (note: for multiple polygons, the entries inside any of them are selected)
+    index = SpatialIndex.from_dataset(dataset, lat_key=args.lat_key, lon_key=args.lon_key)
+    if args.polygon is not None:
+        ids = index.query_polygons(read_polygons(args.polygon))
+        dataset = dataset.iloc[np.unique(np.concatenate(ids))]
+    else:
+        dataset = select_radius(dataset, args.center[0], args.center[1], args.radius, index=index)
+
+    # do printout
+    print('Selected {} entries'.format(len(dataset)))
+
+    # write output file
+    if args.outputfile is not None:
+        dataset.to_csv(args.outputfile, sep=args.delimiter, index=False)
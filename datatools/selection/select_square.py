@@ -6,6 +6,7 @@
 import os
 import sys
 import argparse
+import numpy as np
 import pandas as pd
 
 
@@ -17,10 +18,17 @@ def select_square(dataset,
     if lat_key is None: lat_key = 'lat'
     if lon_key is None: lon_key = 'lon'
     norig = len(dataset)
-    if lat_min is not None: dataset = dataset[dataset[lat_key] > float(lat_min)]
-    if lat_max is not None: dataset = dataset[dataset[lat_key] < float(lat_max)]
-    if lon_min is not None: dataset = dataset[dataset[lon_key] > float(lon_min)]
-    if lon_max is not None: dataset = dataset[dataset[lon_key] < float(lon_max)]
+    # (note: all bounds are combined in a single mask, so the dataset is only copied once)
+    mask = np.ones(norig, dtype=bool)
+    if lat_min is not None or lat_max is not None:
+        lat = dataset[lat_key].values.astype(float)
+        if lat_min is not None: mask &= (lat > float(lat_min))
+        if lat_max is not None: mask &= (lat < float(lat_max))
+    if lon_min is not None or lon_max is not None:
+        lon = dataset[lon_key].values.astype(float)
+        if lon_min is not None: mask &= (lon > float(lon_min))
+        if lon_max is not None: mask &= (lon < float(lon_max))
+    dataset = dataset[mask]
     nafter = len(dataset)
     if verbose:
         print(f'INFO in select_square: selected {nafter} out of {norig} instances.')
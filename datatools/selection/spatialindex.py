@@ -0,0 +1,120 @@
+##########################################
+# Grid index for fast spatial selections #
+##########################################
+# The points of a dataset are assigned to the cells of a regular grid
+# (in a local flat projection), and sorted by cell.
+# A region query then only needs to check the points in the cells
+# that overlap with the bounding box of the region,
+# so that many regions can be selected without rescanning the full dataset.
+
+
+# import external modules
+import os
+import sys
+import numpy as np
+
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+topdir = os.path.abspath(os.path.join(thisdir, '../..'))
+sys.path.append(topdir)
+
+# local imports
+from tools.distance import haversine_array
+from tools.geometrytools import coords_to_array
+from tools.geometrytools import project_local
+from tools.geometrytools import points_in_polygon
+
+
+class SpatialIndex(object):
+    # grid index over a set of points
+    # input arguments:
+    # - lat, lon: 1D numpy arrays with latitudes and longitudes
+    #   (points with missing coordinates are never selected)
+    # - cellsize: size of the grid cells (in meter)
+    # note: all query methods return a sorted 1D numpy array of indices of the selected points.
+
+    def __init__(self, lat, lon, cellsize=100):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.cellsize = cellsize
+        valid = np.nonzero(~np.isnan(self.lat) & ~np.isnan(self.lon))[0]
+        self.ref_lat = np.mean(self.lat[valid]) if len(valid) > 0 else 0.
+        # assign points to cells
+        xy = project_local(np.column_stack((self.lon[valid], self.lat[valid])), ref_lat=self.ref_lat)
+        self.origin = np.min(xy, axis=0) if len(valid) > 0 else np.zeros(2)
+        cells = np.floor((xy - self.origin) / cellsize).astype(np.int64)
+        self.ncols = int(np.max(cells[:, 0])) + 1 if len(valid) > 0 else 1
+        self.nrows = int(np.max(cells[:, 1])) + 1 if len(valid) > 0 else 1
+        keys = cells[:, 1] * self.ncols + cells[:, 0]
+        # sort points by cell, and store the position of the first point of each cell
+        order = np.argsort(keys, kind='stable')
+        self.order = valid[order]
+        (self.keys, starts) = np.unique(keys[order], return_index=True)
+        self.bounds = np.append(starts, len(order))
+
+    @classmethod
+    def from_dataset(cls, dataset, lat_key='lat', lon_key='lon', cellsize=100):
+        # make a spatial index for a pandas DataFrame
+        return cls(dataset[lat_key].values, dataset[lon_key].values, cellsize=cellsize)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def candidates(self, lat_min, lat_max, lon_min, lon_max):
+        # get the indices of the points in the grid cells overlapping with a bounding box
+        # (note: the cells of each grid row within the bounding box have consecutive keys,
+        #  so their points form a single contiguous slice of the sorted points.)
+        corners = project_local(np.array([[lon_min, lat_min], [lon_max, lat_max]]), ref_lat=self.ref_lat)
+        (col_min, row_min) = np.floor((corners[0] - self.origin) / self.cellsize).astype(np.int64)
+        (col_max, row_max) = np.floor((corners[1] - self.origin) / self.cellsize).astype(np.int64)
+        col_min = max(col_min, 0)
+        row_min = max(row_min, 0)
+        col_max = min(col_max, self.ncols - 1)
+        row_max = min(row_max, self.nrows - 1)
+        if col_min > col_max or row_min > row_max: return np.zeros(0, dtype=int)
+        rows = np.arange(row_min, row_max + 1)
+        first = np.searchsorted(self.keys, rows * self.ncols + col_min, side='left')
+        last = np.searchsorted(self.keys, rows * self.ncols + col_max, side='right')
+        slices = [self.order[self.bounds[a]:self.bounds[b]] for a, b in zip(first, last) if b > a]
+        if len(slices)==0: return np.zeros(0, dtype=int)
+        return np.concatenate(slices)
+
+    def query_bbox(self, lat_min=None, lat_max=None, lon_min=None, lon_max=None):
+        # select the points strictly inside a bounding box
+        # (note: bounds that are None are not applied)
+        lat_min = -90. if lat_min is None else float(lat_min)
+        lat_max = 90. if lat_max is None else float(lat_max)
+        lon_min = -180. if lon_min is None else float(lon_min)
+        lon_max = 180. if lon_max is None else float(lon_max)
+        ids = self.candidates(lat_min, lat_max, lon_min, lon_max)
+        lat = self.lat[ids]
+        lon = self.lon[ids]
+        mask = (lat > lat_min) & (lat < lat_max) & (lon > lon_min) & (lon < lon_max)
+        return np.sort(ids[mask])
+
+    def query_radius(self, lat, lon, radius):
+        # select the points within a given distance (in meter) from a center point
+        r = 6371000 # (in meter)
+        p = np.pi / 180.
+        dlat = radius / (r * p)
+        dlon = radius / (r * p * max(np.cos(min(abs(lat) + dlat, 90.) * p), 1e-12))
+        ids = self.candidates(lat - dlat, lat + dlat, lon - dlon, lon + dlon)
+        mask = (haversine_array(lat, lon, self.lat[ids], self.lon[ids]) <= radius)
+        return np.sort(ids[mask])
+
+    def query_polygon(self, polygon):
+        # select the points inside a polygon
+        # (polygon: list of coordinates formatted as {'lon': longitude, 'lat': latitude},
+        #  or an array of [lon, lat] vertices)
+        polygon = coords_to_array(polygon)
+        (lon_min, lat_min) = np.min(polygon, axis=0)
+        (lon_max, lat_max) = np.max(polygon, axis=0)
+        ids = self.candidates(lat_min, lat_max, lon_min, lon_max)
+        mask = points_in_polygon(np.column_stack((self.lon[ids], self.lat[ids])), polygon)
+        return np.sort(ids[mask])
+
+    def query_polygons(self, polygons):
+        # select the points inside each of a list of polygons
+        # returns:
+        #   list of sorted 1D numpy arrays of indices, one for each polygon
+        return [self.query_polygon(polygon) for polygon in polygons]
@@ -23,11 +23,13 @@ from python.distancematrix import get_distance_matrix
 from python.distancematrix import plot_distance_matrix
 from python.route import get_route_coords
 from python.route import plot_route_coords
+from python.route import RouteLegCache
+from python.route import simplify_route
 from tools.kmltools import coords_to_kml
 from tools.tsptools import solve_tsp
 
 
-def make_plot(df, highlight_idx=None, selected_ids=None):
+def make_plot(df, highlight_idx=None, selected_ids=None, route_coords=None):
 
     # add some plot info to df
     df['color'] = 'blue'
@@ -57,6 +59,14 @@ def make_plot(df, highlight_idx=None, selected_ids=None):
                 size='size', size_max=10,
                 hover_data=hover_data,
                 zoom=10, height=600, width=900)
+
+    # add route
+    # (note: hovering is disabled to not interfere with the click callback)
+    if route_coords is not None:
+        fig.add_trace(go.Scattermapbox(
+                lon=route_coords[:, 0], lat=route_coords[:, 1],
+                mode='lines', line={'color': 'blue'},
+                hoverinfo='skip', showlegend=False))
     
     # plot aesthetic settings
     fig.update_layout(mapbox_style="open-street-map") # map style
@@ -67,7 +77,10 @@ def make_plot(df, highlight_idx=None, selected_ids=None):
 
 class SakuraRunApp():
 
-    def __init__(self, df):
+    def __init__(self, df, plot_tolerance=5):
+        # input arguments:
+        # - df: dataframe with locations
+        # - plot_tolerance: tolerance (in meter) for simplifying the route before plotting
         
         # initialize the app
         self.app = Dash()
@@ -76,11 +89,15 @@ class SakuraRunApp():
         self.df = df.copy()
         self.selected_ids = list(range(len(self.df)))
         self.highlight_idx = None
+        self.route_coords = None
+        self.plot_tolerance = plot_tolerance
         self.mapfig = self.make_map()
 
         # initialize other properties
         self.session = requests.Session()
         self.distance_matrix = None
+        self.coords = None
+        self.route_cache = RouteLegCache()
 
         # define components
         self.titlediv = html.Div(children="Sakura Run")
@@ -134,6 +151,8 @@ class SakuraRunApp():
                 # select or deselect chosen idx
                 if idx in self.selected_ids: self.selected_ids.remove(idx)
                 else: self.selected_ids.append(idx)
+                # remove the route (if any) as it is no longer valid
+                self.route_coords = None
                 # make a new figure
                 self.mapfig = self.make_map()
                 return self.mapfig
@@ -187,6 +206,7 @@ class SakuraRunApp():
 
             # select coordinates from currently selected indices
             coords = [coords[idx] for idx in self.selected_ids]
+            self.coords = coords
 
             # calculate distance matrix
             self.distance_matrix = get_distance_matrix(
@@ -206,28 +226,39 @@ class SakuraRunApp():
         @callback(
             Output(component_id='route_result_div', component_property='children',
                    allow_duplicate=True),
+            Output(component_id='mapdiv', component_property='figure',
+                   allow_duplicate=True),
             Input(component_id='route_calc_button', component_property='n_clicks'),
             prevent_initial_call=True,
         )
         def calculate_route(nclicks):
             if self.distance_matrix is None:
                 msg = f'ERROR: cannot calculate route as distance matrix is not yet set.'
-                return msg
+                return msg, dash.no_update
 
             # optimization of route
             (ids, dist) = solve_tsp(self.distance_matrix, method='local')
 
-            # todo: calculate actual route and plot
+            # calculate actual route
+            # (note: legs that were already calculated for a previous selection are re-used)
+            coords = [self.coords[idx] for idx in ids]
+            (route_coords, route_info) = get_route_coords(coords,
+                    session=self.session, chunksize=5, cache=self.route_cache)
 
-            msg = 'Shortest route: {:.3f} km'.format(dist/1000)
-            return msg
+            # plot route
+            self.route_coords = simplify_route(route_coords, self.plot_tolerance, stops=coords)
+            self.mapfig = self.make_map()
+
+            msg = 'Shortest route: {:.3f} km'.format(route_info['distance']/1000)
+            return msg, self.mapfig
 
     def make_map(self):
         # helper function of initializer to make the map figure
         figure = make_plot(
                    self.df,
                    highlight_idx=self.highlight_idx,
-                   selected_ids=self.selected_ids)
+                   selected_ids=self.selected_ids,
+                   route_coords=self.route_coords)
         return figure
 
     def make_layout(self):
@@ -11,10 +11,7 @@ import os
 import sys
 import math
 import numpy as np
-import pandas as pd
 import requests
-import plotly.express as px
-import plotly.graph_objects as go
 
 # set path for local imports
 thisdir = os.path.dirname(os.path.abspath(__file__))
@@ -27,6 +24,9 @@ from api.api_key import API_KEY
 from api.requests import graphhopper_request
 from tools.distance import haversine
 from python.kmeans import cluster_kmeans
+from tools.profiletools import profiled
+from tools.plottools import map_trace
+from tools.plottools import map_figure
 
 
 def get_distance_matrix(coords,
@@ -35,6 +35,7 @@ def get_distance_matrix(coords,
         blocksize=None,
         geodesic=False,
         kmeans=False,
+        limiter=None,
         to_coords=None):
     # get the distance matrix between a set of coordinates
     # input arguments:
@@ -55,6 +56,8 @@ def get_distance_matrix(coords,
     # - kmeans: use k-means clustering before calculating distances.
     #   - intra-cluster distances are calculated with GraphHopper.
     #   - extra-cluster distances: distance between cluster centers + from coords to their centroids.
+    # - limiter: QuotaLimiter object (see api/requests.py), e.g. to share the quota
+    #   with other threads making GraphHopper requests.
     # - to_coords: currently only for internal use, do not call.
     # returns:
     #   numpy array with distances in meter;
@@ -106,7 +109,7 @@ def get_distance_matrix(coords,
                 thiscoords = [coords[i], coords[j]]
                 # calculate distance between two points
                 temp = get_distance_matrix(thiscoords,
-                        session=session, profile=profile)
+                        session=session, profile=profile, limiter=limiter)
                 distances[i,j] = temp[0,1]
                 distances[j,i] = temp[1,0]
         return distances
@@ -131,7 +134,7 @@ def get_distance_matrix(coords,
                 to_coords = coords[j:j+blocksize]
                 # calculate distance between blocks of points
                 temp = get_distance_matrix(from_coords,
-                        session=session, profile=profile,
+                        session=session, profile=profile, limiter=limiter,
                         to_coords=to_coords)
                 distances[i:i+blocksize,j:j+blocksize] = temp
                 distances[j:j+blocksize,i:i+blocksize] = temp.transpose()
@@ -151,7 +154,7 @@ def get_distance_matrix(coords,
             json.pop('points')
             json['from_points'] = points
             json['to_points'] = to_points
-        response = graphhopper_request(session, json, API_KEY, service='matrix')
+        response = graphhopper_request(session, json, API_KEY, service='matrix', limiter=limiter)
         distances = np.array(response['distances'])
         return distances
     
@@ -161,6 +164,7 @@ def get_distance_matrix(coords,
         raise Exception(msg)
 
 
+@profiled('matrix/geodesic')
 def get_geodesic_distance_matrix(coords, verbose=True):
     # get simple geodesic distance matrix
     size = len(coords)
@@ -181,9 +185,39 @@ def get_geodesic_distance_matrix(coords, verbose=True):
     return distances
 
 
+def get_plot_edges(distances, mode='matrix', k_nearest=None):
+    # get the edges to plot for a distance matrix
+    # input arguments:
+    # - distances: distance matrix in np array format
+    # - mode, k_nearest: see plot_distance_matrix
+    # returns:
+    #   a tuple of two 1D numpy arrays with the start and end index of each edge
+    # note: differences between i,j and j,i are ignored for now
+    n = distances.shape[0]
+    if mode=='route':
+        start = np.arange(n)
+        return (start, (start+1) % n)
+    if mode!='matrix':
+        raise Exception('Plotting mode {} not recognized.'.format(mode))
+    if k_nearest is not None and k_nearest < 1:
+        raise Exception('k_nearest must be at least 1 (or None), found {}.'.format(k_nearest))
+    if k_nearest is None or k_nearest >= n-1: return np.triu_indices(n, k=1)
+    # keep only the k shortest edges for each node
+    tempdist = np.array(distances, dtype=float)
+    np.fill_diagonal(tempdist, np.inf)
+    nearest = np.argpartition(tempdist, k_nearest-1, axis=1)[:, :k_nearest]
+    start = np.repeat(np.arange(n), k_nearest)
+    end = nearest.ravel()
+    # remove duplicates (i.e. edges that are among the k shortest for both nodes)
+    edges = np.unique(np.column_stack((np.minimum(start, end), np.maximum(start, end))), axis=0)
+    return (edges[:, 0], edges[:, 1])
+
+
 def plot_distance_matrix(coords,
         distances = None,
         mode = 'matrix',
+        k_nearest = None,
+        map_type = None,
         **kwargs):
     # make a visual representation of the distance matrix
     # if no distances are provided, calculate them on the fly
@@ -194,72 +228,37 @@ def plot_distance_matrix(coords,
     #   - matrix: default, plot coordinates and all distances between them
     #   - route: plot only the distances used in the shortest path.
     #     this assumes the input coords have already been ordered according to the shortest path.
+    # - k_nearest: in matrix mode, plot only the k shortest edges for each node
+    #   (default: plot all edges)
+    # - map_type: see tools/plottools.py
     # - kwargs: passed down to get_distance_matrix if needed
-    if distances is None: distances = get_distances_matrix(coords, **kwargs)
+    # note: all edges are drawn as a single trace (with NaN values separating them),
+    #       which keeps the plot responsive for a large number of points.
+    if distances is None: distances = get_distance_matrix(coords, **kwargs)
     # format coordinates
-    lon = [float(coord['lon']) for coord in coords]
-    lat = [float(coord['lat']) for coord in coords]
-    # put coordinates in a dataframe
-    df_coords = pd.DataFrame({'node': np.arange(len(coords))})
-    df_coords['lat'] = lat
-    df_coords['lon'] = lon
-    df_coords['color'] = 'red'
-    df_coords['size'] = 1
-    df_coords['order'] = np.array(list(range(len(coords))))
+    lon = np.array([float(coord['lon']) for coord in coords])
+    lat = np.array([float(coord['lat']) for coord in coords])
     show_order = (mode=='route')
-    # put connecting lines in a list of dataframes
-    # note: differences between i,j and j,i are ignored for now
-    dfs = []
-    for i in range(distances.shape[0]):
-        if mode=='matrix':
-            for j in range(i+1,distances.shape[1]):
-                df = pd.DataFrame({'node': np.arange(2)})
-                df['lat'] = [lat[i], lat[j]]
-                df['lon'] = [lon[i], lon[j]]
-                dfs.append(df)
-        elif mode=='route':
-            j = i+1
-            if i == distances.shape[0]-1: j = 0
-            df = pd.DataFrame({'node': np.arange(2)})
-            df['lat'] = [lat[i], lat[j]]
-            df['lon'] = [lon[i], lon[j]]
-            dfs.append(df)
-    # make a dataframe with transparent points along the edges for displaying text
-    df_text = pd.DataFrame({'node': np.arange(len(dfs))})
-    mid_lat = []
-    mid_lon = []
-    mid_dist = []
-    for i in range(distances.shape[0]):
-        if mode=='matrix':
-            for j in range(i+1,distances.shape[1]):
-                mid_lat.append( (lat[i]+lat[j])/2. )
-                mid_lon.append( (lon[i]+lon[j])/2. )
-                mid_dist.append(distances[i,j])
-        elif mode=='route':
-            j = i+1
-            if i == distances.shape[0]-1: j = 0
-            mid_lat.append( (lat[i]+lat[j])/2. )
-            mid_lon.append( (lon[i]+lon[j])/2. )
-            mid_dist.append(distances[i,j])
-    df_text['lat'] = mid_lat
-    df_text['lon'] = mid_lon
-    df_text['size'] = 1
-    df_text['distance'] = mid_dist
+    # get connecting lines, separated by NaN values
+    (start, end) = get_plot_edges(distances, mode=mode, k_nearest=k_nearest)
+    nans = np.full(len(start), np.nan)
+    line_lat = np.column_stack((lat[start], lat[end], nans)).ravel()
+    line_lon = np.column_stack((lon[start], lon[end], nans)).ravel()
+    # get points along the edges for displaying the distance
+    mid_lat = (lat[start]+lat[end])/2.
+    mid_lon = (lon[start]+lon[end])/2.
+    mid_dist = distances[start, end]
     # plot the coordinates on map
-    tempfig = px.scatter_mapbox(df_text, lat="lat", lon="lon",
-                hover_data={'distance': True, 'size':False, 'lat':False, 'lon':False},
-                size='size', size_max=10)
-    figdata = tempfig.data
-    for df in dfs:
-        tempfig = px.line_mapbox(df, lat="lat", lon="lon")
-        figdata += tempfig.data
-    tempfig = px.scatter_mapbox(df_coords, lat="lat", lon="lon",
-                hover_data={'size':False, 'color':False, 'lat':True, 'lon':True, 'order':show_order},
-                color='color', color_discrete_map='identity',
-                size='size', size_max=10,
-                zoom=8, height=600, width=900)
-    figdata += tempfig.data
-    fig = go.Figure(figdata)
-    fig.update_layout(mapbox_style="open-street-map")
-    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+    traces = []
+    traces.append(map_trace(line_lat, line_lon, map_type=map_type, mode='lines',
+                    line={'color': 'blue', 'width': 1}, hoverinfo='skip'))
+    traces.append(map_trace(mid_lat, mid_lon, map_type=map_type, mode='markers',
+                    marker={'color': 'blue', 'size': 5, 'opacity': 0.5},
+                    customdata=mid_dist, hovertemplate='distance: %{customdata}<extra></extra>'))
+    hovertemplate = 'lat: %{lat}<br>lon: %{lon}'
+    if show_order: hovertemplate += '<br>order: %{customdata}'
+    traces.append(map_trace(lat, lon, map_type=map_type, mode='markers',
+                    marker={'color': 'red', 'size': 10},
+                    customdata=np.arange(len(coords)), hovertemplate=hovertemplate+'<extra></extra>'))
+    fig = map_figure(traces, lat, lon, map_type=map_type)
     fig.show()
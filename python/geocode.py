@@ -0,0 +1,230 @@
+##################################################
+# Tools for finding the coordinates of addresses #
+##################################################
+# This functionality uses the GraphHopper API
+# see documentation here: https://www.graphhopper.com/
+# more specifically here: https://docs.graphhopper.com/#operation/getGeocode
+# The addresses are normalized and deduplicated, and only addresses
+# that are not yet in the (persistent) cache are requested.
+
+
+# external imports
+import os
+import sys
+import re
+import json
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '..')))
+
+# local imports
+from api.requests import graphhopper_get
+from api.requests import QuotaLimiter
+from tools.paralleltools import run_in_parallel
+
+
+def normalize_address(address):
+    # normalize an address, so that different notations of the same address get the same key
+    # (note: text between parentheses, e.g. coordinates, is removed,
+    #  line breaks are replaced by commas, and whitespace and case are normalized.)
+    if not isinstance(address, str): return None
+    address = re.sub(r'\([^)]*\)', ' ', address)
+    address = re.sub(r'\s*[\n,]\s*', ', ', address.strip())
+    address = re.sub(r'\s+', ' ', address).strip(' ,').lower()
+    address = re.sub(r'(, )+', ', ', address)
+    return address if len(address) > 0 else None
+
+
+class GeocodeCache(object):
+    # store of geocoded addresses, keyed by normalized address.
+    # addresses that could not be found are stored as well (with value None),
+    # so that they are not requested again.
+    # input arguments:
+    # - cachefile: path to a .json file for persistent storage (optional)
+
+    def __init__(self, cachefile=None):
+        self.cachefile = cachefile
+        self.addresses = {}
+        self.lock = threading.Lock()
+        if cachefile is not None and os.path.exists(cachefile): self.load(cachefile)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __contains__(self, address):
+        return address in self.addresses
+
+    def get(self, address):
+        # get the coordinates of a normalized address as a dict {'lat': latitude, 'lon': longitude},
+        # or None if it is not in the cache or could not be found
+        return self.addresses.get(address, None)
+
+    def set(self, address, coords):
+        # add a normalized address to the cache
+        with self.lock: self.addresses[address] = coords
+
+    def load(self, cachefile):
+        # add the addresses stored in a .json file
+        with open(cachefile, 'r') as f: self.addresses.update(json.load(f))
+
+    def save(self, cachefile=None):
+        # write all addresses to a .json file
+        # (note: the file is written under a temporary name first,
+        #  so an interrupted write does not leave a corrupt cache file)
+        if cachefile is None: cachefile = self.cachefile
+        if cachefile is None: return
+        cachedir = os.path.dirname(os.path.abspath(cachefile))
+        if not os.path.exists(cachedir): os.makedirs(cachedir)
+        with self.lock:
+            with open(cachefile + '.tmp', 'w') as f: json.dump(self.addresses, f, indent=1)
+            os.replace(cachefile + '.tmp', cachefile)
+
+
+def make_session(max_workers=4):
+    # make a requests.Session with a connection pool large enough for max_workers threads
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def geocode_address(session, address, limiter=None, point=None, base_url=None, key=None):
+    # find the coordinates of a single address
+    # input arguments:
+    # - session: requests.Session object
+    # - address: address in str format
+    # - limiter: QuotaLimiter object shared between all requests (optional)
+    # - point: dict {'lat': latitude, 'lon': longitude} to prefer results near to (optional)
+    # - base_url: base URL of the GraphHopper API (default: see api/requests.py)
+    # - key: GraphHopper API key (default: API_KEY in api/api_key.py,
+    #   which is only imported if no key is given, e.g. not for a local stand-in server)
+    # returns:
+    #   dict {'lat': latitude, 'lon': longitude}, or None if the address was not found
+    #   (an exception is raised if the request failed, so that the address is not
+    #   stored in the cache as not found)
+    if key is None: from api.api_key import API_KEY as key
+    params = {'q': address, 'limit': 1}
+    if point is not None: params['point'] = '{},{}'.format(point['lat'], point['lon'])
+    response = graphhopper_get(session, params, key,
+                 service='geocode', limiter=limiter, base_url=base_url)
+    hits = response.get('hits', None) if isinstance(response, dict) else None
+    if hits is None:
+        raise Exception('Geocoding request for address "{}" failed: {}'.format(address, response))
+    if len(hits)==0: return None
+    return {'lat': float(hits[0]['point']['lat']), 'lon': float(hits[0]['point']['lng'])}
+
+
+def geocode_addresses(addresses, session=None, cache=None,
+        batchsize=100, max_workers=4, limiter=None,
+        point=None, base_url=None, key=None, verbose=True):
+    # find the coordinates of a list of addresses
+    # input arguments:
+    # - addresses: list of addresses in str format
+    # - session: requests.Session object (if None, a new one is created,
+    #   with a connection pool of size max_workers)
+    # - cache: GeocodeCache object; only addresses that are not yet in the cache are requested
+    #   (if None, a new one is created without persistent storage)
+    # - batchsize: number of addresses to request before the cache is saved
+    #   (so that an interrupted or failed run does not lose the results of earlier batches)
+    # - max_workers: maximum number of addresses to request in parallel
+    # - limiter: QuotaLimiter object shared between all requests
+    #   (if None, a new one is created allowing max_workers parallel requests)
+    # - point, base_url, key: see geocode_address
+    # returns:
+    #   a tuple of 1D numpy arrays with latitudes, longitudes and a mask of found addresses
+    #   (addresses that were not found have NaN as latitude and longitude)
+    if session is None: session = make_session(max_workers=max_workers)
+    if cache is None: cache = GeocodeCache()
+    if limiter is None: limiter = QuotaLimiter(max_concurrent=max_workers)
+
+    # normalize and deduplicate addresses
+    normalized = [normalize_address(address) for address in addresses]
+    unique = sorted(set([address for address in normalized if address is not None]))
+    missing = [address for address in unique if address not in cache]
+    if verbose:
+        msg = 'INFO in geocode_addresses: found {} distinct addresses'.format(len(unique))
+        msg += ' ({} not yet in cache).'.format(len(missing))
+        print(msg)
+
+    # request missing addresses in batches
+    for start in range(0, len(missing), batchsize):
+        batch = missing[start:start+batchsize]
+        argsets = [(session, address, limiter, point, base_url, key) for address in batch]
+        results = run_in_parallel(geocode_address, argsets, max_workers=max_workers,
+                    name='address', verbose=verbose)
+        for address, coords in zip(batch, results): cache.set(address, coords)
+        cache.save()
+
+    # get coordinates for all addresses
+    lat = np.full(len(addresses), np.nan)
+    lon = np.full(len(addresses), np.nan)
+    for idx, address in enumerate(normalized):
+        coords = cache.get(address) if address is not None else None
+        if coords is None: continue
+        lat[idx] = coords['lat']
+        lon[idx] = coords['lon']
+    mask = ~np.isnan(lat)
+    if verbose:
+        print('INFO in geocode_addresses: found coordinates for {} out of {} entries.'.format(
+              np.sum(mask), len(addresses)))
+    return (lat, lon, mask)
+
+
+def add_missing_coords(dataset, address_key, lat_key='lat', lon_key='lon',
+        cachefile=None, drop_missing=True, **kwargs):
+    # find the coordinates of entries in a dataframe with missing coordinates, based on their address
+    # input arguments:
+    # - dataset: pandas DataFrame
+    # - address_key: name of the column with addresses
+    # - lat_key, lon_key: names of the columns with latitude and longitude
+    #   (entries with NaN in either are geocoded)
+    # - cachefile: path to a .json file for persistent storage of geocoded addresses (optional)
+    # - drop_missing: whether to remove the entries for which no coordinates were found
+    # - kwargs: passed to geocode_addresses
+    # returns:
+    #   pandas DataFrame
+    missing = (dataset[lat_key].isna() | dataset[lon_key].isna()).values
+    if np.sum(missing) > 0:
+        cache = GeocodeCache(cachefile=cachefile)
+        addresses = dataset[address_key].values[missing]
+        (lat, lon, _) = geocode_addresses(addresses, cache=cache, **kwargs)
+        dataset.loc[missing, lat_key] = lat
+        dataset.loc[missing, lon_key] = lon
+    if drop_missing:
+        found = (dataset[lat_key].notna() & dataset[lon_key].notna()).values
+        dataset = dataset[found]
+    return dataset
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser(description='Find the coordinates of addresses')
+    parser.add_argument('-i', '--inputfile', required=True, type=os.path.abspath)
+    parser.add_argument('-o', '--outputfile', required=True)
+    parser.add_argument('--delimiter', default=',')
+    parser.add_argument('--address_key', required=True)
+    parser.add_argument('--cachefile', default=None)
+    parser.add_argument('--max_workers', default=4, type=int)
+    parser.add_argument('--base_url', default=None)
+    parser.add_argument('--key', default=None)
+    args = parser.parse_args()
+    print('Running with following configuration:')
+    for arg in vars(args): print(f'  - {arg}: {getattr(args, arg)}')
+
+    # load input file, find coordinates and write output file
+    dataset = pd.read_csv(args.inputfile, sep=args.delimiter)
+    (lat, lon, _) = geocode_addresses(dataset[args.address_key].values,
+                      cache=GeocodeCache(cachefile=args.cachefile),
+                      max_workers=args.max_workers, base_url=args.base_url, key=args.key)
+    dataset['lat'] = lat
+    dataset['lon'] = lon
+    dataset.to_csv(args.outputfile, sep=args.delimiter, index=False)
@@ -0,0 +1,42 @@
+######################################################################
+# Tools for selecting the points that can be visited within a budget #
+######################################################################
+# The distance along the road network between two points is never shorter
+# than the geodesic distance between them.
+# This allows to discard points that can certainly not be visited
+# within a given distance budget, before calculating the (expensive) distance matrix.
+
+
+# external imports
+import os
+import sys
+import numpy as np
+
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '..')))
+
+# local imports
+from tools.distance import haversine_array
+
+
+def prune_by_budget(coords, budget, start=0, prizes=None):
+    # find the points that can possibly be visited within a distance budget
+    # input arguments:
+    # - coords: list of coordinates, formatted as {'lon': longitude, 'lat': latitude}
+    # - budget: maximum total distance of the route (in meter)
+    # - start: index of the start (and end) point of the route
+    # - prizes: prize for visiting each point (optional);
+    #   if provided, points without prize are discarded as well
+    # returns:
+    #   numpy array with indices of the remaining points (w.r.t. input coords),
+    #   always including the start point
+    lats = np.array([float(coord['lat']) for coord in coords])
+    lons = np.array([float(coord['lon']) for coord in coords])
+    # a round trip from the start point to each point and back
+    # is at least twice the geodesic distance between them
+    dist = haversine_array(lats[start], lons[start], lats, lons)
+    mask = (2*dist <= budget)
+    if prizes is not None: mask = ((mask) & (np.asarray(prizes) > 0))
+    mask[start] = True
+    return np.nonzero(mask)[0]
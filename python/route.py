@@ -12,10 +12,8 @@ import sys
 import json
 import math
 import numpy as np
-import pandas as pd
 import requests
-import plotly.express as px
-import plotly.graph_objects as go
+import threading
 
 # set path for local imports
 thisdir = os.path.dirname(os.path.abspath(__file__))
@@ -26,9 +24,71 @@ from api.api_key import API_KEY
 
 # local imports
 from api.requests import graphhopper_request
+from api.requests import QuotaLimiter
+from tools.geometrytools import coords_to_array
+from tools.geometrytools import decode_polyline
+from tools.geometrytools import project_local
+from tools.profiletools import profile_stage
+from tools.profiletools import profiled
+from tools.paralleltools import run_in_parallel
+from tools.plottools import map_trace
+from tools.plottools import map_figure
 
 
-def get_route_coords(coords, session=None, profile='foot', chunksize=None):
+class RouteLegCache(object):
+    # store of route legs (i.e. the route between two consecutive points),
+    # keyed by transportation profile and the coordinates of both end points.
+    # a route through a set of points is a sequence of legs,
+    # most of which survive a re-ordering of the points,
+    # so they do not need to be requested again.
+    # input arguments:
+    # - cachefile: path to a .json file for persistent storage (optional)
+
+    def __init__(self, cachefile=None):
+        self.cachefile = cachefile
+        self.legs = {}
+        self.lock = threading.Lock()
+        if cachefile is not None and os.path.exists(cachefile): self.load(cachefile)
+
+    def __len__(self):
+        return len(self.legs)
+
+    @staticmethod
+    def key(profile, coord1, coord2):
+        # make a key for a leg from coord1 to coord2
+        return '{}:{:.6f},{:.6f}:{:.6f},{:.6f}'.format(profile,
+                 float(coord1['lon']), float(coord1['lat']),
+                 float(coord2['lon']), float(coord2['lat']))
+
+    def get(self, profile, coord1, coord2):
+        # get a leg as a tuple of (array of [lon, lat] points, distance),
+        # or None if it is not in the cache
+        return self.legs.get(self.key(profile, coord1, coord2), None)
+
+    def set(self, profile, coord1, coord2, points, distance):
+        # add a leg to the cache
+        with self.lock: self.legs[self.key(profile, coord1, coord2)] = (points, distance)
+
+    def load(self, cachefile):
+        # add the legs stored in a .json file
+        with open(cachefile, 'r') as f: legs = json.load(f)
+        for key, leg in legs.items():
+            self.legs[key] = (np.array(leg['points']).reshape(-1, 2), leg['distance'])
+
+    def save(self, cachefile=None):
+        # write all legs to a .json file
+        # (note: the lock prevents simultaneous writes when the cache is shared between threads)
+        if cachefile is None: cachefile = self.cachefile
+        cachedir = os.path.dirname(os.path.abspath(cachefile))
+        if not os.path.exists(cachedir): os.makedirs(cachedir)
+        with self.lock:
+            legs = {key: {'points': points.tolist(), 'distance': distance}
+                      for key, (points, distance) in self.legs.items()}
+            with open(cachefile, 'w') as f: json.dump(legs, f)
+
+
+def get_route_coords(coords, session=None, profile='foot', chunksize=None,
+        max_workers=4, limiter=None, cache=None, verbose=True):
     # get the route between a set of coordinates
     # input arguments:
     # - coords: list of coordinates, formatted as {'lon': longitude, 'lat': latitude}
@@ -37,31 +97,38 @@ def get_route_coords(coords, session=None, profile='foot', chunksize=None):
     # - chunksize: number of coordinates to put in one chunk, i.e. one API call
     #   (default: do not split in chunks, make one API call for the full coords list)
     #   (use chunksize = 5 or lower to be compatible with a free GraphHopper account)
+    # - max_workers: maximum number of chunks to request in parallel
+    # - limiter: QuotaLimiter object shared between all requests
+    #   (if None, a new one is created allowing max_workers parallel requests)
+    # - cache: RouteLegCache object; if provided, only the legs that are not yet
+    #   in the cache are requested (and added to it)
+    # - verbose: whether to print the progress of the chunks (see run_in_parallel)
     # returns:
-    #   list of coordinates in same format as input
+    #   a tuple with the route as an array of [lon, lat] points
+    #   (see tools/geometrytools.py) and a dict with additional info
     if session is None: session = requests.Session()
+
+    if cache is not None:
+        return get_route_coords_cached(coords, cache, session=session, profile=profile,
+                 chunksize=chunksize, max_workers=max_workers, limiter=limiter, verbose=verbose)
     
     if( chunksize is not None and len(coords)>chunksize ):
         chunksize = int(chunksize)-1
-        nchunks = int(math.ceil((len(coords)-1)/chunksize))
+        # make chunks
         # (note: -1 is because chunks must be overlapping by one point)
-        routecoords = []
-        routeinfo = {'distance': 0.}
-        counter = 0
-        for i in range(0, len(coords)-1, chunksize):
-            # print counter
-            counter += 1
-            msg =''
-            if counter>1: msg += '\033[F'
-            msg += 'Calculating route chunk {} of {}...'.format(counter,nchunks)
-            print(msg)
-            # make chunk and calculate route for this chunk
-            chunk = coords[i:i+chunksize+1]
-            chunkcoords, chunkinfo = get_route_coords(chunk,
-                    session=session, profile=profile)
-            # aggregate results
-            routecoords += chunkcoords
-            routeinfo['distance'] += chunkinfo['distance']
+        chunks = [coords[i:i+chunksize+1] for i in range(0, len(coords)-1, chunksize)]
+        if limiter is None: limiter = QuotaLimiter(max_concurrent=max_workers)
+        # calculate route for all chunks in parallel
+        get_chunk = lambda chunk: get_route_coords(chunk,
+                      session=session, profile=profile, limiter=limiter)
+        results = run_in_parallel(get_chunk, [(chunk,) for chunk in chunks],
+                    max_workers=max_workers, name='route chunk', verbose=verbose)
+        # aggregate results in original order
+        # (note: the first point of each chunk is the same as the last point of the previous one)
+        routecoords = [chunkcoords if idx==0 else chunkcoords[1:]
+                         for idx, (chunkcoords, _) in enumerate(results)]
+        routecoords = np.concatenate(routecoords)
+        routeinfo = {'distance': sum([chunkinfo['distance'] for _, chunkinfo in results])}
         return (routecoords, routeinfo)
     
     else:
@@ -70,49 +137,205 @@ def get_route_coords(coords, session=None, profile='foot', chunksize=None):
           'profile': profile,
           'points': points,
           'instructions': False,
-          'points_encoded': False
+          'points_encoded': True
         } 
-        response = graphhopper_request(session, json, API_KEY, service='route')
-        points = np.array(response['paths'][0]['points']['coordinates'])
-        coords = [{'lon': el[0], 'lat': el[1]} for el in points]
-        distance = response['paths'][0]['distance']
-        info = {'distance': distance}
-        return (coords, info)
+        response = graphhopper_request(session, json, API_KEY, service='route', limiter=limiter)
+        path = response['paths'][0]
+        routecoords = decode_path_points(path)
+        info = {'distance': path['distance']}
+        return (routecoords, info)
+
+
+def decode_path_points(path):
+    # get the points of a path in a GraphHopper route response as an array
+    # input arguments:
+    # - path: element of the 'paths' list in the response
+    # returns:
+    #   array of [lon, lat] points
+    points = path['points']
+    if isinstance(points, str):
+        multiplier = path.get('points_encoded_multiplier', 1e5)
+        with profile_stage('route/decode'):
+            return decode_polyline(points, multiplier=multiplier)
+    return np.array(points['coordinates'], dtype=float)[:, :2]
+
+
+def split_route_legs(path, points):
+    # split the points of a GraphHopper route at the instructions marking
+    # that a via point or the end point was reached
+    # (sign 5 and 4 respectively in GraphHopper's instruction format)
+    # input arguments:
+    # - path: element of the 'paths' list in the response (requested with instructions)
+    # - points: array of [lon, lat] points of the path
+    # returns:
+    #   list of tuples of (array of [lon, lat] points, distance)
+    legs = []
+    start = 0
+    distance = 0.
+    for instruction in path.get('instructions', []):
+        distance += instruction['distance']
+        if instruction['sign'] in [4, 5]:
+            end = instruction['interval'][0]
+            if end < start or end >= len(points): return legs
+            legs.append((points[start:end+1].copy(), distance))
+            start = end
+            distance = 0.
+    return legs
 
 
-def plot_route_coords(coords, route_coords=None, **kwargs):
+def get_route_legs(coords, session=None, profile='foot', limiter=None):
+    # get the separate legs of the route between a set of coordinates in one API call
+    # (note: if the route cannot be split into legs, e.g. because of coinciding
+    #  consecutive points, each leg is requested separately instead.)
+    # input arguments: see get_route_coords
+    # returns:
+    #   list of tuples of (array of [lon, lat] points, distance),
+    #   one for each pair of consecutive coordinates
+    if session is None: session = requests.Session()
+    points = [[el['lon'], el['lat']] for el in coords]
+    json = {
+      'profile': profile,
+      'points': points,
+      'instructions': True,
+      'points_encoded': True
+    }
+    response = graphhopper_request(session, json, API_KEY, service='route', limiter=limiter)
+    path = response['paths'][0]
+    legs = split_route_legs(path, decode_path_points(path))
+    if len(legs)!=len(coords)-1:
+        msg = 'WARNING in get_route_legs: could not split route into legs:'
+        msg += ' found {} legs for {} points;'.format(len(legs), len(coords))
+        msg += ' requesting each leg separately.'
+        print(msg)
+        legs = []
+        for coord1, coord2 in zip(coords[:-1], coords[1:]):
+            (legcoords, leginfo) = get_route_coords([coord1, coord2],
+                                     session=session, profile=profile, limiter=limiter)
+            legs.append((legcoords, leginfo['distance']))
+    return legs
+
+
+def get_route_coords_cached(coords, cache, session=None, profile='foot', chunksize=None,
+        max_workers=4, limiter=None, verbose=True):
+    # get the route between a set of coordinates, re-using legs stored in a RouteLegCache
+    # input arguments: see get_route_coords
+    # returns:
+    #   same as get_route_coords
+    if session is None: session = requests.Session()
+
+    # find legs that are not yet in the cache (each one only once),
+    # and group consecutive missing legs into runs of points
+    missing = set()
+    runs = []
+    for idx in range(len(coords)-1):
+        key = cache.key(profile, coords[idx], coords[idx+1])
+        if key in cache.legs or key in missing:
+            continue
+        missing.add(key)
+        if len(runs)>0 and runs[-1][-1]==idx: runs[-1].append(idx+1)
+        else: runs.append([idx, idx+1])
+
+    # split runs into chunks of at most chunksize points
+    # (note: chunks must be overlapping by one point)
+    chunks = []
+    for run in runs:
+        step = len(run)-1
+        if chunksize is not None: step = max(int(chunksize)-1, 1)
+        for i in range(0, len(run)-1, step):
+            chunks.append([coords[idx] for idx in run[i:i+step+1]])
+
+    # request missing legs in parallel and add them to the cache
+    if len(chunks)>0:
+        if limiter is None: limiter = QuotaLimiter(max_concurrent=max_workers)
+        get_chunk = lambda chunk: get_route_legs(chunk,
+                      session=session, profile=profile, limiter=limiter)
+        results = run_in_parallel(get_chunk, [(chunk,) for chunk in chunks],
+                    max_workers=max_workers, name='route chunk', verbose=verbose)
+        for chunk, legs in zip(chunks, results):
+            for idx, (points, distance) in enumerate(legs):
+                cache.set(profile, chunk[idx], chunk[idx+1], points, distance)
+        if cache.cachefile is not None: cache.save()
+
+    # assemble the route from its legs
+    # (note: the first point of each leg is the same as the last point of the previous one)
+    routecoords = []
+    routeinfo = {'distance': 0.}
+    for idx in range(len(coords)-1):
+        (points, distance) = cache.get(profile, coords[idx], coords[idx+1])
+        if idx>0: points = points[1:]
+        routecoords.append(points)
+        routeinfo['distance'] += distance
+    if len(routecoords)==0: return (np.zeros((0, 2)), routeinfo)
+    return (np.concatenate(routecoords), routeinfo)
+
+
+def plot_route_coords(coords, route_coords=None, map_type=None, **kwargs):
     # make a visual representation of the route
     # if no route is provided, calculate it on the fly
     # input arguments:
-    # - coords: list of coordinates, formatted as {'lon': longitude, 'lat': latitude}
-    # - route_coords: route between coords, in same format as coords
+    # - coords: list of coordinates, formatted as {'lon': longitude, 'lat': latitude},
+    #   or array of [lon, lat] points
+    # - route_coords: route between coords, as an array of [lon, lat] points
+    #   (as returned by get_route_coords; a list in the same format as coords works too)
+    # - map_type: see tools/plottools.py
     # - kwargs: passed down to get_route_coords if needed
     if route_coords is None: route_coords = get_route_coords(coords, **kwargs)[0]
-    # put coordinates in a dataframe
-    lon = [float(coord['lon']) for coord in coords]
-    lat = [float(coord['lat']) for coord in coords]
-    df_coords = pd.DataFrame({'node': np.arange(len(coords))})
-    df_coords['lat'] = lat
-    df_coords['lon'] = lon
-    df_coords['color'] = 'red'
-    df_coords['size'] = 1
-    # put route in a dataframe
-    lon = [float(coord['lon']) for coord in route_coords]
-    lat = [float(coord['lat']) for coord in route_coords]
-    df_route = pd.DataFrame({'node': np.arange(len(route_coords))})
-    df_route['lat'] = lat
-    df_route['lon'] = lon
-    df_route['color'] = 'blue'
+    coords = coords_to_array(coords)
+    route_coords = coords_to_array(route_coords)
     # plot the coordinates on map
-    fig1 = px.line_mapbox(df_route, lat="lat", lon="lon",
-             color='color', color_discrete_map='identity',
-             zoom=8, height=600, width=900)
-    fig2 = px.scatter_mapbox(df_coords, lat="lat", lon="lon",
-             hover_data={'size':False, 'lat':True, 'lon':True},
-             color='color', color_discrete_map='identity',
-             size='size', size_max=10,
-             zoom=8, height=600, width=900)
-    fig = go.Figure(data=fig1.data+fig2.data)
-    fig.update_layout(mapbox_style="open-street-map")
-    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+    traces = []
+    traces.append(map_trace(route_coords[:, 1], route_coords[:, 0], map_type=map_type,
+                    mode='lines', line={'color': 'blue'}, hoverinfo='skip'))
+    traces.append(map_trace(coords[:, 1], coords[:, 0], map_type=map_type,
+                    mode='markers', marker={'color': 'red', 'size': 10},
+                    hovertemplate='lat: %{lat}<br>lon: %{lon}<extra></extra>'))
+    fig = map_figure(traces, coords[:, 1], coords[:, 0], map_type=map_type)
     fig.show()
+
+
+@profiled('route/simplify')
+def simplify_route(route_coords, tolerance, stops=None):
+    # simplify a route using the Douglas-Peucker algorithm,
+    # i.e. remove points that are closer than a given tolerance to the simplified route
+    # input arguments:
+    # - route_coords: route as an array of [lon, lat] points (e.g. output of get_route_coords)
+    # - tolerance: maximum allowed deviation (in meter) of the simplified route
+    # - stops: coordinates of the stops along the route (e.g. tree clusters)
+    #   in any format accepted by tools/geometrytools.coords_to_array;
+    #   the route points closest to the stops are always kept.
+    # returns:
+    #   simplified route as an array of [lon, lat] points
+    route_coords = coords_to_array(route_coords)
+    if tolerance is None or tolerance <= 0 or len(route_coords)<3: return route_coords
+    xy = project_local(route_coords)
+
+    # find points that must be kept
+    keep = np.zeros(len(xy), dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+    if stops is not None:
+        stops = coords_to_array(stops)
+        for stop in project_local(stops, ref_lat=np.mean(route_coords[:, 1])):
+            keep[np.argmin(np.sum((xy-stop)**2, axis=1))] = True
+
+    # iterate over segments between kept points and split them
+    # at the point furthest away, as long as it is further than the tolerance
+    kept = np.nonzero(keep)[0]
+    segments = list(zip(kept[:-1], kept[1:]))
+    while len(segments)>0:
+        (first, last) = segments.pop()
+        if last-first < 2: continue
+        # distance of intermediate points to the segment between first and last
+        a = xy[first]
+        ab = xy[last] - a
+        ap = xy[first+1:last] - a
+        norm = np.dot(ab, ab)
+        t = np.clip(ap @ ab / norm, 0., 1.) if norm > 0 else np.zeros(len(ap))
+        dist = np.sqrt(np.sum((ap - t[:, np.newaxis]*ab)**2, axis=1))
+        idx = np.argmax(dist)
+        if dist[idx] <= tolerance: continue
+        idx = first + 1 + idx
+        keep[idx] = True
+        segments.append((first, idx))
+        segments.append((idx, last))
+    return route_coords[keep]
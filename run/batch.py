@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+###########################################################
+# Calculate optimal sakura runs for many inputs in one go #
+###########################################################
+# The jobs are defined in a manifest (.json file) of the following form:
+# {
+#   "defaults": {"chunksize": 5, "blocksize": 5},
+#   "jobs": [
+#     {"inputfile": "data-gent-clustered.csv",
+#      "profiles": ["foot", "bike"],
+#      "outputfile": "output/gent-{profile}.kml"},
+#     {"inputfile": "data-providence-clustered.csv",
+#      "profile": "foot",
+#      "outputfile": "output/providence.gpx",
+#      "budget": 10}
+#   ]
+# }
+# Each combination of input file and profile is a separate job.
+# Relative paths are interpreted with respect to the directory of the manifest.
+# The options per job (or in "defaults") correspond to the command line arguments
+# of sakurarun.py (see job_options below).
+# The format of the output file (.kml, .kmz, .gpx or .geojson) follows from its extension.
+#
+# All GraphHopper requests (distance matrices and routes) of all jobs
+# are sent through one shared session and quota limiter,
+# while the shortest path calculations are run in a pool of processes.
+
+
+# external imports
+import os
+import sys
+import json
+import copy
+import numpy as np
+import requests
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '..')))
+
+# local imports
+from api.requests import QuotaLimiter
+from python.distancematrix import get_distance_matrix
+from python.route import get_route_coords
+from python.route import RouteLegCache
+from python.route import simplify_route
+from tools.exporttools import write_route
+from tools.checkpointtools import Checkpointer
+from run.sakurarun import read_locations
+from run.sakurarun import make_stage_keys
+from run.sakurarun import find_shortest_path
+from run.sakurarun import cross_check
+from run.sakurarun import can_cross_check
+
+
+# options per job and their default values
+job_options = {
+  'inputfile': None,
+  'outputfile': None,
+  'profile': 'foot',
+  'delimiter': ',',
+  'lat_key': 'lat',
+  'lon_key': 'lon',
+  'budget': None,
+  'prize_key': 'num',
+  'start_index': 0,
+  'threshold': 0.05,
+  'blocksize': None,
+  'geodesic_distance_matrix': False,
+  'kmeans_distance_matrix': False,
+  'chunksize': None,
+  'simplify_kml': 0
+}
+
+
+def read_manifest(manifestfile):
+    # read a manifest and expand it into a list of jobs
+    # returns:
+    #   list of dicts with a value for each key in job_options
+    with open(manifestfile, 'r') as f: manifest = json.load(f)
+    manifestdir = os.path.dirname(os.path.abspath(manifestfile))
+    defaults = copy.deepcopy(job_options)
+    defaults.update(manifest.get('defaults', {}))
+    jobs = []
+    for jobdict in manifest['jobs']:
+        jobdict = copy.deepcopy(jobdict)
+        profiles = jobdict.pop('profiles', [jobdict.pop('profile', defaults['profile'])])
+        for key in jobdict.keys():
+            if key not in job_options:
+                msg = f'WARNING: key {key} not recognized and will be ignored.'
+                print(msg)
+        for profile in profiles:
+            job = copy.deepcopy(defaults)
+            job.update({key: val for key, val in jobdict.items() if key in job_options})
+            job['profile'] = profile
+            if job['inputfile'] is None:
+                raise Exception('Job {} does not specify an input file.'.format(jobdict))
+            if job['outputfile'] is None:
+                job['outputfile'] = os.path.splitext(job['inputfile'])[0] + '-{profile}.kml'
+            job['outputfile'] = job['outputfile'].format(profile=profile)
+            for key in ['inputfile', 'outputfile']:
+                job[key] = os.path.join(manifestdir, job[key])
+            jobs.append(job)
+    return jobs
+
+
+def solve_job(distances, tour=None, budget=None, prizes=None, start=0, check_methods=None):
+    # calculate the shortest path and cross-check it (for use in a process pool)
+    # input arguments:
+    # - distances: distance matrix
+    # - tour: tuple of path indices and distance, if already known (e.g. from a checkpoint)
+    # - budget, prizes, start: see find_shortest_path in sakurarun.py
+    # - check_methods: methods to cross-check with (if None, no cross-check is done)
+    # returns:
+    #   a tuple with the path indices, distance, and a tuple of the cross-check distances
+    #   and path indices of the best cross-check (w.r.t. the path, as in sakurarun.py),
+    #   or None if no cross-check is done
+    # note: if the cross-check finds a shorter path, this path is returned instead
+    if tour is None: tour = find_shortest_path(distances, budget=budget, prizes=prizes, start=start)
+    (ids, dist) = tour
+    check = None
+    if check_methods is not None and can_cross_check(len(ids)-1, budget=budget):
+        check_results = cross_check(distances[np.ix_(ids[:-1], ids[:-1])], check_methods)
+        check_dists = [check_dist for _, check_dist in check_results]
+        best = int(np.argmin(check_dists))
+        check = (check_dists, check_results[best][0])
+        if check_dists[best] < dist - 1e-6:
+            (ids, dist) = ([ids[idx] for idx in check_results[best][0]], check_dists[best])
+    return (ids, dist, check)
+
+
+if __name__=='__main__':
+
+    # read command line arguments
+    parser = argparse.ArgumentParser(description='Calculate optimal sakura runs in batch')
+    parser.add_argument('-m', '--manifest', required=True, type=os.path.abspath,
+            help='Manifest (.json) with jobs to run.')
+    parser.add_argument('--max_workers', default=4, type=int,
+            help='Maximum number of GraphHopper requests in parallel (default: 4).')
+    parser.add_argument('--max_requests_per_minute', default=None, type=int,
+            help='Maximum number of GraphHopper requests per minute (default: no limit).')
+    parser.add_argument('--max_processes', default=None, type=int,
+            help='Maximum number of processes for shortest path calculation'
+                +' (default: number of cores).')
+    parser.add_argument('--checkpoint_dir', default=None, type=os.path.abspath,
+            help='Directory for storing the output of each stage (see sakurarun.py).')
+    parser.add_argument('--route_cache', default=None, type=os.path.abspath,
+            help='File (.json) for storing calculated route legs (see sakurarun.py).')
+    args = parser.parse_args()
+
+    # read manifest
+    jobs = read_manifest(args.manifest)
+    print('Found {} jobs in manifest {}.'.format(len(jobs), args.manifest))
+
+    # make shared objects
+    session = requests.Session()
+    limiter = QuotaLimiter(max_concurrent=args.max_workers,
+                max_per_minute=args.max_requests_per_minute)
+    checkpointer = Checkpointer(args.checkpoint_dir)
+    route_cache = RouteLegCache(cachefile=args.route_cache)
+    check_methods = ['annealing']
+
+    # read locations
+    for job in jobs:
+        if job['budget'] is not None: job['budget'] = job['budget']*1000
+        (job['coords'], job['prizes'], job['start']) = read_locations(job['inputfile'],
+                delimiter=job['delimiter'], lat_key=job['lat_key'], lon_key=job['lon_key'],
+                budget=job['budget'], prize_key=job['prize_key'], start_index=job['start_index'])
+        job['check_methods'] = check_methods if job['threshold'] > 0 else None
+        job['keys'] = make_stage_keys(job['coords'], profile=job['profile'],
+                        blocksize=job['blocksize'],
+                        geodesic=job['geodesic_distance_matrix'],
+                        kmeans=job['kmeans_distance_matrix'],
+                        budget=job['budget'], prizes=job['prizes'], start=job['start'],
+                        check_methods=check_methods, chunksize=job['chunksize'])
+
+    # calculate distance matrices
+    print('Calculating distance matrices...')
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        futures = {}
+        for idx, job in enumerate(jobs):
+            job['distances'] = checkpointer.load_array('matrix', job['keys']['matrix'])
+            if job['distances'] is not None: continue
+            futures[idx] = executor.submit(get_distance_matrix, job['coords'],
+                             session=session, profile=job['profile'],
+                             blocksize=job['blocksize'],
+                             geodesic=job['geodesic_distance_matrix'],
+                             kmeans=job['kmeans_distance_matrix'],
+                             limiter=limiter)
+        for idx, future in futures.items():
+            jobs[idx]['distances'] = future.result()
+            checkpointer.save_array('matrix', jobs[idx]['keys']['matrix'], jobs[idx]['distances'])
+
+    # find shortest paths and cross-check them
+    print('Finding shortest paths...')
+    with ProcessPoolExecutor(max_workers=args.max_processes) as executor:
+        futures = {}
+        for idx, job in enumerate(jobs):
+            tour = checkpointer.load('tour', job['keys']['tour'])
+            if tour is not None: tour = ([int(el) for el in tour['ids']], float(tour['dist']))
+            check = None
+            if job['check_methods'] is not None:
+                check = checkpointer.load('crosscheck', job['keys']['crosscheck'])
+            if check is not None: job['check_dists'] = check['dists']
+            futures[idx] = executor.submit(solve_job, job['distances'], tour=tour,
+                             budget=job['budget'], prizes=job['prizes'], start=job['start'],
+                             check_methods=job['check_methods'] if check is None else None)
+        for idx, future in futures.items():
+            job = jobs[idx]
+            (ids, dist, check) = future.result()
+            job['ids'] = ids
+            job['dist'] = dist
+            checkpointer.save('tour', job['keys']['tour'], ids=np.array(ids), dist=np.array(dist))
+            if check is not None:
+                job['check_dists'] = np.array(check[0])
+                checkpointer.save('crosscheck', job['keys']['crosscheck'],
+                        dists=job['check_dists'], ids=np.array(check[1]))
+
+    # calculate routes
+    print('Calculating routes...')
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        futures = {}
+        for idx, job in enumerate(jobs):
+            job['coords'] = [job['coords'][el] for el in job['ids']]
+            route = checkpointer.load('route', job['keys']['route'])
+            if route is not None:
+                job['route'] = (route['coords'], {'distance': float(route['distance'])})
+                continue
+            futures[idx] = executor.submit(get_route_coords, job['coords'],
+                             session=session, profile=job['profile'],
+                             chunksize=job['chunksize'], max_workers=args.max_workers,
+                             limiter=limiter, cache=route_cache, verbose=False)
+        # (note: the routes of multiple jobs are calculated at the same time,
+        #  so one line is printed per job instead of the progress of each one)
+        for idx, future in futures.items():
+            jobs[idx]['route'] = future.result()
+            print('  - calculated route for {} ({})'.format(jobs[idx]['inputfile'], jobs[idx]['profile']))
+            (route_coords, route_info) = jobs[idx]['route']
+            checkpointer.save('route', jobs[idx]['keys']['route'],
+                    coords=route_coords, distance=np.array(route_info['distance']))
+
+    # write output files and print summary
+    print('Summary:')
+    for job in jobs:
+        (route_coords, route_info) = job['route']
+        kml_coords = simplify_route(route_coords, job['simplify_kml'], stops=job['coords'])
+        outputdir = os.path.dirname(job['outputfile'])
+        if not os.path.exists(outputdir): os.makedirs(outputdir)
+        write_route(job['outputfile'], kml_coords, stops=job['coords'][:-1])
+        msg = '  - {} ({}):'.format(job['inputfile'], job['profile'])
+        msg += ' shortest path {:.3f} km,'.format(job['dist']/1000)
+        msg += ' total distance {:.3f} km'.format(route_info['distance']/1000)
+        msg += ' -> {}'.format(job['outputfile'])
+        print(msg)
+        for method, check_dist in zip(check_methods, job.get('check_dists', [])):
+            if np.abs(job['dist']-check_dist)/job['dist'] > job['threshold']:
+                msg = '    WARNING: found more than {}% deviation'.format(job['threshold']*100)
+                msg += ' in cross-check with method "{}"'.format(method)
+                print(msg)
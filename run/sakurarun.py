@@ -12,6 +12,7 @@ import numpy as np
 import pandas as pd
 import requests
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 # set path for local imports
 thisdir = os.path.dirname(os.path.abspath(__file__))
@@ -21,12 +22,104 @@ sys.path.append(os.path.abspath(os.path.join(thisdir, '..')))
 from api.api_key import API_KEY
 
 # local imports
+from api.requests import QuotaLimiter
 from python.distancematrix import get_distance_matrix
 from python.distancematrix import plot_distance_matrix
 from python.route import get_route_coords
 from python.route import plot_route_coords
-from tools.kmltools import coords_to_kml
+from python.route import RouteLegCache
+from python.route import simplify_route
+from python.orienteering import prune_by_budget
+from tools.exporttools import write_route
+from tools.geometrytools import coords_to_array
+from tools.checkpointtools import Checkpointer
+from tools.checkpointtools import make_key
+from tools.profiletools import Profiler
+from tools.profiletools import enable_profiling
+from tools.profiletools import disable_profiling
+from tools.profiletools import profile_stage
 from tools.tsptools import solve_tsp
+from tools.tsptools import solve_orienteering
+
+
+def read_locations(inputfile, delimiter=',', lat_key='lat', lon_key='lon',
+        budget=None, prize_key='num', start_index=0, info_keys=None):
+    # read the locations to visit from an input file
+    # input arguments:
+    # - inputfile: input .csv file with cluster locations
+    # - delimiter, lat_key, lon_key: see corresponding command line arguments
+    # - budget: distance budget (in meter);
+    #   if specified, locations that are certainly out of reach are discarded
+    # - prize_key, start_index: see corresponding command line arguments
+    # - info_keys: columns to keep as attributes of each location (if present),
+    #   e.g. for labeling the stops in the output file (default: 'num' and 'street')
+    # returns:
+    #   a tuple of coordinates (list of {'lon': longitude, 'lat': latitude, <info_keys>}),
+    #   prizes and index of the start location (both None if no budget is specified)
+    df = pd.read_csv(inputfile, delimiter=delimiter)
+    print('Read input file {} with {} entries.'.format(inputfile, len(df)))
+
+    # get coordinates in suitable format
+    lats = df[lat_key].astype(float)
+    lons = df[lon_key].astype(float)
+    coords = [{'lon': lon, 'lat': lat} for lon, lat in zip(lons, lats)]
+    if info_keys is None: info_keys = ['num', 'street']
+    for key in info_keys:
+        if key not in df.columns: continue
+        vals = df[key].astype(object).where(df[key].notna(), None).tolist()
+        for coord, val in zip(coords, vals): coord[key] = val
+    if budget is None: return (coords, None, None)
+
+    # discard locations that are out of reach for the given budget
+    prizes = np.ones(len(df))
+    if prize_key in df.columns: prizes = df[prize_key].values.astype(float)
+    ids = prune_by_budget(coords, budget, start=start_index, prizes=prizes)
+    start = int(np.nonzero(ids==start_index)[0][0])
+    coords = [coords[idx] for idx in ids]
+    prizes = prizes[ids]
+    print('Kept {} locations within reach of a {:.3f} km budget.'.format(len(coords), budget/1000))
+    return (coords, prizes, start)
+
+
+def make_stage_keys(coords, profile='foot', blocksize=None, geodesic=False, kmeans=False,
+        budget=None, prizes=None, start=None, check_methods=None, chunksize=None):
+    # make the checkpoint keys for each stage (see tools/checkpointtools.py)
+    # (note: the key of each stage depends on the key of the previous stage,
+    #  so that a stage is re-run whenever any of its upstream inputs has changed)
+    # returns:
+    #   dict mapping stage names to keys
+    keys = {}
+    keys['matrix'] = make_key(coords_to_array(coords), profile, blocksize, geodesic, kmeans)
+    keys['tour'] = make_key(keys['matrix'], budget, prizes, start)
+    keys['crosscheck'] = make_key(keys['tour'], check_methods)
+    keys['route'] = make_key(keys['tour'], profile, chunksize)
+    return keys
+
+
+def find_shortest_path(distances, budget=None, prizes=None, start=0):
+    # find the shortest path through all locations,
+    # or through the locations with maximal prize within a budget (if specified)
+    # returns:
+    #   a tuple with the path indices and distance (see tools/tsptools.py)
+    if budget is None: return solve_tsp(distances, method='local')
+    return solve_orienteering(distances, prizes, budget, start=start)
+
+
+def cross_check(distances, check_methods):
+    # solve the shortest path problem with other heuristic methods
+    # returns:
+    #   list of tuples of path indices and distance, one for each method
+    return [solve_tsp(distances, method=method) for method in check_methods]
+
+
+def can_cross_check(npoints, budget=None):
+    # check whether a path can be cross-checked with other heuristic methods
+    # input arguments:
+    # - npoints: number of locations on the path (without the return to the start)
+    # - budget: distance budget (see find_shortest_path)
+    # (note: in case of a budget, the selected path can be too short for the
+    #  cross-check methods, in which case the cross-check is skipped)
+    return (budget is None or npoints > 3)
 
 
 if __name__=='__main__':
@@ -36,11 +129,24 @@ if __name__=='__main__':
     parser.add_argument('-i', '--inputfile', required=True, type=os.path.abspath,
             help='Input .csv file with cluster locations.')
     parser.add_argument('-o', '--outputfile', default='sakurarun.kml', type=os.path.abspath,
-            help='Output .kml file with route markers (default: "sakurarun.kml").')
+            help='Output file with the route and its stops (default: "sakurarun.kml");'
+                +' supported formats: .kml, .kmz, .gpx and .geojson.')
     parser.add_argument('-p', '--profile', default='foot',
             help='Transportation profile (default: "foot").')
     parser.add_argument('-t', '--threshold', default=0.05, type=float,
             help='Relative difference threshold for method cross-checking (default: 0.05).')
+    parser.add_argument('-b', '--budget', default=None, type=float,
+            help='Distance budget (in km); if specified, only the subset of locations'
+                +' with maximal total prize (see --prize_key) that fits in the budget'
+                +' is visited, instead of all of them (default: no budget).')
+    parser.add_argument('--prize_key', default='num',
+            help='Name of the column with the prize for visiting each location'
+                +' (only used in combination with --budget;'
+                +' if the column is not present, all locations have equal prize;'
+                +' default: "num").')
+    parser.add_argument('--start_index', default=0, type=int,
+            help='Index of the start location (only used in combination with --budget;'
+                +' default: 0).')
     parser.add_argument('--delimiter', default=',',
             help='Delimiter for reading .csv file (default: ",")')
     parser.add_argument('--lat_key', default='lat',
@@ -53,6 +159,9 @@ if __name__=='__main__':
                 +' use a value <= 5 for compatibility with a free GraphHopper account.')
     parser.add_argument('--plot_distance_matrix', default=False, action='store_true',
             help='Make plot of distance matrix.')
+    parser.add_argument('--plot_k_nearest', default=None, type=int,
+            help='Plot only the k shortest distances for each point in the distance matrix plot'
+                +' (default: plot all distances).')
     parser.add_argument('--geodesic_distance_matrix', default=False, action='store_true',
             help='Use a simple geodesic distance matrix instead of a fully accurate one.')
     parser.add_argument('--kmeans_distance_matrix', default=False, action='store_true',
@@ -63,85 +172,206 @@ if __name__=='__main__':
             help='Chunk size for route calculation, must be None'
                 +' or an integer between 2 and the number of points in the input file;'
                 +' use a value <= 5 for compatibility with a free GraphHopper account.')
+    parser.add_argument('--max_workers', default=4, type=int,
+            help='Maximum number of route chunks to request in parallel (default: 4).')
+    parser.add_argument('--max_requests_per_minute', default=None, type=int,
+            help='Maximum number of route requests per minute (default: no limit).')
+    parser.add_argument('--route_cache', default=None, type=os.path.abspath,
+            help='File (.json) for storing calculated route legs, so that they do not need'
+                +' to be requested again in subsequent runs (default: no caching).')
     parser.add_argument('--plot_route', default=False, action='store_true',
             help='Make plot of final optimal route.')
+    parser.add_argument('--checkpoint_dir', default=None, type=os.path.abspath,
+            help='Directory for storing the output of each stage (distance matrix,'
+                +' shortest path, cross-check and route); a rerun with unchanged inputs'
+                +' and parameters resumes after the last completed stage'
+                +' (default: no checkpointing).')
+    parser.add_argument('--simplify_plot', default=0, type=float,
+            help='Tolerance (in meter) for simplifying the route before plotting'
+                +' (default: 0, i.e. no simplification).')
+    parser.add_argument('--simplify_kml', default=0, type=float,
+            help='Tolerance (in meter) for simplifying the route before writing'
+                +' the output file (default: 0, i.e. no simplification).')
+    parser.add_argument('--profile_report', default=None, type=os.path.abspath,
+            help='Output .json file for a report with the wall time, cpu time'
+                +' and peak memory of each stage (default: no profiling).')
+    parser.add_argument('--profile_cprofile', default=False, action='store_true',
+            help='Add the most expensive functions according to cProfile to the profiling report.')
+    parser.add_argument('--profile_tracemalloc', default=False, action='store_true',
+            help='Use tracemalloc to measure the peak memory within each stage'
+                +' (default: report the maximum resident memory of the process since its start,'
+                +' which is not specific to each stage).')
     args = parser.parse_args()
 
+    # start profiling
+    if args.profile_report is not None:
+        enable_profiling(Profiler(use_cprofile=args.profile_cprofile,
+                                  use_tracemalloc=args.profile_tracemalloc))
+
     # format blocksize argument
     if args.blocksize is not None: args.blocksize = int(args.blocksize)
 
     # format chunksize argument
     if args.chunksize is not None: args.chunksize = int(args.chunksize)
 
-    # load input file
-    df = pd.read_csv(args.inputfile, delimiter=args.delimiter)
-    print('Read input file {} with {} entries.'.format(args.inputfile, len(df)))
+    # format budget argument
+    budget = None
+    if args.budget is not None: budget = args.budget*1000
 
-    # get coordinates in suitable format
-    lats = df[args.lat_key].astype(float)
-    lons = df[args.lon_key].astype(float)
-    coords = [{'lon': lon, 'lat': lat} for lon, lat in zip(lons, lats)]
+    # load input file
+    with profile_stage('read_input'):
+        (coords, prizes, start) = read_locations(args.inputfile,
+                delimiter=args.delimiter, lat_key=args.lat_key, lon_key=args.lon_key,
+                budget=budget, prize_key=args.prize_key, start_index=args.start_index)
 
     # make requests session
     session = requests.Session()
 
+    # make checkpointer and keys for each stage
+    checkpointer = Checkpointer(args.checkpoint_dir)
+    check_methods = ['annealing']
+    keys = make_stage_keys(coords, profile=args.profile, blocksize=args.blocksize,
+             geodesic=args.geodesic_distance_matrix, kmeans=args.kmeans_distance_matrix,
+             budget=budget, prizes=prizes, start=start,
+             check_methods=check_methods, chunksize=args.chunksize)
+
     # calculate distance matrix
-    print('Calculating distance matrix...')
-    sys.stdout.flush()
-    distances = get_distance_matrix(coords,
-            session=session, profile=args.profile, blocksize=args.blocksize,
-            geodesic=args.geodesic_distance_matrix,
-            kmeans=args.kmeans_distance_matrix)
+    distances = checkpointer.load_array('matrix', keys['matrix'])
+    if distances is None:
+        print('Calculating distance matrix...')
+        sys.stdout.flush()
+        with profile_stage('matrix'):
+            distances = get_distance_matrix(coords,
+                    session=session, profile=args.profile, blocksize=args.blocksize,
+                    geodesic=args.geodesic_distance_matrix,
+                    kmeans=args.kmeans_distance_matrix)
+        checkpointer.save_array('matrix', keys['matrix'], distances)
 
     # plot distance matrix
     if args.plot_distance_matrix:
         print('Plotting distance matrix...')
         sys.stdout.flush()
-        plot_distance_matrix(coords, distances=distances)
+        with profile_stage('plot_matrix'):
+            plot_distance_matrix(coords, distances=distances, k_nearest=args.plot_k_nearest)
 
     # optimization of route
-    print('Finding shortest path...')
-    sys.stdout.flush()
-    (ids, dist) = solve_tsp(distances, method='local')
+    tour = checkpointer.load('tour', keys['tour'])
+    if tour is not None:
+        ids = [int(idx) for idx in tour['ids']]
+        dist = float(tour['dist'])
+    else:
+        print('Finding shortest path...')
+        sys.stdout.flush()
+        with profile_stage('tsp'):
+            (ids, dist) = find_shortest_path(distances, budget=budget, prizes=prizes, start=start)
+        checkpointer.save('tour', keys['tour'], ids=np.array(ids), dist=np.array(dist))
+    if budget is not None:
+        msg = 'Selected {} out of {} locations'.format(len(ids)-1, len(coords))
+        msg += ' with total prize {}.'.format(np.sum(prizes[ids[:-1]]))
+        print(msg)
     print('Shortest path: {:.3f} km'.format(dist/1000))
     sys.stdout.flush()
 
     # re-index coords and distances
     coords = [coords[idx] for idx in ids]
-    new_distances = np.copy(distances)
-    for i in range(distances.shape[0]):
-        for j in range(distances.shape[1]):
-            new_distances[i,j] = distances[ids[i], ids[j]]
-    distances = new_distances
+    distances = distances[np.ix_(ids[:-1], ids[:-1])]
+
+    # check whether a cross-check with other heuristic methods needs to be run
+    do_check = (args.threshold > 0 and can_cross_check(len(distances), budget=budget))
+    check = checkpointer.load('crosscheck', keys['crosscheck']) if do_check else None
+
+    # start calculating the route in the background
+    # (note: the route calculation is limited by the network and the cross-check below
+    #  by the cpu, so they are run simultaneously; while the cross-check is running,
+    #  the route legs are kept in a cache so that they can be re-used if it finds
+    #  a shorter path. otherwise, the legs are only cached if a cache file is given,
+    #  since the cache requires the more verbose responses with instructions.)
+    limiter = QuotaLimiter(max_concurrent=args.max_workers,
+                max_per_minute=args.max_requests_per_minute)
+    route_cache = None
+    if args.route_cache is not None: route_cache = RouteLegCache(cachefile=args.route_cache)
+    elif do_check and check is None: route_cache = RouteLegCache()
+    def calculate_route(coords, verbose=True):
+        with profile_stage('route'):
+            return get_route_coords(coords,
+                     session=session, profile=args.profile, chunksize=args.chunksize,
+                     max_workers=args.max_workers, limiter=limiter, cache=route_cache,
+                     verbose=verbose)
+    executor = ThreadPoolExecutor(max_workers=1)
+    route = checkpointer.load('route', keys['route'])
+    route_future = None
+    if route is None:
+        print('Calculating route details (in the background)...')
+        route_future = executor.submit(calculate_route, coords, verbose=not do_check)
 
     # cross-check with other heuristic methods
-    check_methods = ['annealing']
-    if args.threshold > 0:
-        print('Cross-checking result...')
-        for method in check_methods:
-            (_, check_dist) = solve_tsp(distances, method=method)
+    if do_check:
+        if check is None:
+            print('Cross-checking result...')
+            with profile_stage('crosscheck'):
+                check_results = cross_check(distances, check_methods)
+            best = int(np.argmin([check_dist for _, check_dist in check_results]))
+            check = {'dists': np.array([check_dist for _, check_dist in check_results]),
+                     'ids': np.array(check_results[best][0])}
+            checkpointer.save('crosscheck', keys['crosscheck'], **check)
+        for method, check_dist in zip(check_methods, check['dists']):
             if np.abs(dist-check_dist)/dist > args.threshold:
                 msg = 'WARNING: found more than {}% deviation'.format(args.threshold*100)
                 msg += ' in cross-check with method "{}"'.format(method)
                 print(msg)
+        # switch to the path found in the cross-check if it is shorter
+        # (note: in case of a budget, this path visits the same locations in another order)
+        best = int(np.argmin(check['dists']))
+        if check['dists'][best] < dist - 1e-6:
+            msg = 'Cross-check with method "{}" found a shorter path'.format(check_methods[best])
+            msg += ' ({:.3f} km); switching to this path.'.format(check['dists'][best]/1000)
+            print(msg)
+            check_ids = [int(idx) for idx in check['ids']]
+            ids = [ids[idx] for idx in check_ids]
+            dist = float(check['dists'][best])
+            coords = [coords[idx] for idx in check_ids]
+            distances = distances[np.ix_(check_ids[:-1], check_ids[:-1])]
+            checkpointer.save('tour', keys['tour'], ids=np.array(ids), dist=np.array(dist))
+            # re-calculate the route for the new path
+            # (note: wait for the running calculation to finish, so all its legs are cached)
+            if route_future is not None: route_future.result()
+            route = None
+            print('Calculating route details for new path...')
+            route_future = executor.submit(calculate_route, coords)
 
     # plot shortest route solution
     if args.plot_tsp:
         print('Plotting shortest route solution...')
-        plot_distance_matrix(coords, distances=distances, mode='route')
+        with profile_stage('plot_tsp'):
+            plot_distance_matrix(coords, distances=distances, mode='route')
 
-    # calculate route
-    print('Calculating route details...')
-    (route_coords, route_info) = get_route_coords(coords,
-            session=session, profile=args.profile, chunksize=args.chunksize)
+    # get the calculated route
+    if route is not None:
+        route_coords = route['coords']
+        route_info = {'distance': float(route['distance'])}
+    else:
+        (route_coords, route_info) = route_future.result()
+        checkpointer.save('route', keys['route'],
+                coords=route_coords, distance=np.array(route_info['distance']))
+    executor.shutdown()
     
     # print some info and make plot
     print('Total distance: {:.3f} km'.format(route_info['distance']/1000))
-    if args.plot_route: plot_route_coords(coords, route_coords=route_coords)
-
-    # write output KML file (e.g. for use in google maps)
-    kmlcontent = coords_to_kml(route_coords)
-    outputdir = os.path.dirname(args.outputfile)
-    if not os.path.exists(outputdir): os.makedirs(outputdir)
-    with open(args.outputfile, 'w') as f:
-        f.write(kmlcontent)
+    if args.plot_route:
+        with profile_stage('plot_route'):
+            plot_coords = simplify_route(route_coords, args.simplify_plot, stops=coords)
+            plot_route_coords(coords, route_coords=plot_coords)
+
+    # write output file (e.g. KML for use in google maps or GPX for use on a watch)
+    with profile_stage('write_output'):
+        kml_coords = simplify_route(route_coords, args.simplify_kml, stops=coords)
+        outputdir = os.path.dirname(args.outputfile)
+        if not os.path.exists(outputdir): os.makedirs(outputdir)
+        write_route(args.outputfile, kml_coords, stops=coords[:-1])
+        print('Written route to {}.'.format(args.outputfile))
+
+    # write profiling report
+    if args.profile_report is not None:
+        profiler = disable_profiling()
+        profiler.write(args.profile_report)
+        print('Written profiling report to {}.'.format(args.profile_report))
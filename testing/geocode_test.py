@@ -0,0 +1,95 @@
+#############################################################
+# Test of geocoding functionality with a local stand-in API #
+#############################################################
+# A minimal stand-in for the GraphHopper geocoding API is run in a local thread,
+# so that this test does not need an API key or network access.
+# It checks that each distinct address is requested only once,
+# that a rerun with the same cache makes no requests at all,
+# and that failed requests are not stored in the cache.
+
+
+import os
+import sys
+import json
+import tempfile
+import threading
+import numpy as np
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '..')))
+
+# local imports
+from python.geocode import GeocodeCache
+from python.geocode import geocode_addresses
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # answer geocoding requests with a deterministic point for each address;
+    # addresses containing "nowhere" are not found, and addresses containing "fail" give an error
+    requests = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        address = parse_qs(url.query)['q'][0]
+        with self.lock: self.requests.append(address)
+        if 'fail' in address:
+            (status, response) = (500, {'message': 'internal error'})
+        elif 'nowhere' in address:
+            (status, response) = (200, {'hits': []})
+        else:
+            rng = np.random.default_rng(sum([ord(c) for c in address]))
+            point = {'lat': 41.8 + 0.1*rng.random(), 'lng': -71.4 + 0.1*rng.random()}
+            (status, response) = (200, {'hits': [{'point': point}]})
+        content = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__=='__main__':
+
+    # start stand-in server
+    server = ThreadingHTTPServer(('localhost', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://localhost:{}'.format(server.server_address[1])
+    kwargs = {'base_url': base_url, 'key': 'dummy', 'batchsize': 10, 'max_workers': 4, 'verbose': False}
+
+    # define addresses (with different notations of the same address)
+    addresses = ['{} Main St, Providence'.format(num) for num in range(1, 31)]
+    addresses += ['{}  main st\nProvidence'.format(num) for num in range(1, 31)]
+    addresses += ['1 Nowhere Rd, Providence', None]
+    cachefile = os.path.join(tempfile.mkdtemp(), 'geocode.json')
+
+    # first run: each distinct address is requested once
+    (lat, lon, mask) = geocode_addresses(addresses, cache=GeocodeCache(cachefile), **kwargs)
+    print('First run: {} requests for {} addresses.'.format(len(StandInHandler.requests), len(addresses)))
+    assert len(StandInHandler.requests)==31
+    assert np.sum(mask)==60
+    assert np.allclose(lat[:30], lat[30:60]) and np.allclose(lon[:30], lon[30:60])
+
+    # second run: all addresses (including the one that was not found) are in the cache
+    del StandInHandler.requests[:]
+    (lat2, lon2, _) = geocode_addresses(addresses, cache=GeocodeCache(cachefile), **kwargs)
+    print('Second run: {} requests.'.format(len(StandInHandler.requests)))
+    assert len(StandInHandler.requests)==0
+    assert np.array_equal(lat, lat2, equal_nan=True) and np.array_equal(lon, lon2, equal_nan=True)
+
+    # failed request: an exception is raised, and the address is not cached
+    failed = False
+    try: geocode_addresses(['1 Fail St, Providence'], cache=GeocodeCache(cachefile), **kwargs)
+    except Exception: failed = True
+    assert failed
+    assert '1 fail st, providence' not in GeocodeCache(cachefile)
+    print('Failed request was not cached.')
+
+    server.shutdown()
+    print('All checks passed.')
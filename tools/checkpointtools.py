@@ -0,0 +1,79 @@
+########################################################
+# Tools for storing and reloading intermediate results #
+########################################################
+# Each stage of a calculation stores its output in a file
+# named after the stage and a content hash of its inputs and parameters,
+# so that a rerun with unchanged inputs can skip the stage.
+
+
+import os
+import json
+import hashlib
+import numpy as np
+
+
+def make_key(*items):
+    # make a content hash of a set of inputs and parameters
+    # input arguments:
+    # - items: numpy arrays or json-serializable objects
+    # returns:
+    #   hash in str format
+    h = hashlib.sha256()
+    for item in items:
+        if isinstance(item, np.ndarray):
+            h.update('{} {}'.format(item.dtype, item.shape).encode())
+            h.update(np.ascontiguousarray(item).tobytes())
+        else:
+            h.update(json.dumps(item, sort_keys=True, default=str).encode())
+        h.update(b'|')
+    return h.hexdigest()[:16]
+
+
+class Checkpointer(object):
+    # store and reload the output of calculation stages
+    # input arguments:
+    # - checkpoint_dir: directory to store the files in
+    #   (if None, nothing is stored and nothing can be reloaded)
+
+    def __init__(self, checkpoint_dir=None):
+        self.checkpoint_dir = checkpoint_dir
+
+    def path(self, stage, key, extension='.npz'):
+        # get the file path for a given stage and key
+        return os.path.join(self.checkpoint_dir, '{}-{}{}'.format(stage, key, extension))
+
+    def load(self, stage, key):
+        # load the output of a stage as a dict of numpy arrays,
+        # or None if it is not available
+        if self.checkpoint_dir is None: return None
+        path = self.path(stage, key)
+        if not os.path.exists(path): return None
+        with np.load(path) as f: res = {name: f[name] for name in f.files}
+        print('Loaded {} from checkpoint {}.'.format(stage, path))
+        return res
+
+    def save(self, stage, key, **arrays):
+        # store the output of a stage, given as numpy arrays
+        # (note: the file is written under a temporary name first,
+        #  so an interrupted write does not leave a corrupt checkpoint)
+        if self.checkpoint_dir is None: return
+        if not os.path.exists(self.checkpoint_dir): os.makedirs(self.checkpoint_dir)
+        path = self.path(stage, key)
+        with open(path + '.tmp', 'wb') as f: np.savez(f, **arrays)
+        os.replace(path + '.tmp', path)
+
+    def load_array(self, stage, key):
+        # same as load, for a stage with a single array as output (stored in .npy format)
+        if self.checkpoint_dir is None: return None
+        path = self.path(stage, key, extension='.npy')
+        if not os.path.exists(path): return None
+        print('Loaded {} from checkpoint {}.'.format(stage, path))
+        return np.load(path)
+
+    def save_array(self, stage, key, array):
+        # same as save, for a stage with a single array as output (stored in .npy format)
+        if self.checkpoint_dir is None: return
+        if not os.path.exists(self.checkpoint_dir): os.makedirs(self.checkpoint_dir)
+        path = self.path(stage, key, extension='.npy')
+        with open(path + '.tmp', 'wb') as f: np.save(f, array)
+        os.replace(path + '.tmp', path)
@@ -11,3 +11,20 @@ def haversine(lat1, lon1, lat2, lon2):
     a = ( 0.5 - math.cos((lat2-lat1)*p)/2.
         + math.cos(lat1*p) * math.cos(lat2*p) * (1-math.cos((lon2-lon1)*p))/2. )
     return 2 * r * math.asin(math.sqrt(a))
+
+
+def haversine_array(lat1, lon1, lat2, lon2):
+    # vectorized version of the haversine formula
+    # input arguments:
+    # - lat1, lon1, lat2, lon2: floats or numpy arrays (broadcastable to a common shape)
+    # returns:
+    #   numpy array with distances in meter
+    r = 6371000 # (in meter)
+    p = np.pi / 180.
+    lat1 = np.asarray(lat1, dtype=float)
+    lon1 = np.asarray(lon1, dtype=float)
+    lat2 = np.asarray(lat2, dtype=float)
+    lon2 = np.asarray(lon2, dtype=float)
+    a = ( 0.5 - np.cos((lat2-lat1)*p)/2.
+        + np.cos(lat1*p) * np.cos(lat2*p) * (1-np.cos((lon2-lon1)*p))/2. )
+    return 2 * r * np.arcsin(np.sqrt(np.clip(a, 0., 1.)))
@@ -0,0 +1,174 @@
+#########################################################
+# Tools for writing routes to kml, kmz, gpx and geojson #
+#########################################################
+# The route vertices are formatted and written in blocks of limited size,
+# so that no full copy of a (large) route is held in memory as text.
+# Usage: write_route('route.gpx', route_coords, stops=coords),
+# where the format is determined from the file extension.
+
+
+# external imports
+import os
+import sys
+import json
+import zipfile
+from io import TextIOWrapper
+from xml.sax.saxutils import escape
+
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '..')))
+
+# local imports
+from tools.geometrytools import coords_to_array
+
+
+# attributes of a stop that are added to its placemark (if present)
+stop_name_key = 'num'
+stop_description_key = 'street'
+
+
+def iterate_blocks(points, fmt, separator='\n', buffersize=1000):
+    # format points in blocks of limited size
+    # input arguments:
+    # - points: array of [lon, lat] points
+    # - fmt: format string for a single point, with named fields lon and lat
+    # - separator: str to put between consecutive points
+    # - buffersize: number of points per block
+    # yields:
+    #   formatted blocks in str format (including separators between blocks)
+    for start in range(0, len(points), buffersize):
+        block = points[start:start+buffersize].tolist()
+        block = separator.join([fmt.format(lon=lon, lat=lat) for lon, lat in block])
+        if start > 0: block = separator + block
+        yield block
+
+
+def stop_properties(stop, idx):
+    # get the name and description of a stop
+    # input arguments:
+    # - stop: dict with coordinates and optional attributes (see stop_name_key)
+    # - idx: index of the stop along the route (used as name if no attribute is present)
+    # returns:
+    #   a tuple of name and description in str format (description can be None)
+    name = 'Stop {}'.format(idx+1)
+    if stop.get(stop_name_key, None) is not None:
+        name = '{} ({})'.format(name, stop[stop_name_key])
+    description = stop.get(stop_description_key, None)
+    if description is not None: description = str(description)
+    return (name, description)
+
+
+def write_kml(f, route_coords, stops=None, color=None, buffersize=1000):
+    # write a route in kml format to an open text file
+    # input arguments:
+    # - route_coords: array of [lon, lat] points
+    # - stops: list of stops (see stop_properties) to add as placemarks (optional)
+    # - color: color of the route line (optional, in kml aabbggrr format)
+    # - buffersize: number of points written at once
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    f.write('<kml xmlns="http://earth.google.com/kml/2.0"> <Document>\n')
+    f.write('<Placemark>\n')
+    f.write('<LineString> <coordinates>\n')
+    for block in iterate_blocks(route_coords, '{lon}, {lat}, 0.', buffersize=buffersize):
+        f.write(block)
+    f.write('\n</coordinates> </LineString>\n')
+    f.write('<Style> <LineStyle>\n')
+    if color is not None: f.write('<color>{}</color>\n'.format(color))
+    f.write('</LineStyle> </Style>\n')
+    f.write('</Placemark>\n')
+    for idx, stop in enumerate(stops if stops is not None else []):
+        (name, description) = stop_properties(stop, idx)
+        f.write('<Placemark> <name>{}</name>\n'.format(escape(name)))
+        if description is not None:
+            f.write('<description>{}</description>\n'.format(escape(description)))
+        f.write('<Point> <coordinates>{}, {}, 0.</coordinates> </Point>\n'.format(
+                float(stop['lon']), float(stop['lat'])))
+        f.write('</Placemark>\n')
+    f.write('</Document> </kml>')
+
+
+def write_kmz(outputfile, route_coords, stops=None, color=None, buffersize=1000):
+    # write a route in kmz format (i.e. a zipped kml file) to a file
+    # input arguments: see write_kml
+    with zipfile.ZipFile(outputfile, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        with z.open('doc.kml', 'w') as zf, TextIOWrapper(zf, encoding='utf-8') as f:
+            write_kml(f, route_coords, stops=stops, color=color, buffersize=buffersize)
+
+
+def write_gpx(f, route_coords, stops=None, buffersize=1000):
+    # write a route in gpx format (as a track, with stops as waypoints) to an open text file
+    # input arguments: see write_kml
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    f.write('<gpx version="1.1" creator="sakurarun" xmlns="http://www.topografix.com/GPX/1/1">\n')
+    for idx, stop in enumerate(stops if stops is not None else []):
+        (name, description) = stop_properties(stop, idx)
+        f.write('<wpt lat="{}" lon="{}"> <name>{}</name>'.format(
+                float(stop['lat']), float(stop['lon']), escape(name)))
+        if description is not None: f.write(' <desc>{}</desc>'.format(escape(description)))
+        f.write(' </wpt>\n')
+    f.write('<trk> <name>sakurarun</name> <trkseg>\n')
+    for block in iterate_blocks(route_coords, '<trkpt lat="{lat}" lon="{lon}"/>', buffersize=buffersize):
+        f.write(block)
+    f.write('\n</trkseg> </trk>\n')
+    f.write('</gpx>')
+
+
+def write_geojson(f, route_coords, stops=None, buffersize=1000):
+    # write a route in geojson format (as a feature collection) to an open text file
+    # input arguments: see write_kml
+    f.write('{"type": "FeatureCollection", "features": [\n')
+    f.write('{"type": "Feature", "properties": {"name": "route"},')
+    f.write(' "geometry": {"type": "LineString", "coordinates": [\n')
+    for block in iterate_blocks(route_coords, '[{lon}, {lat}]', separator=',\n', buffersize=buffersize):
+        f.write(block)
+    f.write('\n]}}')
+    for idx, stop in enumerate(stops if stops is not None else []):
+        (name, description) = stop_properties(stop, idx)
+        properties = {'name': name}
+        if description is not None: properties['description'] = description
+        for key in [stop_name_key, stop_description_key]:
+            if stop.get(key, None) is not None: properties[key] = stop[key]
+        feature = {'type': 'Feature', 'properties': properties,
+                   'geometry': {'type': 'Point', 'coordinates': [float(stop['lon']), float(stop['lat'])]}}
+        f.write(',\n' + json.dumps(feature, default=str))
+    f.write('\n]}')
+
+
+# supported formats per file extension
+formats = {
+  '.kml': 'kml',
+  '.kmz': 'kmz',
+  '.gpx': 'gpx',
+  '.geojson': 'geojson',
+  '.json': 'geojson'
+}
+
+
+def write_route(outputfile, route_coords, stops=None, fmt=None, color=None, buffersize=1000):
+    # write a route to a file
+    # input arguments:
+    # - outputfile: path to the output file
+    # - route_coords: array of [lon, lat] points (e.g. as returned by get_route_coords),
+    #   or list of coordinates formatted as {'lon': longitude, 'lat': latitude}
+    # - stops: list of stops, formatted as {'lon': longitude, 'lat': latitude}
+    #   with optional attributes (see stop_name_key and stop_description_key)
+    # - fmt: output format (default: determined from the extension of outputfile)
+    # - color: color of the route line (only for kml and kmz)
+    # - buffersize: number of points written at once
+    if fmt is None:
+        extension = os.path.splitext(outputfile)[1].lower()
+        if extension not in formats:
+            msg = 'Output file extension {} not recognized;'.format(extension)
+            msg += ' choose from {}.'.format(list(formats.keys()))
+            raise Exception(msg)
+        fmt = formats[extension]
+    route_coords = coords_to_array(route_coords)
+    if fmt=='kmz':
+        write_kmz(outputfile, route_coords, stops=stops, color=color, buffersize=buffersize)
+        return
+    with open(outputfile, 'w') as f:
+        if fmt=='kml': write_kml(f, route_coords, stops=stops, color=color, buffersize=buffersize)
+        elif fmt=='gpx': write_gpx(f, route_coords, stops=stops, buffersize=buffersize)
+        elif fmt=='geojson': write_geojson(f, route_coords, stops=stops, buffersize=buffersize)
+        else: raise Exception('Output format {} not recognized.'.format(fmt))
@@ -0,0 +1,121 @@
+#############################################
+# Tools for handling array-backed geometry #
+#############################################
+# Routes are represented as 2D numpy arrays of shape (number of points, 2),
+# with longitudes in the first column and latitudes in the second column
+# (the same order as GraphHopper's (non-encoded) coordinates).
+
+
+import numpy as np
+
+
+def coords_to_array(coords):
+    # convert coordinates to an array of shape (number of points, 2)
+    # input arguments:
+    # - coords: list of coordinates formatted as {'lon': longitude, 'lat': latitude},
+    #   or an array of [longitude, latitude] points (returned as is)
+    # returns:
+    #   numpy array with longitudes in the first column and latitudes in the second column
+    if isinstance(coords, np.ndarray): return coords
+    if len(coords)==0: return np.zeros((0, 2))
+    lon = np.array([float(coord['lon']) for coord in coords])
+    lat = np.array([float(coord['lat']) for coord in coords])
+    return np.column_stack((lon, lat))
+
+
+def decode_polyline(encoded, multiplier=1e5):
+    # decode a string in encoded polyline format
+    # see e.g. https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+    # (GraphHopper uses the same format, with latitude before longitude)
+    # input arguments:
+    # - encoded: encoded polyline in str format
+    # - multiplier: precision multiplier used for encoding (default 1e5)
+    # returns:
+    #   numpy array with longitudes in the first column and latitudes in the second column
+    if len(encoded)==0: return np.zeros((0, 2))
+    # each character holds a 5-bit chunk of a number;
+    # the continuation bit (0x20) is not set for the last chunk of each number
+    values = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    ends = (values < 0x20)
+    ends_idx = np.nonzero(ends)[0]
+    number_ids = np.concatenate(([0], np.cumsum(ends)[:-1]))
+    number_starts = np.concatenate(([0], ends_idx[:-1]+1))
+    shifts = 5*(np.arange(len(values)) - number_starts[number_ids])
+    # combine the chunks of each number
+    # (note: bincount works with float weights, which is exact for the values at hand)
+    numbers = np.bincount(number_ids, weights=((values & 0x1f) << shifts).astype(float))
+    numbers = numbers.astype(np.int64)
+    # undo the sign encoding
+    numbers = np.where(numbers & 1, ~(numbers >> 1), numbers >> 1)
+    # undo the delta encoding
+    points = np.cumsum(numbers.reshape(-1, 2), axis=0) / multiplier
+    return np.ascontiguousarray(points[:, ::-1])
+
+
+def project_local(points, ref_lat=None):
+    # project [lon, lat] points onto a local flat plane (equirectangular projection),
+    # which is accurate enough for distance calculations on the scale of a city
+    # input arguments:
+    # - points: array of [lon, lat] points
+    # - ref_lat: reference latitude for the projection (default: mean latitude of points)
+    # returns:
+    #   array of [x, y] points in meter
+    r = 6371000 # (in meter)
+    p = np.pi / 180.
+    points = np.asarray(points, dtype=float)
+    if ref_lat is None: ref_lat = np.mean(points[:, 1]) if len(points)>0 else 0.
+    x = r * p * points[:, 0] * np.cos(ref_lat*p)
+    y = r * p * points[:, 1]
+    return np.column_stack((x, y))
+
+
+def convex_hull(points):
+    # find the convex hull of a set of points in a flat plane (monotone chain algorithm)
+    # input arguments:
+    # - points: array of [x, y] points (e.g. as returned by project_local)
+    # returns:
+    #   numpy array with indices of the points on the convex hull
+    #   (in counterclockwise order, without collinear points;
+    #    for less than three distinct points, the indices of the distinct points)
+    points = np.asarray(points, dtype=float)
+    order = np.lexsort((points[:, 1], points[:, 0]))
+    # remove duplicate points
+    if len(order) > 1:
+        keep = np.concatenate(([True], np.any(np.diff(points[order], axis=0)!=0, axis=1)))
+        order = order[keep]
+    if len(order) < 3: return order
+    def cross(o, a, b):
+        return ((points[a, 0]-points[o, 0])*(points[b, 1]-points[o, 1])
+                - (points[a, 1]-points[o, 1])*(points[b, 0]-points[o, 0]))
+    def half_hull(ids):
+        hull = []
+        for idx in ids:
+            while len(hull) >= 2 and cross(hull[-2], hull[-1], idx) <= 0: hull.pop()
+            hull.append(idx)
+        return hull
+    lower = half_hull(order)
+    upper = half_hull(order[::-1])
+    return np.array(lower[:-1] + upper[:-1], dtype=int)
+
+
+def points_in_polygon(points, polygon):
+    # check which points are inside a polygon (even-odd rule, vectorized over the points)
+    # input arguments:
+    # - points: array of [x, y] points (e.g. [lon, lat] points)
+    # - polygon: array of [x, y] vertices (the last vertex may or may not repeat the first one)
+    # returns:
+    #   1D numpy array of booleans
+    # note: the edges are treated as straight lines in the coordinates of the points,
+    #       which is accurate enough for [lon, lat] polygons on the scale of a city.
+    points = np.asarray(points, dtype=float)
+    polygon = np.asarray(polygon, dtype=float)
+    px = points[:, 0]
+    py = points[:, 1]
+    inside = np.zeros(len(points), dtype=bool)
+    # loop over the edges and count the crossings of a ray from each point in the +x direction
+    for (x1, y1), (x2, y2) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        if y1==y2: continue
+        crosses = ((y1 > py) != (y2 > py))
+        xcross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= (crosses & (px < xcross))
+    return inside
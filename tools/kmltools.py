@@ -3,20 +3,30 @@
 ############################################
 
 
-def coords_to_kml(coords, color=None):
+# external imports
+import io
+import os
+import sys
+
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '..')))
+
+# local imports
+from tools.geometrytools import coords_to_array
+from tools.exporttools import write_kml
+
+
+def coords_to_kml(coords, color=None, stops=None):
     # convert a list of coordinates to kml format
     # input arguments:
-    # - coords: list of coordinates formatted as {'lon': longitude, 'lat': latitude}
+    # - coords: array of [lon, lat] points (e.g. as returned by get_route_coords),
+    #   or list of coordinates formatted as {'lon': longitude, 'lat': latitude}
+    # - stops: list of stops to add as placemarks (see tools/exporttools.py)
     # returns:
     #   content of a kml file in str format
-    header = '<?xml version="1.0" encoding="UTF-8"?>\n'
-    header += '<kml xmlns="http://earth.google.com/kml/2.0"> <Document>\n'
-    header += '<Placemark>\n'
-    coords = ['{}, {}, 0.'.format(coord['lon'], coord['lat']) for coord in coords]
-    coords = '\n'.join(coords)
-    coords = '<LineString> <coordinates>\n' + coords + '\n' + '</coordinates> </LineString>\n'
-    style = '<Style> <LineStyle>\n'
-    if color is not None: style += '<color>{}</color>\n'.format(color)
-    style += '</LineStyle> </Style>\n'
-    footer = '</Placemark> </Document> </kml>'
-    return header + coords + style + footer
+    # note: for writing (large) routes to a file, use write_route in tools/exporttools.py
+    #       instead, which does not hold the full content in memory.
+    f = io.StringIO()
+    write_kml(f, coords_to_array(coords), stops=stops, color=color)
+    return f.getvalue()
@@ -0,0 +1,37 @@
+####################################################
+# Tools for calling a function in parallel threads #
+####################################################
+
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+def run_in_parallel(function, argsets, max_workers=4, name='request', verbose=True):
+    # helper function to call a function for a list of arguments in parallel
+    # input arguments:
+    # - function: function to call
+    # - argsets: list of tuples of positional arguments
+    # - max_workers: maximum number of parallel calls
+    # - name: name of the items for printouts
+    # - verbose: whether to print a progress counter
+    #   (note: the counter overwrites the previous line of output,
+    #   so it should be disabled when other output is printed at the same time)
+    # returns:
+    #   list of results, in the same order as argsets
+    ncalls = len(argsets)
+    counter = 0
+    results = [None]*ncalls
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for idx, args in enumerate(argsets):
+            futures[executor.submit(function, *args)] = idx
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if not verbose: continue
+            # print counter
+            counter += 1
+            msg =''
+            if counter>1: msg += '\033[F'
+            msg += 'Calculated {} {} of {}...'.format(name,counter,ncalls)
+            print(msg)
+    return results
@@ -1,43 +1,129 @@
-###############################################
-# Plot the locations of entries in a csv file #
-###############################################
+####################################################
+# Tools for plotting locations and routes on a map #
+####################################################
 
 
-# imports
+# external imports
 import os
 import sys
-import argparse
 import numpy as np
-import pandas as pd
-import plotly.express as px
+import plotly.graph_objects as go
 
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '..')))
 
-def plot_locations(lat, lon, extra_info=None):
+# local imports
+from tools.geometrytools import project_local
+
+
+# supported map types:
+# - mapbox: map traces based on mapbox (deprecated in recent plotly versions)
+# - map: WebGL map traces based on MapLibre (requires plotly >= 5.24)
+# the default is the MapLibre-based type if it is available
+map_types = ['mapbox', 'map']
+default_map_type = 'map' if hasattr(go, 'Scattermap') else 'mapbox'
+
+
+def map_trace(lat, lon, map_type=None, **kwargs):
+    # make a scatter trace (points and/or lines) on a map
+    # input arguments:
+    # - lat and lon: 1D numpy arrays with latitudes and longitudes
+    #   (for lines, separate disconnected segments by NaN values)
+    # - map_type: see map_types above
+    # - kwargs: passed down to the trace constructor (e.g. mode, marker, line)
+    if map_type is None: map_type = default_map_type
+    if map_type not in map_types:
+        raise Exception('Map type {} not recognized; choose from {}.'.format(map_type, map_types))
+    if map_type=='map': return go.Scattermap(lat=lat, lon=lon, **kwargs)
+    return go.Scattermapbox(lat=lat, lon=lon, **kwargs)
+
+
+def map_figure(traces, lat, lon, map_type=None, zoom=8, height=600, width=900):
+    # make a figure with traces on an open street map
+    # input arguments:
+    # - traces: list of traces (e.g. made with map_trace)
+    # - lat and lon: 1D numpy arrays with latitudes and longitudes to center the map on
+    # - map_type: see map_types above
+    if map_type is None: map_type = default_map_type
+    fig = go.Figure(traces)
+    mapsettings = {'style': 'open-street-map', 'zoom': zoom,
+                   'center': {'lat': float(np.nanmean(lat)), 'lon': float(np.nanmean(lon))}}
+    if map_type=='map': fig.update_layout(map=mapsettings)
+    else: fig.update_layout(mapbox=mapsettings)
+    fig.update_layout(height=height, width=width, showlegend=False)
+    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+    return fig
+
+
+def bin_locations(lat, lon, binsize=100):
+    # aggregate locations into square bins
+    # input arguments:
+    # - lat and lon: 1D numpy arrays with latitudes and longitudes
+    # - binsize: size of the bins (in meter)
+    # returns:
+    #   a tuple of 1D numpy arrays with the mean latitude, mean longitude
+    #   and number of locations in each (non-empty) bin
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    points = project_local(np.column_stack((lon, lat)))
+    cells = np.floor(points / binsize).astype(np.int64)
+    (_, bin_ids, counts) = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    bin_ids = bin_ids.ravel()
+    bin_lat = np.bincount(bin_ids, weights=lat) / counts
+    bin_lon = np.bincount(bin_ids, weights=lon) / counts
+    return (bin_lat, bin_lon, counts)
+
+
+def plot_locations(lat, lon, extra_info=None, hover_columns=None,
+        max_points=5000, binsize=100, outputfile=None, map_type=None):
     # make a visual representation of a set of coordinates
     # input arguments:
     # - lat and lon: 1D numpy arrays with latitudes and longitudes
-    
-    # put coordinates in a dataframe
-    df_coords = pd.DataFrame({'node': np.arange(len(lat))})
-    df_coords['lat'] = lat
-    df_coords['lon'] = lon
-    df_coords['color'] = 'red'
-    df_coords['size'] = 1
-    if extra_info is not None:
-        for key, val in extra_info.items():
-            df_coords[key] = val
-
-    # define what to display on hovering
-    hover_data = {'size':False, 'color':False, 'lat':True, 'lon':True}
-    if extra_info is not None:
-        for key in extra_info.keys(): hover_data[key] = True
-    
+    # - extra_info: dict (or dataframe) with additional values per location,
+    #   to display on hovering
+    # - hover_columns: keys in extra_info to display on hovering
+    #   (default: all keys; keys not present in extra_info are ignored)
+    # - max_points: maximum number of locations to plot as individual markers;
+    #   if there are more locations, they are aggregated into bins
+    #   and the number of locations per bin is shown instead of extra_info
+    # - binsize: size of the bins (in meter)
+    # - outputfile: if specified, the figure is written to this file instead of shown;
+    #   the format follows from the extension (.html, or an image format such as .png,
+    #   which requires the kaleido package)
+    # - map_type: see map_types above
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+
+    if len(lat) > max_points:
+        # aggregate the locations into bins
+        (bin_lat, bin_lon, counts) = bin_locations(lat, lon, binsize=binsize)
+        sizes = 5 + 15 * np.sqrt(counts / np.amax(counts))
+        trace = map_trace(bin_lat, bin_lon, map_type=map_type, mode='markers',
+                  marker={'color': counts, 'colorscale': 'Reds', 'size': sizes,
+                          'showscale': True, 'colorbar': {'title': {'text': 'count'}}},
+                  customdata=counts,
+                  hovertemplate='lat: %{lat}<br>lon: %{lon}<br>count: %{customdata}<extra></extra>')
+    else:
+        # define what to display on hovering
+        if extra_info is None: extra_info = {}
+        if hover_columns is None: hover_columns = list(extra_info.keys())
+        hover_columns = [key for key in hover_columns if key in extra_info.keys()]
+        hovertemplate = 'lat: %{lat}<br>lon: %{lon}'
+        for idx, key in enumerate(hover_columns):
+            hovertemplate += '<br>{}: %{{customdata[{}]}}'.format(key, idx)
+        customdata = None
+        if len(hover_columns) > 0:
+            customdata = np.column_stack([np.asarray(extra_info[key]) for key in hover_columns])
+        trace = map_trace(lat, lon, map_type=map_type, mode='markers',
+                  marker={'color': 'red', 'size': 10},
+                  customdata=customdata, hovertemplate=hovertemplate+'<extra></extra>')
+
     # plot the coordinates on map
-    fig = px.scatter_mapbox(df_coords, lat="lat", lon="lon",
-                hover_data=hover_data,
-                color='color', color_discrete_map='identity',
-                size='size', size_max=10,
-                zoom=8, height=600, width=900)
-    fig.update_layout(mapbox_style="open-street-map")
-    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
-    fig.show()
+    fig = map_figure([trace], lat, lon, map_type=map_type)
+    if outputfile is None:
+        fig.show()
+    elif os.path.splitext(outputfile)[1].lower()=='.html':
+        fig.write_html(outputfile)
+    else:
+        fig.write_image(outputfile)
@@ -0,0 +1,184 @@
+#####################################################
+# Tools for measuring the time and memory per stage #
+#####################################################
+# Usage: create a Profiler, activate it with enable_profiling,
+# and wrap the code to measure in "with profile_stage('name'):" blocks,
+# or decorate the functions to measure with "@profiled('name')".
+# If no profiler is active, profile_stage does nothing,
+# so instrumented functions can be used without any overhead.
+
+
+import io
+import sys
+import json
+import time
+import pstats
+import cProfile
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+try: import resource
+except ImportError: resource = None # (not available on Windows)
+
+
+# currently active profiler
+_profiler = None
+
+
+class Profiler(object):
+    # collect wall time, cpu time and peak memory per stage
+    # input arguments:
+    # - use_cprofile: run cProfile over the full run (from start to stop)
+    #   and add the most expensive functions to the report
+    # - use_tracemalloc: trace memory allocations with tracemalloc
+    #   to measure the peak memory within each stage
+    #   (otherwise the maximum resident memory of the process since its start is reported,
+    #   which is not specific to the stage, and not available on all platforms)
+    # note: cpu time is measured for the whole process (i.e. summed over all threads)
+    # note: tracemalloc has a single peak for the whole process, so the peak memory
+    #       of stages that run simultaneously in different threads includes the allocations
+    #       of each other (but the peak of one stage is never lost by resetting it for another)
+
+    def __init__(self, use_cprofile=False, use_tracemalloc=False):
+        self.use_cprofile = use_cprofile
+        self.use_tracemalloc = use_tracemalloc
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.running = []
+        self.cprofile = None
+        self.start_time = None
+        self.stop_time = None
+
+    def start(self):
+        self.start_time = time.time()
+        if self.use_tracemalloc: tracemalloc.start()
+        if self.use_cprofile:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def stop(self):
+        self.stop_time = time.time()
+        if self.cprofile is not None: self.cprofile.disable()
+        if self.use_tracemalloc: tracemalloc.stop()
+
+    def update_peaks(self):
+        # add the traced peak since the last reset to all running stages, and reset it
+        # (note: must be called with the lock acquired)
+        peak = tracemalloc.get_traced_memory()[1]
+        for record in self.running: record['peak'] = max(record['peak'], peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name):
+        # measure a stage (can be nested, and can run in multiple threads)
+        record = {'peak': 0}
+        tracing = (self.use_tracemalloc and tracemalloc.is_tracing())
+        if tracing:
+            with self.lock:
+                self.update_peaks()
+                self.running.append(record)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            if tracing:
+                with self.lock:
+                    self.update_peaks()
+                    self.running = [el for el in self.running if el is not record]
+                peak = record['peak']
+            else: peak = get_max_rss()
+            self.add(name, wall_time=wall, cpu_time=cpu, peak_memory=peak)
+
+    def add(self, name, wall_time=0., cpu_time=0., peak_memory=None):
+        # add a measurement to a stage
+        # (e.g. for time spent waiting, which is not measured as a separate stage)
+        # (note: peak_memory can be None if it was not measured)
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = {'calls': 0, 'wall_time': 0., 'cpu_time': 0., 'peak_memory': None}
+            stage = self.stages[name]
+            stage['calls'] += 1
+            stage['wall_time'] += wall_time
+            stage['cpu_time'] += cpu_time
+            if peak_memory is not None:
+                stage['peak_memory'] = max(stage['peak_memory'] or 0, peak_memory)
+
+    def report(self, ntop=30):
+        # make a report in dict format
+        report = {
+          'settings': {'use_cprofile': self.use_cprofile, 'use_tracemalloc': self.use_tracemalloc},
+          'peak_memory_type': 'traced' if self.use_tracemalloc else 'process_max_rss',
+          'total_wall_time': None,
+          'stages': self.stages
+        }
+        if self.start_time is not None and self.stop_time is not None:
+            report['total_wall_time'] = self.stop_time - self.start_time
+        if self.cprofile is not None:
+            stats = pstats.Stats(self.cprofile, stream=io.StringIO())
+            functions = []
+            for (filename, line, function), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+                functions.append({'function': '{}:{}({})'.format(filename, line, function),
+                                  'calls': ncalls, 'tottime': tottime, 'cumtime': cumtime})
+            functions = sorted(functions, key=lambda el: el['cumtime'], reverse=True)
+            report['cprofile'] = functions[:ntop]
+        return report
+
+    def write(self, outputfile, **kwargs):
+        # write the report to a .json file
+        with open(outputfile, 'w') as f:
+            json.dump(self.report(**kwargs), f, indent=2)
+
+
+def get_max_rss():
+    # get the maximum resident memory of the process since its start (in bytes),
+    # or None if it is not available on this platform
+    if resource is None: return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # (note: the value is in bytes on macOS and in kilobytes on Linux)
+    return maxrss if sys.platform=='darwin' else maxrss * 1024
+
+
+def enable_profiling(profiler):
+    # set the active profiler and start it
+    global _profiler
+    _profiler = profiler
+    profiler.start()
+    return profiler
+
+
+def disable_profiling():
+    # stop the active profiler and return it
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    if profiler is not None: profiler.stop()
+    return profiler
+
+
+@contextmanager
+def profile_stage(name):
+    # measure a stage with the active profiler (if any)
+    if _profiler is None:
+        yield
+        return
+    with _profiler.stage(name):
+        yield
+
+
+def profile_add(name, **kwargs):
+    # add a measurement to a stage of the active profiler (if any)
+    if _profiler is not None: _profiler.add(name, **kwargs)
+
+
+def profiled(name):
+    # decorator to measure each call of a function as a stage with the active profiler (if any)
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with profile_stage(name): return function(*args, **kwargs)
+        return wrapper
+    return decorator
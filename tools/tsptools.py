@@ -1,26 +1,144 @@
+import os
+import sys
 import numpy as np
 import python_tsp
 from python_tsp.exact import solve_tsp_dynamic_programming
 from python_tsp.heuristics import solve_tsp_local_search
 from python_tsp.heuristics import solve_tsp_simulated_annealing
 
+# set path for local imports
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(thisdir, '..')))
 
-def solve_tsp(distances, method='exact'):
+# local imports
+from tools.profiletools import profile_stage
+from tools.profiletools import profiled
+
+
+def solve_tsp_two_opt(distances, max_processing_time=None):
+	# solve the traveling salesperson problem with a nearest neighbour tour
+	# followed by 2-opt moves (fast, but usually less optimal than the other heuristics)
+	# input arguments:
+	# - distances: square np array with distances
+	# - max_processing_time: ignored (for compatibility with the other methods)
+	# returns:
+	#   a tuple with the path indices (without returning to the start) and distance
+	distances = np.asarray(distances, dtype=float)
+	route = [0]
+	remaining = np.ones(len(distances), dtype=bool)
+	remaining[0] = False
+	for _ in range(len(distances)-1):
+	    candidates = np.nonzero(remaining)[0]
+	    nearest = int(candidates[np.argmin(distances[route[-1], candidates])])
+	    route.append(nearest)
+	    remaining[nearest] = False
+	(route, length) = two_opt(distances, route + [0])
+	return (route[:-1], length)
+
+
+# available methods for solve_tsp
+# each method takes a distance matrix and a maximum processing time (in seconds, or None),
+# and returns a tuple with the path indices (without returning to the start) and distance.
+# new methods can be added here and are then automatically available in solve_tsp.
+# (note: only the methods in time_limited_methods respect the maximum processing time.)
+tsp_methods = {
+	'exact': lambda distances, max_processing_time=None: solve_tsp_dynamic_programming(distances),
+	'local': lambda distances, max_processing_time=None: solve_tsp_local_search(distances,
+	           max_processing_time=max_processing_time),
+	'annealing': lambda distances, max_processing_time=None: solve_tsp_simulated_annealing(distances,
+	           max_processing_time=max_processing_time),
+	'two_opt': solve_tsp_two_opt
+}
+time_limited_methods = ['local', 'annealing']
+
+
+def solve_tsp(distances, method='exact', max_processing_time=None):
 	# solve the traveling salesperson problem for a given distance matrix
 	# input arguments:
 	# - distances: square np array with distances
-	# - method: choose from 'exact', 'local' or 'annealing'
+	# - method: choose from the keys of tsp_methods ('exact', 'local', 'annealing' or 'two_opt')
+	# - max_processing_time: maximum processing time in seconds (default: no limit);
+	#   only used by the methods in time_limited_methods
 	# returns:
 	#   a tuple with the shortes path indices and distance
-	if method=='exact':
-	    shortest_path_inds, shortest_path_dist = solve_tsp_dynamic_programming(distances)
-	elif method=='local':
-	    shortest_path_inds, shortest_path_dist = solve_tsp_local_search(distances)
-	elif method=='annealing':
-	    shortest_path_inds, shortest_path_dist = solve_tsp_simulated_annealing(distances)
-	else:
-	    msg = 'Method "{}" not recognized.'.format(method)
+	if method not in tsp_methods:
+	    msg = 'Method "{}" not recognized; choose from {}.'.format(method, list(tsp_methods.keys()))
 	    raise Exception(msg)
+	with profile_stage('tsp/{}'.format(method)):
+	    shortest_path_inds, shortest_path_dist = tsp_methods[method](distances,
+	                                               max_processing_time=max_processing_time)
 	# add the first index to the end to make the closed loop explicit
-	shortest_path_inds = shortest_path_inds + [shortest_path_inds[0]]
+	shortest_path_inds = list(shortest_path_inds) + [shortest_path_inds[0]]
 	return (shortest_path_inds, shortest_path_dist)
+
+
+@profiled('tsp/orienteering')
+def solve_orienteering(distances, prizes, budget, start=0):
+	# solve the orienteering problem for a given distance matrix,
+	# i.e. find the closed route starting and ending at a given point,
+	# that collects the maximum total prize without exceeding a distance budget
+	# (e.g. visit as many trees as possible in a run of limited length).
+	# a greedy insertion heuristic is used: the point with the best ratio of prize
+	# to detour is inserted at its cheapest position, after which the route is shortened
+	# with 2-opt moves, until no remaining point fits in the budget.
+	# input arguments:
+	# - distances: square np array with distances
+	# - prizes: 1D np array with the prize for visiting each point
+	# - budget: maximum total distance of the route (in the same unit as distances)
+	# - start: index of the start (and end) point of the route
+	# returns:
+	#   a tuple with the path indices and distance (same convention as solve_tsp)
+	distances = np.asarray(distances, dtype=float)
+	prizes = np.asarray(prizes, dtype=float)
+	route = [start, start]
+	length = 0.
+	candidates = np.array([idx for idx in range(len(distances))
+	                         if idx!=start and prizes[idx]>0], dtype=int)
+	while len(candidates)>0:
+	    # calculate the detour for inserting each candidate at each position
+	    a = np.array(route[:-1])
+	    b = np.array(route[1:])
+	    detours = (distances[a][:, candidates] + distances[candidates][:, b].T
+	                - distances[a, b][:, np.newaxis])
+	    positions = np.argmin(detours, axis=0)
+	    detours = detours[positions, np.arange(len(candidates))]
+	    # select the best candidate among the ones that fit in the budget
+	    fits = (length + detours <= budget)
+	    if not np.any(fits): break
+	    ratios = np.where(fits, prizes[candidates] / (np.maximum(detours, 0.) + 1e-9), -np.inf)
+	    best = np.argmax(ratios)
+	    route.insert(positions[best]+1, int(candidates[best]))
+	    candidates = np.delete(candidates, best)
+	    # shorten the route to free up budget for the next insertions
+	    (route, length) = two_opt(distances, route)
+	return (route, length)
+
+
+def two_opt(distances, route):
+	# improve a closed route using 2-opt moves (segment reversals)
+	# input arguments:
+	# - distances: square np array with distances (may be asymmetric)
+	# - route: list of indices, with the first index repeated at the end
+	# returns:
+	#   a tuple with the improved path indices and distance
+	route = np.array(route, dtype=int)
+	while len(route)>3:
+	    # forward and backward edge lengths along the route and their cumulative sums
+	    fwd = distances[route[:-1], route[1:]]
+	    bwd = distances[route[1:], route[:-1]]
+	    cfwd = np.concatenate(([0.], np.cumsum(fwd)))
+	    cbwd = np.concatenate(([0.], np.cumsum(bwd)))
+	    # change in length for reversing the segment between positions i and j
+	    i = np.arange(1, len(route)-2)[:, np.newaxis]
+	    j = np.arange(2, len(route)-1)[np.newaxis, :]
+	    i, j = np.broadcast_arrays(i, j)
+	    delta = (distances[route[i-1], route[j]] + distances[route[i], route[j+1]]
+	              - fwd[i-1] - fwd[j]
+	              + (cbwd[j]-cbwd[i]) - (cfwd[j]-cfwd[i]))
+	    delta = np.where(j>i, delta, np.inf)
+	    best = np.unravel_index(np.argmin(delta), delta.shape)
+	    if delta[best] > -1e-9: break
+	    (bi, bj) = (i[best], j[best])
+	    route[bi:bj+1] = route[bi:bj+1][::-1]
+	length = float(np.sum(distances[route[:-1], route[1:]]))
+	return ([int(idx) for idx in route], length)